@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from logger import Logger
+
+
+# Executa as etapas do pipeline respeitando dependências: cada tarefa começa assim
+# que todas as suas dependências terminam com sucesso, num pool limitado de threads.
+# Tarefas cuja dependência falhou são ignoradas (status "ignorada").
+class AgendadorEtapas:
+    def __init__(self, max_workers=None):
+        self.max_workers = int(max_workers if max_workers is not None else os.getenv("PIPELINE_WORKERS", 4))
+        if self.max_workers < 1:
+            raise ValueError("max_workers deve ser maior que zero")
+
+        self.tarefas = {}
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def adicionar(self, nome, funcao, dependencias=()):
+        if nome in self.tarefas:
+            raise ValueError(f"Tarefa duplicada no agendador: {nome}")
+        self.tarefas[nome] = (funcao, tuple(dependencias))
+
+    def _validar(self):
+        for nome, (_, dependencias) in self.tarefas.items():
+            for dep in dependencias:
+                if dep not in self.tarefas:
+                    raise ValueError(f"Tarefa {nome} depende de tarefa inexistente: {dep}")
+
+        # Detecta ciclos removendo, em rodadas, as tarefas sem dependências pendentes
+        restantes = {nome: set(deps) for nome, (_, deps) in self.tarefas.items()}
+        while restantes:
+            livres = [nome for nome, deps in restantes.items() if not deps]
+            if not livres:
+                raise ValueError(f"Dependência circular entre as tarefas: {sorted(restantes)}")
+            for nome in livres:
+                del restantes[nome]
+            for deps in restantes.values():
+                deps.difference_update(livres)
+
+    def executar(self):
+        self._validar()
+
+        status = {}
+        pendentes = list(self.tarefas)
+        em_execucao = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pendentes or em_execucao:
+                # Libera (ou ignora) tarefas até não haver mais mudança nesta rodada
+                mudou = True
+                while mudou:
+                    mudou = False
+                    for nome in list(pendentes):
+                        funcao, dependencias = self.tarefas[nome]
+                        if any(status.get(dep) in ("erro", "ignorada") for dep in dependencias):
+                            status[nome] = "ignorada"
+                            pendentes.remove(nome)
+                            self.logger.warning(f"Tarefa {nome} ignorada: dependência não concluída.")
+                            mudou = True
+                        elif all(status.get(dep) == "ok" for dep in dependencias):
+                            pendentes.remove(nome)
+                            self.logger.info(f"Iniciando tarefa {nome}.")
+                            em_execucao[executor.submit(funcao)] = nome
+
+                if not em_execucao:
+                    break
+
+                concluidas, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+                for futuro in concluidas:
+                    nome = em_execucao.pop(futuro)
+                    try:
+                        futuro.result()
+                        status[nome] = "ok"
+                        self.logger.info(f"Tarefa {nome} concluída.")
+                    except Exception as e:
+                        status[nome] = "erro"
+                        self.logger.error(f"Erro na tarefa {nome}: {e}")
+
+        return status
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from logger import Logger
+from schema import aplicar_migracoes
+
+
+# Camada única de acesso ao SQLite do pipeline: abre o banco em modo WAL com
+# pragmas ajustados, entrega uma conexão por thread (leitores concorrentes) e
+# serializa as escritas (um único escritor por vez, sem "database is locked").
+class ArmazenamentoSQLite:
+    def __init__(self, db_path=None):
+        load_dotenv()
+        self.db_path = db_path or os.getenv("DB_LITE_PATH")
+        if not self.db_path:
+            raise ValueError("Variável DB_LITE_PATH não configurada no .env")
+
+        self.mmap_mb = int(os.getenv("SQLITE_MMAP_MB", 256))
+        self.cache_mb = int(os.getenv("SQLITE_CACHE_MB", 64))
+        self.busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 30000))
+
+        self._local = threading.local()
+        self._conexoes = []
+        self._lock_conexoes = threading.Lock()
+        self._lock_escrita = threading.RLock()
+        self._schema_verificado = False
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def _abrir(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        self._verificar_schema(conn)
+        return conn
+
+    def _verificar_schema(self, conn):
+        # Migrações rodam uma vez por instância, na primeira conexão aberta
+        if self._schema_verificado:
+            return
+        with self._lock_escrita:
+            if not self._schema_verificado:
+                aplicar_migracoes(conn, self.logger)
+                self._schema_verificado = True
+
+    def conexao(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._abrir()
+            self._local.conn = conn
+            with self._lock_conexoes:
+                self._conexoes.append(conn)
+        return conn
+
+    @contextmanager
+    def transacao(self):
+        # BEGIN IMMEDIATE reserva a escrita logo no início; o lock evita que
+        # duas threads deste processo disputem o escritor do WAL
+        with self._lock_escrita:
+            conn = self.conexao()
+            profundidade = getattr(self._local, "profundidade", 0)
+            if profundidade:
+                # Chamada aninhada na mesma thread: participa da transação externa
+                self._local.profundidade = profundidade + 1
+                try:
+                    yield conn
+                finally:
+                    self._local.profundidade = profundidade
+                return
+
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.profundidade = 1
+            try:
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._local.profundidade = 0
+
+    def fechar(self):
+        with self._lock_conexoes:
+            for conn in self._conexoes:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    self.logger.warning(f"Erro ao fechar conexão SQLite: {e}")
+            self._conexoes = []
+        self._local = threading.local()
@@ -0,0 +1,77 @@
+import os
+import hashlib
+from dotenv import load_dotenv
+from logger import Logger
+
+# Sobe quando o desenho dos gráficos muda (cores, rótulos, tamanho) para invalidar o cache
+VERSAO_GRAFICOS = 1
+
+
+# Cache em disco dos gráficos do relatório, endereçado pelo conteúdo: a chave é o
+# hash das séries plotadas e dos parâmetros do gráfico, e o arquivo guarda o PNG já
+# em base64. Série igual devolve o mesmo arquivo sem consultar o matplotlib. Passando
+# do limite de tamanho, saem primeiro os arquivos usados há mais tempo (mtime).
+class CacheGraficos:
+    def __init__(self, pasta=None, limite_mb=None):
+        load_dotenv()
+        self.pasta = pasta or os.getenv("RELATORIO_CACHE_GRAFICOS") or os.path.join(os.getcwd(), "CacheGraficos")
+        limite_mb = limite_mb if limite_mb is not None else float(os.getenv("RELATORIO_CACHE_MB", "50"))
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        os.makedirs(self.pasta, exist_ok=True)
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    @staticmethod
+    def chave(tipo, series, parametros):
+        conteudo = repr((VERSAO_GRAFICOS, tipo, series, sorted(parametros.items())))
+        return hashlib.sha1(conteudo.encode("utf-8")).hexdigest()
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, f"{chave}.b64")
+
+    def obter(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, "r", encoding="ascii") as arquivo:
+                conteudo = arquivo.read()
+        except FileNotFoundError:
+            return None
+        # Marca como usado agora: a remoção por tamanho tira os mais antigos
+        os.utime(caminho)
+        return conteudo
+
+    def gravar(self, chave, imagem_base64):
+        caminho = self._caminho(chave)
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="ascii") as arquivo:
+            arquivo.write(imagem_base64)
+        os.replace(temporario, caminho)
+        self.limpar()
+
+    def limpar(self):
+        arquivos = []
+        total = 0
+        for nome in os.listdir(self.pasta):
+            if not nome.endswith(".b64"):
+                continue
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            arquivos.append((info.st_mtime, info.st_size, caminho))
+            total += info.st_size
+
+        removidos = 0
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+            removidos += 1
+        if removidos:
+            self.logger.info(f"Cache de gráficos: {removidos} arquivo(s) removido(s) por limite de tamanho.")
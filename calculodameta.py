@@ -1,12 +1,114 @@
-import sqlite3
 import os
+import hashlib
+import numpy as np
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from logger import Logger
+from armazenamento import ArmazenamentoSQLite
+from catalogo import CatalogoRede
+from indice_sku import IndiceSKU
+from meses import listar_meses, mes_anterior
+
+# Meta de valor da loja: 25% da venda de referência (gravada em metavalor)
+FATOR_META = 0.25
+
+# Faixas de bonificação, avaliadas em ordem; vale a primeira atendida.
+# fator_valor: compra mínima como fração da base (venda da loja; meta somada no grupo)
+# mix_minimo / mix_maximo: percentual de mix exigido (>=) / limite superior (<); None = sem exigência
+# pct: bonificação sobre o valor comprado
+FAIXAS_LOJA = (
+    {"fator_valor": 0.25, "mix_minimo": 50, "mix_maximo": None, "pct": 0.02,
+     "motivo": "Bateu 25% da meta de valor e 50% do mix"},
+    {"fator_valor": 0.20, "mix_minimo": 50, "mix_maximo": None, "pct": 0.015,
+     "motivo": "Bateu 20% da meta de valor e 50% do mix"},
+    {"fator_valor": 0.20, "mix_minimo": None, "mix_maximo": 50, "pct": 0.01,
+     "motivo": "Não bateu mix, mas bateu 20% da meta de valor"},
+)
+MOTIVO_LOJA_SEM_FAIXA = "Não bateu critérios de bonificação"
+
+FAIXAS_GRUPO = (
+    {"fator_valor": 1.00, "mix_minimo": 50, "mix_maximo": None, "pct": 0.02,
+     "motivo": "Grupo bateu 100% da meta de valor e 50% do mix"},
+    {"fator_valor": 0.80, "mix_minimo": 50, "mix_maximo": None, "pct": 0.015,
+     "motivo": "Grupo bateu 80% da meta de valor e 50% do mix"},
+    {"fator_valor": 0.80, "mix_minimo": None, "mix_maximo": 50, "pct": 0.01,
+     "motivo": "Grupo bateu 80% da meta de valor, mas não o mix"},
+)
+MOTIVO_GRUPO_SEM_FAIXA = "Grupo não bateu critérios de bonificação"
+
+
+def fingerprint_entradas(*entradas):
+    # Impressão digital das entradas de uma linha de resultado (valores e regras)
+    return hashlib.sha1(repr(entradas).encode("utf-8")).hexdigest()
+
+
+def faixa_atendida(valor, base, perc_mix, faixas):
+    # Primeira faixa atendida (dict) ou None
+    for faixa in faixas:
+        if valor < base * faixa["fator_valor"]:
+            continue
+        if faixa["mix_minimo"] is not None and perc_mix < faixa["mix_minimo"]:
+            continue
+        if faixa["mix_maximo"] is not None and perc_mix >= faixa["mix_maximo"]:
+            continue
+        return faixa
+    return None
+
+
+def avaliar_faixas(valor, base, perc_mix, cenarios):
+    # Versão vetorizada de faixa_atendida para vários cenários de uma vez.
+    # valor/base/perc_mix: arrays de mesmo formato (ex.: lojas × meses);
+    # cenarios: lista de tabelas de faixas (podem ter tamanhos diferentes).
+    # Devolve (indice_faixa, pct) com formato (cenários,) + formato dos dados;
+    # indice_faixa = len(tabela do cenário) quando nenhuma faixa é atendida
+    valor = np.asarray(valor, dtype=float)
+    base = np.asarray(base, dtype=float)
+    perc_mix = np.asarray(perc_mix, dtype=float)
+    qtd_cenarios = len(cenarios)
+    qtd_faixas = max((len(faixas) for faixas in cenarios), default=0)
+
+    # Faixas que faltam num cenário ficam impossíveis de atingir (fator infinito);
+    # a coluna extra de pct (zero) representa "nenhuma faixa"
+    fator = np.full((qtd_cenarios, qtd_faixas), np.inf)
+    mix_minimo = np.full((qtd_cenarios, qtd_faixas), -np.inf)
+    mix_maximo = np.full((qtd_cenarios, qtd_faixas), np.inf)
+    pct = np.zeros((qtd_cenarios, qtd_faixas + 1))
+    for c, faixas in enumerate(cenarios):
+        for k, faixa in enumerate(faixas):
+            fator[c, k] = faixa["fator_valor"]
+            if faixa["mix_minimo"] is not None:
+                mix_minimo[c, k] = faixa["mix_minimo"]
+            if faixa["mix_maximo"] is not None:
+                mix_maximo[c, k] = faixa["mix_maximo"]
+            pct[c, k] = faixa["pct"]
+
+    # Parâmetros por cenário viram (cenários, 1, 1, ...) e fazem broadcast com os dados
+    formato_cenario = (qtd_cenarios,) + (1,) * valor.ndim
+    formato = (qtd_cenarios,) + valor.shape
+    condicoes = []
+    # Fator infinito com base 0 dá NaN, que nunca passa na comparação
+    with np.errstate(invalid="ignore"):
+        for k in range(qtd_faixas):
+            condicao = (
+                (valor >= base * fator[:, k].reshape(formato_cenario))
+                & (perc_mix >= mix_minimo[:, k].reshape(formato_cenario))
+                & (perc_mix < mix_maximo[:, k].reshape(formato_cenario))
+            )
+            condicoes.append(np.broadcast_to(condicao, formato))
+    if condicoes:
+        indice = np.select(condicoes, list(range(qtd_faixas)), default=qtd_faixas)
+    else:
+        indice = np.zeros(formato, dtype=int)
+
+    # "Nenhuma faixa" de cada cenário aponta para a sua própria posição len(tabela)
+    tamanhos = np.array([len(faixas) for faixas in cenarios]).reshape(formato_cenario)
+    indice = np.minimum(indice, tamanhos)
+    linhas = np.arange(qtd_cenarios).reshape(formato_cenario)
+    return indice, pct[linhas, indice]
 
 
 class CalculoMeta:
-    def __init__(self, id_loja):
+    def __init__(self, id_loja, armazenamento=None):
         load_dotenv()
 
         self.id_loja = id_loja
@@ -17,42 +119,25 @@ class CalculoMeta:
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
     def conectar_sqlite(self):
-        self.sqlite_conn = sqlite3.connect(self.db_path)
+        self.sqlite_conn = self.armazenamento.conexao()
         self.sqlite_cursor = self.sqlite_conn.cursor()
         self.logger.info(f"Conexão SQLite aberta para loja {self.id_loja}.")
-        self.criar_tabela_resultado_meta()  # Garante tabela criada ao abrir conexão
 
     def fechar_sqlite(self):
         if self.sqlite_cursor:
             self.sqlite_cursor.close()
-        if self.sqlite_conn:
-            self.sqlite_conn.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info(f"Conexão SQLite fechada para loja {self.id_loja}.")
 
-    def criar_tabela_resultado_meta(self):
-        self.sqlite_cursor.execute("""
-            CREATE TABLE IF NOT EXISTS resultado_meta_por_mes (
-                id_loja INTEGER,
-                mes_referencia TEXT,
-                data_ultima_consulta TEXT,
-                metavalor REAL,
-                metavalorbatido REAL,
-                percentual_metavalor REAL,
-                skumetamix INTEGER,
-                skumetamixcomprado INTEGER,
-                percentual_metamix REAL,
-                bonificacao_pct REAL,
-                valor_bonificacao REAL,
-                motivo TEXT,
-                PRIMARY KEY (id_loja, mes_referencia)
-            )
-        """)
-        self.sqlite_conn.commit()
-
     # Nova função para calcular mês com subtração de meses, cuidando ano/mês
     def obter_mes_antes(self, mes_referencia, meses_antes=1):
         ano, mes = map(int, mes_referencia.split('-'))
@@ -106,78 +191,71 @@ class CalculoMeta:
             return 0.0
 
     def buscar_total_skus_catalogo(self, mes_referencia):
-        self.sqlite_cursor.execute("""
-            SELECT COUNT(DISTINCT codigoexterno)
-              FROM produtosrede_historico
-             WHERE mes_referencia = ?
-        """, (mes_referencia,))
-        row = self.sqlite_cursor.fetchone()
-        total = int(row[0]) if row and row[0] else 0
+        total = CatalogoRede(self.armazenamento).total_skus(mes_referencia)
         self.logger.info(f"Loja {self.id_loja} - Total SKUs catálogo em {mes_referencia}: {total}")
         return total
 
     def buscar_total_skus_comprados(self, mes_referencia):
-        self.sqlite_cursor.execute("""
-            SELECT COUNT(DISTINCT codigoexterno)
-              FROM produtoscomprados
-             WHERE mes_referencia = ?
-               AND id_loja = ?
-        """, (mes_referencia, self.id_loja))
-        row = self.sqlite_cursor.fetchone()
-        total = int(row[0]) if row and row[0] else 0
+        # Só conta SKUs que estão no catálogo do mês (interseção dos bitsets)
+        indice = IndiceSKU(self.armazenamento)
+        total = indice.mix_periodo(self.id_loja, mes_referencia)["total_comprado"]
         self.logger.info(f"Loja {self.id_loja} - Total SKUs comprados em {mes_referencia}: {total}")
         return total
 
+    def buscar_mix_calculado(self, mes_referencia):
+        # Reaproveita o resumo do ComparadorMixProdutos (mix_por_mes) quando já existe
+        self.sqlite_cursor.execute("""
+            SELECT total_ofertado, total_comprado
+              FROM mix_por_mes
+             WHERE id_loja = ? AND mes_referencia = ?
+        """, (self.id_loja, mes_referencia))
+        row = self.sqlite_cursor.fetchone()
+        if not row:
+            return None
+        self.logger.info(f"Loja {self.id_loja} - Mix de {mes_referencia} lido de mix_por_mes: {row[1]}/{row[0]}")
+        return int(row[0]), int(row[1])
+
     def salvar_resultado_meta(self, mes_referencia, meta_25, valor_compra, perc_valor,
                               total_catalogo, total_comprados, perc_mix,
                               bonificacao_pct, valor_bonificacao, motivo):
         data_hoje = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        self.sqlite_cursor.execute("""
-            INSERT OR REPLACE INTO resultado_meta_por_mes (
-                id_loja, mes_referencia, data_ultima_consulta,
-                metavalor, metavalorbatido, percentual_metavalor,
-                skumetamix, skumetamixcomprado, percentual_metamix,
+        with self.armazenamento.transacao():
+            self.sqlite_cursor.execute("""
+                INSERT OR REPLACE INTO resultado_meta_por_mes (
+                    id_loja, mes_referencia, data_ultima_consulta,
+                    metavalor, metavalorbatido, percentual_metavalor,
+                    skumetamix, skumetamixcomprado, percentual_metamix,
+                    bonificacao_pct, valor_bonificacao, motivo
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                self.id_loja, mes_referencia, data_hoje,
+                meta_25, valor_compra, perc_valor,
+                total_catalogo, total_comprados, perc_mix,
                 bonificacao_pct, valor_bonificacao, motivo
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            self.id_loja, mes_referencia, data_hoje,
-            meta_25, valor_compra, perc_valor,
-            total_catalogo, total_comprados, perc_mix,
-            bonificacao_pct, valor_bonificacao, motivo
-        ))
+            ))
 
-        self.sqlite_conn.commit()
         self.logger.info(f"Loja {self.id_loja} - Resultado salvo em resultado_meta_por_mes.")
 
     def calcular_bonificacao_loja(self, mes_referencia):
         venda_mes_anterior = self.buscar_vendas_mes_anterior(mes_referencia)
         valor_compra = self.buscar_compras_mes(mes_referencia)
 
-        meta_25 = venda_mes_anterior * 0.25
-        meta_20 = venda_mes_anterior * 0.20
+        meta_25 = venda_mes_anterior * FATOR_META
 
-        total_catalogo = self.buscar_total_skus_catalogo(mes_referencia)
-        total_comprados = self.buscar_total_skus_comprados(mes_referencia)
+        mix = self.buscar_mix_calculado(mes_referencia)
+        if mix:
+            total_catalogo, total_comprados = mix
+        else:
+            total_catalogo = self.buscar_total_skus_catalogo(mes_referencia)
+            total_comprados = self.buscar_total_skus_comprados(mes_referencia)
 
         perc_mix = (total_comprados / total_catalogo) * 100 if total_catalogo else 0.0
         perc_valor = (valor_compra / meta_25) * 100 if meta_25 else 0.0
 
-        bonificacao_pct = 0.0
-        motivo = ""
-
-        if valor_compra >= meta_25 and perc_mix >= 50:
-            bonificacao_pct = 0.02
-            motivo = "Bateu 25% da meta de valor e 50% do mix"
-        elif valor_compra >= meta_20 and perc_mix >= 50:
-            bonificacao_pct = 0.015
-            motivo = "Bateu 20% da meta de valor e 50% do mix"
-        elif valor_compra >= meta_20 and perc_mix < 50:
-            bonificacao_pct = 0.01
-            motivo = "Não bateu mix, mas bateu 20% da meta de valor"
-        else:
-            bonificacao_pct = 0.0
-            motivo = "Não bateu critérios de bonificação"
+        faixa = faixa_atendida(valor_compra, venda_mes_anterior, perc_mix, FAIXAS_LOJA)
+        bonificacao_pct = faixa["pct"] if faixa else 0.0
+        motivo = faixa["motivo"] if faixa else MOTIVO_LOJA_SEM_FAIXA
 
         valor_bonificacao = valor_compra * bonificacao_pct
 
@@ -194,36 +272,19 @@ class CalculoMeta:
         )
 
     @staticmethod
-    def calcular_bonificacao_grupo(mes_referencia):
+    def calcular_bonificacao_grupo(mes_referencia, armazenamento=None):
         load_dotenv()
         db_path = os.getenv("DB_LITE_PATH")
 
         logger_config = Logger()
         logger = logger_config.get_logger("CalculoMeta_GRUPO")
 
-        conn = sqlite3.connect(db_path)
+        armazenamento_proprio = armazenamento is None
+        if armazenamento_proprio:
+            armazenamento = ArmazenamentoSQLite(db_path)
+        conn = armazenamento.conexao()
         cursor = conn.cursor()
 
-        # Garante que a tabela existe
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS resultado_meta_por_mes (
-                id_loja INTEGER,
-                mes_referencia TEXT,
-                data_ultima_consulta TEXT,
-                metavalor REAL,
-                metavalorbatido REAL,
-                percentual_metavalor REAL,
-                skumetamix INTEGER,
-                skumetamixcomprado INTEGER,
-                percentual_metamix REAL,
-                bonificacao_pct REAL,
-                valor_bonificacao REAL,
-                motivo TEXT,
-                PRIMARY KEY (id_loja, mes_referencia)
-            )
-        """)
-        conn.commit()
-
         # Soma dados das lojas
         cursor.execute("""
             SELECT 
@@ -243,23 +304,10 @@ class CalculoMeta:
             perc_valor = (total_comprado / total_meta) * 100 if total_meta else 0.0
             perc_mix = (total_skus_comprados / total_skus_catalogo) * 100 if total_skus_catalogo else 0.0
 
-            # Define bonificação do grupo
-            bonificacao_pct = 0.0
-            motivo = ""
-
             # Regras de bonificação GRUPO
-            if total_comprado >= total_meta and perc_mix >= 50:
-                bonificacao_pct = 0.02
-                motivo = "Grupo bateu 100% da meta de valor e 50% do mix"
-            elif total_comprado >= (total_meta * 0.80) and perc_mix >= 50:
-                bonificacao_pct = 0.015
-                motivo = "Grupo bateu 80% da meta de valor e 50% do mix"
-            elif total_comprado >= (total_meta * 0.80) and perc_mix < 50:
-                bonificacao_pct = 0.01
-                motivo = "Grupo bateu 80% da meta de valor, mas não o mix"
-            else:
-                bonificacao_pct = 0.0
-                motivo = "Grupo não bateu critérios de bonificação"
+            faixa = faixa_atendida(total_comprado, total_meta, perc_mix, FAIXAS_GRUPO)
+            bonificacao_pct = faixa["pct"] if faixa else 0.0
+            motivo = faixa["motivo"] if faixa else MOTIVO_GRUPO_SEM_FAIXA
 
             # Soma bonificações das lojas
             cursor.execute("""
@@ -274,21 +322,20 @@ class CalculoMeta:
             # Insere ou atualiza linha do grupo (id_loja = 0)
             data_hoje = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            cursor.execute("""
-                INSERT OR REPLACE INTO resultado_meta_por_mes (
-                    id_loja, mes_referencia, data_ultima_consulta,
-                    metavalor, metavalorbatido, percentual_metavalor,
-                    skumetamix, skumetamixcomprado, percentual_metamix,
-                    bonificacao_pct, valor_bonificacao, motivo
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                0, mes_referencia, data_hoje,
-                total_meta, total_comprado, perc_valor,
-                total_skus_catalogo, total_skus_comprados, perc_mix,
-                bonificacao_pct, valor_bonificacao_total, motivo
-            ))
-
-            conn.commit()
+            with armazenamento.transacao():
+                cursor.execute("""
+                    INSERT OR REPLACE INTO resultado_meta_por_mes (
+                        id_loja, mes_referencia, data_ultima_consulta,
+                        metavalor, metavalorbatido, percentual_metavalor,
+                        skumetamix, skumetamixcomprado, percentual_metamix,
+                        bonificacao_pct, valor_bonificacao, motivo
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    0, mes_referencia, data_hoje,
+                    total_meta, total_comprado, perc_valor,
+                    total_skus_catalogo, total_skus_comprados, perc_mix,
+                    bonificacao_pct, valor_bonificacao_total, motivo
+                ))
 
             logger.info(f"[Grupo] Totais salvos para {mes_referencia} como id_loja = 0.")
             logger.info(f"[Grupo] Valor Comprado: R$ {total_comprado:,.2f}")
@@ -303,42 +350,303 @@ class CalculoMeta:
         else:
             logger.warning(f"[Grupo] Nenhum dado consolidado encontrado para {mes_referencia}.")
 
-        conn.close()
+        cursor.close()
+        if armazenamento_proprio:
+            armazenamento.fechar()
 
     def processar(self, mes_referencia):
         try:
             self.conectar_sqlite()
             if self.id_loja == 0:
-                self.calcular_bonificacao_grupo(mes_referencia)
+                self.calcular_bonificacao_grupo(mes_referencia, self.armazenamento)
             else:
                 self.calcular_bonificacao_loja(mes_referencia)
         except Exception as e:
             self.logger.error(f"Erro no processamento da loja {self.id_loja}: {e}")
+            raise
         finally:
             self.fechar_sqlite()
 
 
-if __name__ == "__main__":
-    data_inicio = datetime(2024, 6, 1)
-    agora = datetime.now()
+# Motor em lote: carrega vendas, compras e mix de todas as lojas e meses do intervalo
+# em matrizes (lojas × meses), aplica as faixas de bonificação vetorizadas e grava
+# todas as linhas de resultado_meta_por_mes (inclusive o grupo, id_loja = 0) de uma vez.
+class CalculoMetaLote:
+    def __init__(self, lojas, mes_inicio, mes_fim=None, armazenamento=None,
+                 faixas_loja=FAIXAS_LOJA, faixas_grupo=FAIXAS_GRUPO):
+        load_dotenv()
+        # Linhas das lojas informadas são recalculadas; o grupo (id_loja = 0) soma essas
+        # lojas e as linhas já gravadas das demais, como calcular_bonificacao_grupo
+        self.lojas = [int(loja) for loja in lojas]
+        if not self.lojas:
+            raise ValueError("Informe ao menos uma loja")
+
+        self.faixas_loja = faixas_loja
+        self.faixas_grupo = faixas_grupo
+
+        self.mes_inicio = mes_inicio
+        self.mes_fim = mes_fim or mes_inicio
+        self.meses = listar_meses(self.mes_inicio, self.mes_fim)
+        # Janeiro usa a venda de dois meses antes (novembro); os demais, do mês anterior
+        self.meses_venda = [
+            mes_anterior(mes, 2 if mes.endswith("-01") else 1) for mes in self.meses
+        ]
 
-    ano = data_inicio.year
-    mes = data_inicio.month
+        self.db_path = os.getenv("DB_LITE_PATH")
+        if not self.db_path:
+            raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
-    while (ano < agora.year) or (ano == agora.year and mes <= agora.month):
-        mes_referencia = f"{ano:04d}-{mes:02d}"
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
 
-        # Calcula grupo primeiro
-        calc_grupo = CalculoMeta(id_loja=0)
-        calc_grupo.processar(mes_referencia)
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def _matriz(self, valores, meses):
+        # valores: {(id_loja, mes): valor}; ausência vale 0
+        return np.array(
+            [[valores.get((loja, mes), 0) for mes in meses] for loja in self.lojas],
+            dtype=float
+        )
+
+    def carregar_dados(self):
+        conn = self.armazenamento.conexao()
+        placeholders = ','.join('?' for _ in self.lojas)
 
-        # Depois calcula as lojas individualmente
-        for loja in [1, 2, 3]:
-            calc = CalculoMeta(id_loja=loja)
-            calc.processar(mes_referencia)
+        vendas = conn.execute(f"""
+            SELECT id_loja, mes_referencia, valor_venda
+              FROM vendas_por_mes
+             WHERE mes_referencia BETWEEN ? AND ?
+               AND id_loja IN ({placeholders})
+        """, (min(self.meses_venda), self.mes_fim, *self.lojas)).fetchall()
+        compras = conn.execute(f"""
+            SELECT id_loja, mes_referencia, valor_total
+              FROM compras_valor_por_mes
+             WHERE mes_referencia BETWEEN ? AND ?
+               AND id_loja IN ({placeholders})
+        """, (self.mes_inicio, self.mes_fim, *self.lojas)).fetchall()
+        mix = {
+            (id_loja, mes): (ofertado, comprado)
+            for id_loja, mes, ofertado, comprado in conn.execute(f"""
+                SELECT id_loja, mes_referencia, total_ofertado, total_comprado
+                  FROM mix_por_mes
+                 WHERE mes_referencia BETWEEN ? AND ?
+                   AND id_loja IN ({placeholders})
+            """, (self.mes_inicio, self.mes_fim, *self.lojas)).fetchall()
+        }
+
+        # Loja/mês ainda sem resumo de mix: calcula pelos bitsets do intervalo inteiro
+        if any((loja, mes) not in mix for loja in self.lojas for mes in self.meses):
+            indice = IndiceSKU(self.armazenamento)
+            for chave, valores in indice.mix_por_loja_mes(self.mes_inicio, self.mes_fim, self.lojas).items():
+                if chave[0] != 0:
+                    mix.setdefault(chave, (valores["total_ofertado"], valores["total_comprado"]))
+
+        venda = {(id_loja, mes): valor or 0.0 for id_loja, mes, valor in vendas}
+        return {
+            "venda": self._matriz(venda, self.meses_venda),
+            "compra": self._matriz({(l, m): v or 0.0 for l, m, v in compras}, self.meses),
+            "skus_catalogo": self._matriz({k: v[0] or 0 for k, v in mix.items()}, self.meses),
+            "skus_comprados": self._matriz({k: v[1] or 0 for k, v in mix.items()}, self.meses),
+        }
+
+    def carregar_outras_lojas(self):
+        # Totais por mês das linhas já gravadas de lojas fora desta execução, para o
+        # grupo continuar sendo a soma de todas as lojas da tabela em execuções parciais
+        placeholders = ','.join('?' for _ in self.lojas)
+        linhas = self.armazenamento.conexao().execute(f"""
+            SELECT id_loja, mes_referencia, metavalor, metavalorbatido,
+                   skumetamix, skumetamixcomprado, valor_bonificacao, fingerprint
+              FROM resultado_meta_por_mes
+             WHERE mes_referencia BETWEEN ? AND ?
+               AND id_loja NOT IN (0, {placeholders})
+             ORDER BY mes_referencia, id_loja
+        """, (self.mes_inicio, self.mes_fim, *self.lojas)).fetchall()
+
+        colunas = ("metavalor", "metavalorbatido", "skumetamix", "skumetamixcomprado", "valor_bonificacao")
+        totais = {coluna: np.zeros(len(self.meses)) for coluna in colunas}
+        # {mes: {id_loja: fingerprint}} para a impressão digital do grupo; linha antiga,
+        # sem fingerprint, entra pelos próprios valores
+        totais["fingerprints"] = {mes: {} for mes in self.meses}
+        posicao = {mes: j for j, mes in enumerate(self.meses)}
+        for id_loja, mes, *valores, fingerprint in linhas:
+            for coluna, valor in zip(colunas, valores):
+                totais[coluna][posicao[mes]] += valor or 0
+            totais["fingerprints"][mes][id_loja] = fingerprint or fingerprint_entradas(*valores)
+        return totais
+
+    @staticmethod
+    def _percentual(parte, total):
+        return np.divide(parte * 100, total, out=np.zeros_like(parte, dtype=float), where=total != 0)
+
+    def calcular(self, dados, outras_lojas=None):
+        venda = dados["venda"]
+        compra = dados["compra"]
+        skus_catalogo = dados["skus_catalogo"]
+        skus_comprados = dados["skus_comprados"]
+
+        # Lojas
+        meta_25 = venda * FATOR_META
+        perc_mix = self._percentual(skus_comprados, skus_catalogo)
+        perc_valor = self._percentual(compra, meta_25)
+        faixa, bonificacao_pct = avaliar_faixas(compra, venda, perc_mix, [self.faixas_loja])
+        faixa, bonificacao_pct = faixa[0], bonificacao_pct[0]
+        valor_bonificacao = compra * bonificacao_pct
+
+        # Grupo: soma das lojas por mês (mais as linhas gravadas das lojas de fora)
+        total_meta = meta_25.sum(axis=0)
+        total_comprado = compra.sum(axis=0)
+        total_catalogo = skus_catalogo.sum(axis=0)
+        total_skus_comprados = skus_comprados.sum(axis=0)
+        total_bonificacao = valor_bonificacao.sum(axis=0)
+        if outras_lojas is not None:
+            total_meta = total_meta + outras_lojas["metavalor"]
+            total_comprado = total_comprado + outras_lojas["metavalorbatido"]
+            total_catalogo = total_catalogo + outras_lojas["skumetamix"]
+            total_skus_comprados = total_skus_comprados + outras_lojas["skumetamixcomprado"]
+            total_bonificacao = total_bonificacao + outras_lojas["valor_bonificacao"]
+        perc_valor_grupo = self._percentual(total_comprado, total_meta)
+        perc_mix_grupo = self._percentual(total_skus_comprados, total_catalogo)
+        faixa_grupo, pct_grupo = avaliar_faixas(total_comprado, total_meta, perc_mix_grupo, [self.faixas_grupo])
+
+        return {
+            "lojas": {
+                "metavalor": meta_25,
+                "metavalorbatido": compra,
+                "percentual_metavalor": perc_valor,
+                "skumetamix": skus_catalogo,
+                "skumetamixcomprado": skus_comprados,
+                "percentual_metamix": perc_mix,
+                "bonificacao_pct": bonificacao_pct,
+                "valor_bonificacao": valor_bonificacao,
+                "faixa": faixa,
+            },
+            "grupo": {
+                "metavalor": total_meta,
+                "metavalorbatido": total_comprado,
+                "percentual_metavalor": perc_valor_grupo,
+                "skumetamix": total_catalogo,
+                "skumetamixcomprado": total_skus_comprados,
+                "percentual_metamix": perc_mix_grupo,
+                "bonificacao_pct": pct_grupo[0],
+                # Valor do grupo é o somatório das bonificações das lojas
+                "valor_bonificacao": total_bonificacao,
+                "faixa": faixa_grupo[0],
+            },
+        }
 
-        # Incrementa mês
-        mes += 1
-        if mes > 12:
-            mes = 1
-            ano += 1
\ No newline at end of file
+    @staticmethod
+    def _motivo(faixas, indice, sem_faixa):
+        return faixas[indice]["motivo"] if indice < len(faixas) else sem_faixa
+
+    def calcular_fingerprints(self, dados, outras_lojas=None):
+        # Loja: venda de referência, valor comprado, SKUs do catálogo e comprados, mais as
+        # regras. Grupo: fingerprints de todas as lojas do mês (as de fora da execução vêm
+        # do que está gravado), então só muda se alguma loja mudar
+        entradas = {chave: valores.tolist() for chave, valores in dados.items()}
+        regras_loja = (FATOR_META, self.faixas_loja)
+        lojas = {}
+        grupo = {}
+        for j, mes in enumerate(self.meses):
+            for i, id_loja in enumerate(self.lojas):
+                lojas[(id_loja, mes)] = fingerprint_entradas(
+                    entradas["venda"][i][j], entradas["compra"][i][j],
+                    entradas["skus_catalogo"][i][j], entradas["skus_comprados"][i][j],
+                    regras_loja
+                )
+            por_loja = dict(outras_lojas["fingerprints"][mes]) if outras_lojas is not None else {}
+            por_loja.update((id_loja, lojas[(id_loja, mes)]) for id_loja in self.lojas)
+            grupo[(0, mes)] = fingerprint_entradas(
+                tuple(fingerprint for _, fingerprint in sorted(por_loja.items())), self.faixas_grupo
+            )
+        return lojas, grupo
+
+    def carregar_fingerprints(self):
+        placeholders = ','.join('?' for _ in self.lojas)
+        cursor = self.armazenamento.conexao().execute(f"""
+            SELECT id_loja, mes_referencia, fingerprint
+              FROM resultado_meta_por_mes
+             WHERE mes_referencia BETWEEN ? AND ?
+               AND id_loja IN (0, {placeholders})
+        """, (self.mes_inicio, self.mes_fim, *self.lojas))
+        return {(id_loja, mes): fingerprint for id_loja, mes, fingerprint in cursor.fetchall()}
+
+    def montar_registros(self, resultado, fingerprints, gravados=None):
+        # gravados: fingerprints já salvos; linhas com a mesma impressão digital ficam de fora
+        gravados = gravados or {}
+        fp_lojas, fp_grupo = fingerprints
+        data_hoje = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        lojas = {chave: valores.tolist() for chave, valores in resultado["lojas"].items()}
+        grupo = {chave: valores.tolist() for chave, valores in resultado["grupo"].items()}
+
+        registros = []
+        for j, mes in enumerate(self.meses):
+            for i, id_loja in enumerate(self.lojas):
+                fingerprint = fp_lojas[(id_loja, mes)]
+                if gravados.get((id_loja, mes)) == fingerprint:
+                    continue
+                registros.append((
+                    id_loja, mes, data_hoje,
+                    lojas["metavalor"][i][j], lojas["metavalorbatido"][i][j], lojas["percentual_metavalor"][i][j],
+                    int(lojas["skumetamix"][i][j]), int(lojas["skumetamixcomprado"][i][j]), lojas["percentual_metamix"][i][j],
+                    lojas["bonificacao_pct"][i][j], lojas["valor_bonificacao"][i][j],
+                    self._motivo(self.faixas_loja, lojas["faixa"][i][j], MOTIVO_LOJA_SEM_FAIXA),
+                    fingerprint
+                ))
+            # Nenhuma loja do mês mudou => fingerprint do grupo igual => consolidado não é regravado
+            fingerprint = fp_grupo[(0, mes)]
+            if gravados.get((0, mes)) == fingerprint:
+                continue
+            registros.append((
+                0, mes, data_hoje,
+                grupo["metavalor"][j], grupo["metavalorbatido"][j], grupo["percentual_metavalor"][j],
+                int(grupo["skumetamix"][j]), int(grupo["skumetamixcomprado"][j]), grupo["percentual_metamix"][j],
+                grupo["bonificacao_pct"][j], grupo["valor_bonificacao"][j],
+                self._motivo(self.faixas_grupo, grupo["faixa"][j], MOTIVO_GRUPO_SEM_FAIXA),
+                fingerprint
+            ))
+        return registros
+
+    def salvar(self, registros):
+        if not registros:
+            return
+        with self.armazenamento.transacao() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO resultado_meta_por_mes (
+                    id_loja, mes_referencia, data_ultima_consulta,
+                    metavalor, metavalorbatido, percentual_metavalor,
+                    skumetamix, skumetamixcomprado, percentual_metamix,
+                    bonificacao_pct, valor_bonificacao, motivo, fingerprint
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, registros)
+
+    def processar(self, forcar=False):
+        # Devolve a lista (id_loja, mes) das linhas regravadas; vazia quando nada mudou.
+        # O cálculo vetorizado é barato; o que se evita são as escritas (e o que depende delas)
+        try:
+            dados = self.carregar_dados()
+            outras_lojas = self.carregar_outras_lojas()
+            resultado = self.calcular(dados, outras_lojas)
+            gravados = {} if forcar else self.carregar_fingerprints()
+            registros = self.montar_registros(
+                resultado, self.calcular_fingerprints(dados, outras_lojas), gravados
+            )
+            self.salvar(registros)
+
+            total = len(self.meses) * (len(self.lojas) + 1)
+            self.logger.info(
+                f"Metas calculadas para lojas {self.lojas} de {self.mes_inicio} a {self.mes_fim}: "
+                f"{len(registros)} de {total} registros alterados em resultado_meta_por_mes."
+            )
+            return [(registro[0], registro[1]) for registro in registros]
+        finally:
+            if self._armazenamento_proprio:
+                self.armazenamento.fechar()
+
+
+if __name__ == "__main__":
+    # Recalcula todo o histórico (lojas e grupo) numa única passada
+    inicio = "2024-06"
+    fim = datetime.now().strftime("%Y-%m")
+    CalculoMetaLote(lojas=[1, 2, 3], mes_inicio=inicio, mes_fim=fim).processar()
@@ -0,0 +1,127 @@
+from logger import Logger
+from indice_sku import gravar_bitset_catalogo
+
+
+# Catálogo da rede versionado: cada SKU tem linhas [valido_de, valido_ate] sobre os
+# meses coletados (vizinhos na ordem de coleta, não no calendário), então o espaço
+# cresce com a rotatividade do catálogo e não com meses × SKUs. O total de SKUs de
+# cada mês coletado fica pronto em catalogo_rede_contagem.
+class CatalogoRede:
+    def __init__(self, armazenamento):
+        self.armazenamento = armazenamento
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def meses_coletados(self):
+        cursor = self.armazenamento.conexao().execute("""
+            SELECT mes_referencia FROM catalogo_rede_contagem ORDER BY mes_referencia
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+    def total_skus(self, mes_referencia):
+        row = self.armazenamento.conexao().execute("""
+            SELECT total_skus FROM catalogo_rede_contagem WHERE mes_referencia = ?
+        """, (mes_referencia,)).fetchone()
+        return int(row[0]) if row and row[0] else 0
+
+    def total_skus_geral(self):
+        # SKUs distintos que já estiveram no catálogo em algum mês
+        row = self.armazenamento.conexao().execute("""
+            SELECT COUNT(DISTINCT codigoexterno) FROM catalogo_rede
+        """).fetchone()
+        return int(row[0]) if row and row[0] else 0
+
+    def codigos_do_mes(self, mes_referencia):
+        cursor = self.armazenamento.conexao().execute("""
+            SELECT codigoexterno FROM produtosrede_historico WHERE mes_referencia = ?
+        """, (mes_referencia,))
+        return {row[0] for row in cursor.fetchall()}
+
+    def gravar_mes(self, mes_referencia, produtos, data_coleta, substituir=False):
+        # produtos: {codigo: descricao} coletados no mês. Por padrão soma ao que o mês já
+        # tinha (como o INSERT OR IGNORE original): coleta parcial não tira SKUs do mês.
+        # substituir=True troca o catálogo do mês inteiro pela lista recebida.
+        # Devolve (inseridos, atualizados) em relação ao que o mês já tinha
+        with self.armazenamento.transacao() as conn:
+            cursor = conn.cursor()
+
+            ja_coletado = cursor.execute("""
+                SELECT 1 FROM catalogo_rede_contagem WHERE mes_referencia = ?
+            """, (mes_referencia,)).fetchone() is not None
+            anterior = cursor.execute("""
+                SELECT MAX(mes_referencia) FROM catalogo_rede_contagem WHERE mes_referencia < ?
+            """, (mes_referencia,)).fetchone()[0]
+            seguinte = cursor.execute("""
+                SELECT MIN(mes_referencia) FROM catalogo_rede_contagem WHERE mes_referencia > ?
+            """, (mes_referencia,)).fetchone()[0]
+
+            # Retira o mês dos intervalos que passam por ele, mantendo os pedaços antes e depois
+            cobrem = cursor.execute("""
+                SELECT codigoexterno, valido_de, valido_ate, descricao FROM catalogo_rede
+                WHERE valido_de <= ? AND valido_ate >= ?
+            """, (mes_referencia, mes_referencia)).fetchall()
+            existentes = {row[0] for row in cobrem} if ja_coletado else set()
+            recebidos = produtos
+            if ja_coletado and not substituir:
+                # Descrição nova prevalece; SKUs que não vieram nesta coleta continuam no mês
+                produtos = {**{row[0]: row[3] for row in cobrem}, **produtos}
+
+            pedacos = []
+            for codigo, valido_de, valido_ate, descricao in cobrem:
+                if valido_de < mes_referencia:
+                    pedacos.append((codigo, valido_de, anterior, descricao))
+                if valido_ate > mes_referencia:
+                    pedacos.append((codigo, seguinte, valido_ate, descricao))
+            cursor.executemany("""
+                DELETE FROM catalogo_rede WHERE codigoexterno = ? AND valido_de = ?
+            """, [(row[0], row[1]) for row in cobrem])
+            cursor.executemany("""
+                INSERT INTO catalogo_rede (codigoexterno, valido_de, valido_ate, descricao)
+                VALUES (?, ?, ?, ?)
+            """, pedacos)
+
+            # Emenda cada produto aos intervalos vizinhos com a mesma descrição
+            esquerda = {}
+            if anterior:
+                cursor.execute("""
+                    SELECT codigoexterno, valido_de, descricao FROM catalogo_rede WHERE valido_ate = ?
+                """, (anterior,))
+                esquerda = {codigo: (valido_de, descricao) for codigo, valido_de, descricao in cursor.fetchall()}
+            direita = {}
+            if seguinte:
+                cursor.execute("""
+                    SELECT codigoexterno, valido_ate, descricao FROM catalogo_rede WHERE valido_de = ?
+                """, (seguinte,))
+                direita = {codigo: (valido_ate, descricao) for codigo, valido_ate, descricao in cursor.fetchall()}
+
+            remover = []
+            novos = []
+            for codigo, descricao in produtos.items():
+                valido_de = valido_ate = mes_referencia
+                vizinho = esquerda.get(codigo)
+                if vizinho and vizinho[1] == descricao:
+                    valido_de = vizinho[0]
+                    remover.append((codigo, vizinho[0]))
+                vizinho = direita.get(codigo)
+                if vizinho and vizinho[1] == descricao:
+                    valido_ate = vizinho[0]
+                    remover.append((codigo, seguinte))
+                novos.append((codigo, valido_de, valido_ate, descricao))
+
+            cursor.executemany("""
+                DELETE FROM catalogo_rede WHERE codigoexterno = ? AND valido_de = ?
+            """, remover)
+            cursor.executemany("""
+                INSERT INTO catalogo_rede (codigoexterno, valido_de, valido_ate, descricao)
+                VALUES (?, ?, ?, ?)
+            """, novos)
+            cursor.execute("""
+                INSERT OR REPLACE INTO catalogo_rede_contagem (mes_referencia, total_skus, data_coleta)
+                VALUES (?, ?, ?)
+            """, (mes_referencia, len(produtos), data_coleta))
+            gravar_bitset_catalogo(cursor, mes_referencia, produtos.keys())
+            cursor.close()
+
+        atualizados = len(recebidos.keys() & existentes)
+        return len(recebidos) - atualizados, atualizados
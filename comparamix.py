@@ -1,10 +1,13 @@
-import sqlite3
 from dotenv import load_dotenv
+from datetime import datetime
 import os
 from logger import Logger  # importa o módulo de logging centralizado
+from armazenamento import ArmazenamentoSQLite
+from catalogo import CatalogoRede
+from indice_sku import IndiceSKU
 
 class ComparadorMixProdutos:
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, armazenamento=None):
         load_dotenv()
         if db_path is None:
             db_path = os.getenv("DB_LITE_PATH")
@@ -12,69 +15,78 @@ class ComparadorMixProdutos:
             raise ValueError("Variável DB_LITE_PATH não encontrada no ambiente")
         self.db_path = db_path
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
 
         # Inicializa o logger configurado e obtém logger com nome da classe
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
     def calcular_percentual_comprados(self, mes_referencia=None, id_loja=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
+        # Mix = SKUs comprados que estão no catálogo / SKUs do catálogo, lido dos bitsets
+        # gravados junto com as compras e o catálogo. Sem mês, acumula todos os meses
+        # em que o catálogo foi coletado
+        indice = IndiceSKU(self.armazenamento)
         if mes_referencia:
-            cursor.execute("""
-                SELECT COUNT(DISTINCT codigoexterno) 
-                FROM produtosrede_historico 
-                WHERE mes_referencia = ?
-            """, (mes_referencia,))
-            total_ofertado = cursor.fetchone()[0]
+            meses = [mes_referencia]
         else:
-            cursor.execute("SELECT COUNT(DISTINCT codigoexterno) FROM produtosrede_historico")
-            total_ofertado = cursor.fetchone()[0]
-
-        if mes_referencia and id_loja:
-            cursor.execute("""
-                SELECT COUNT(DISTINCT codigoexterno) 
-                FROM produtoscomprados 
-                WHERE mes_referencia = ? AND id_loja = ?
-            """, (mes_referencia, id_loja))
-            total_comprado = cursor.fetchone()[0]
-        elif mes_referencia:
-            cursor.execute("""
-                SELECT COUNT(DISTINCT codigoexterno) 
-                FROM produtoscomprados 
-                WHERE mes_referencia = ?
-            """, (mes_referencia,))
-            total_comprado = cursor.fetchone()[0]
-        elif id_loja:
-            cursor.execute("""
-                SELECT COUNT(DISTINCT codigoexterno) 
-                FROM produtoscomprados 
-                WHERE id_loja = ?
-            """, (id_loja,))
-            total_comprado = cursor.fetchone()[0]
+            meses = CatalogoRede(self.armazenamento).meses_coletados()
+
+        if meses:
+            resultado = indice.mix_periodo(id_loja, meses[0], meses[-1])
         else:
-            cursor.execute("SELECT COUNT(DISTINCT codigoexterno) FROM produtoscomprados")
-            total_comprado = cursor.fetchone()[0]
+            resultado = indice.calcular_mix(0, 0)
+
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
+
+        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Total ofertado: {resultado['total_ofertado']}")
+        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Total comprado: {resultado['total_comprado']}")
+        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Fora do catálogo: {resultado['total_fora_catalogo']}")
+        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Percentual comprado: {resultado['percentual_comprado']:.2f}%")
+
+        return resultado
+
+    def calcular_mix_lote(self, mes_inicio, mes_fim=None, lojas=()):
+        # Todas as lojas e meses de uma vez: os bitsets gravados do intervalo são
+        # carregados e o mix sai de AND/popcount. O resultado vai para mix_por_mes
+        # (id_loja = 0 é o total geral, a união das compras de todas as lojas).
+        # Devolve {(id_loja, mes): {"total_ofertado", "total_comprado", "total_fora_catalogo", "percentual_comprado"}}
+        mes_fim = mes_fim or mes_inicio
+        lojas = [int(loja) for loja in lojas]
+
+        indice = IndiceSKU(self.armazenamento)
+        resultado = indice.mix_por_loja_mes(mes_inicio, mes_fim, lojas)
 
-        conn.close()
+        data_calculo = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        registros = []
+        for (id_loja, mes), mix in resultado.items():
+            registros.append((
+                id_loja, mes, mix["total_ofertado"], mix["total_comprado"],
+                mix["total_fora_catalogo"], mix["percentual_comprado"], data_calculo
+            ))
+            self.logger.info(
+                f"Loja {id_loja if id_loja else 'todas'} ({mes}): "
+                f"{mix['total_comprado']}/{mix['total_ofertado']} = {mix['percentual_comprado']:.2f}% "
+                f"({mix['total_fora_catalogo']} fora do catálogo)"
+            )
 
-        percentual = 0.0
-        if total_ofertado > 0:
-            percentual = (total_comprado / total_ofertado) * 100
+        with self.armazenamento.transacao() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO mix_por_mes (
+                    id_loja, mes_referencia, total_ofertado, total_comprado,
+                    total_fora_catalogo, percentual_comprado, data_calculo
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, registros)
 
-        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Total ofertado: {total_ofertado}")
-        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Total comprado: {total_comprado}")
-        self.logger.info(f"Loja {id_loja if id_loja else 'todas'}: Percentual comprado: {percentual:.2f}%")
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
 
-        return {
-            "total_ofertado": total_ofertado,
-            "total_comprado": total_comprado,
-            "percentual_comprado": percentual
-        }
+        self.logger.info(f"Mix salvo em mix_por_mes: {len(registros)} registros ({mes_inicio} a {mes_fim}).")
+        return resultado
 
 
 if __name__ == "__main__":
     comp = ComparadorMixProdutos()
-    for loja in [1, 2, 3]:
-        comp.calcular_percentual_comprados(mes_referencia="2025-07", id_loja=loja)
+    comp.calcular_mix_lote("2025-07", lojas=[1, 2, 3])
@@ -1,14 +1,16 @@
-import sqlite3
-import xml.etree.ElementTree as ET
 import psycopg2
 from dotenv import load_dotenv
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from calendar import monthrange
 from logger import Logger  # Importa o logger centralizado
+from parser_nfe import ParserNFe
+from armazenamento import ArmazenamentoSQLite
+from indice_sku import gravar_bitset_compras
 
 class ProdutosComprados:
-    def __init__(self, id_loja, mes_referencia=None):
+    def __init__(self, id_loja, mes_referencia=None, pool=None, itersize=None, parser=None, reprocessar=False,
+                 armazenamento=None):
         load_dotenv()
         self.id_loja = id_loja
 
@@ -31,6 +33,20 @@ class ProdutosComprados:
         self.data_fim = ultimo_dia.strftime("%Y-%m-%d")
         self.data_coleta = datetime.now().strftime("%Y-%m-%d")
 
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
+        # Quantidade de notas (XML) trazidas por ida ao servidor no cursor server-side
+        self.itersize = int(itersize if itersize is not None else os.getenv("PG_ITERSIZE", 200))
+        # Motor de parsing das NF-e; se não vier da Main, a classe cria e fecha o seu
+        self.parser = parser
+        self._parser_proprio = parser is None
+        # reprocessar=True ignora o controle de notas já processadas e relê o mês inteiro
+        self.reprocessar = reprocessar
+        # Validade (dias) do mapa externo -> interno e do cache de códigos sem correspondência
+        self.validade_mapa_dias = int(os.getenv("MAPA_CODIGOS_VALIDADE_DIAS", 30))
+        self.validade_nao_resolvidos_dias = int(os.getenv("CODIGOS_NAO_RESOLVIDOS_VALIDADE_DIAS", 7))
+        # Mercadológicos fora da meta, ex.: "16" (mercadologico1 = 16) ou "16,2:35" (nivel:valor)
+        self.mercadologicos_excluidos = self._ler_mercadologicos_excluidos(os.getenv("MERCADOLOGICOS_EXCLUIDOS", "16"))
+        self.validade_excluidos_horas = int(os.getenv("PRODUTOS_EXCLUIDOS_VALIDADE_HORAS", 24))
         self.conn_pg = None
         self.cursor_pg = None
         self.conn_sqlite = None
@@ -41,41 +57,61 @@ class ProdutosComprados:
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         # Inicializa logger
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
+    @staticmethod
+    def _ler_mercadologicos_excluidos(configuracao):
+        excluidos = set()
+        for item in configuracao.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            nivel, _, valor = item.rpartition(":")
+            nivel = int(nivel) if nivel else 1
+            if not 1 <= nivel <= 5:
+                raise ValueError(f"Nível de mercadológico inválido em MERCADOLOGICOS_EXCLUIDOS: {item}")
+            excluidos.add((nivel, int(valor)))
+        return excluidos
+
     def conectar_postgres(self):
-        self.conn_pg = psycopg2.connect(
-            host=os.getenv("PG_HOST"),
-            port=os.getenv("PG_PORT"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
+        if self.pool:
+            self.conn_pg = self.pool.obter()
+        else:
+            self.conn_pg = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
         self.cursor_pg = self.conn_pg.cursor()
         self.logger.info(f"Conectado ao PostgreSQL para loja {self.id_loja}.")
 
     def conectar_sqlite(self):
-        self.conn_sqlite = sqlite3.connect(self.db_path)
+        self.conn_sqlite = self.armazenamento.conexao()
         self.cursor_sqlite = self.conn_sqlite.cursor()
+        self.logger.info("Conectado ao SQLite.")
+
+    def carregar_notas_processadas(self):
+        if self.reprocessar:
+            return []
         self.cursor_sqlite.execute("""
-            CREATE TABLE IF NOT EXISTS produtoscomprados (
-                codigoexterno TEXT,
-                codigointerno INTEGER,
-                descricao TEXT,
-                id_loja INTEGER,
-                mes_referencia TEXT,
-                data_coleta TEXT,
-                PRIMARY KEY (codigoexterno, id_loja, mes_referencia)
-            )
-        """)
-        self.conn_sqlite.commit()
-        self.logger.info("Conectado ao SQLite e tabela verificada/criada.")
+        SELECT numeronota || ':' || hash FROM notas_processadas
+        WHERE id_loja = ? AND mes_referencia = ?
+        """, (self.id_loja, self.mes_referencia))
+        return [row[0] for row in self.cursor_sqlite.fetchall()]
 
-    def buscar_notas_pg(self):
+    def _query_notas(self):
+        # Notas já processadas com o mesmo conteúdo (número + md5 do XML) ficam de fora;
+        # se o XML de uma nota mudar, ela volta a ser lida
         query_xmls = """
-        SELECT NFE.NUMERONOTA, NFE.XML 
+        SELECT NFE.NUMERONOTA::text, MD5(NFE.XML::text), CONVERT_TO(NFE.XML::text, 'UTF8') AS XML
         FROM NOTAENTRADANFE NFE
         JOIN NOTAENTRADA NE ON NFE.NUMERONOTA = NE.NUMERONOTA
         WHERE NFE.ID_FORNECEDOR = 2 AND NE.ID_FORNECEDOR = 2
@@ -85,53 +121,138 @@ class ProdutosComprados:
         AND NFE.CARREGADO = TRUE
         AND NE.ID_TIPOENTRADA != 3
         AND NE.DATAEMISSAO BETWEEN %s AND %s
+        AND (NFE.NUMERONOTA::text || ':' || MD5(NFE.XML::text)) <> ALL(%s::text[])
         """
-        self.cursor_pg.execute(query_xmls, (self.id_loja, self.id_loja, self.data_ini, self.data_fim))
-        notas = self.cursor_pg.fetchall()
+        processadas = self.carregar_notas_processadas()
+        if processadas:
+            self.logger.info(f"Loja {self.id_loja}: {len(processadas)} notas já processadas em {self.mes_referencia} serão ignoradas.")
+        return query_xmls, (self.id_loja, self.id_loja, self.data_ini, self.data_fim, processadas)
+
+    def buscar_notas_pg(self):
+        query_xmls, params = self._query_notas()
+        self.cursor_pg.execute(query_xmls, params)
+        notas = [((numeronota, hash_xml), xml) for numeronota, hash_xml, xml in self.cursor_pg.fetchall()]
         self.logger.info(f"Buscadas {len(notas)} notas fiscais para loja {self.id_loja} entre {self.data_ini} e {self.data_fim}.")
         return notas
 
-    def inserir_codigos_externos_sqlite(self, notas):
-        ns = {'ns': 'http://www.portalfiscal.inf.br/nfe'}
-        count_inserts = 0
-        count_ignorados = 0
-
-        for numeronota, xml_str in notas:
-            try:
-                root = ET.fromstring(xml_str)
-                cprod_elements = root.findall('.//ns:cProd', ns)
-                for cprod in cprod_elements:
-                    codigo_externo = cprod.text.strip()
-                    self.cursor_sqlite.execute("""
-                    INSERT OR IGNORE INTO produtoscomprados (codigoexterno, codigointerno, descricao, id_loja, mes_referencia, data_coleta)
-                    VALUES (?, NULL, NULL, ?, ?, ?)
-                    """, (codigo_externo, self.id_loja, self.mes_referencia, self.data_coleta))
-                    if self.cursor_sqlite.rowcount == 0:
-                        count_ignorados += 1
-                    else:
-                        count_inserts += 1
-            except Exception as e:
-                self.logger.error(f"Erro ao processar nota {numeronota}: {e}")
-
+    def iterar_notas_pg(self):
+        # Cursor nomeado (server-side): as notas chegam em lotes de itersize,
+        # então só um lote de XMLs fica em memória por vez
+        query_xmls, params = self._query_notas()
+        cursor = self.conn_pg.cursor(name=f"notas_loja_{self.id_loja}")
+        cursor.itersize = self.itersize
+        total = 0
+        try:
+            cursor.execute(query_xmls, params)
+            for numeronota, hash_xml, xml in cursor:
+                total += 1
+                # A chave (numeronota, hash) atravessa o parser e volta para o registro da nota
+                yield (numeronota, hash_xml), xml
+        finally:
+            cursor.close()
+            self.logger.info(f"Lidas {total} notas fiscais para loja {self.id_loja} entre {self.data_ini} e {self.data_fim}.")
+
+    def extrair_codigos_externos(self, notas):
+        if self.parser is None:
+            self.parser = ParserNFe()
+        for chave_nota, codigos, erro in self.parser.processar(notas):
+            if erro:
+                self.logger.error(f"Erro ao processar nota {chave_nota[0]}: {erro}")
+                continue
+            yield chave_nota, codigos
+
+    def carregar_codigos_do_mes(self):
+        self.cursor_sqlite.execute("""
+        SELECT codigoexterno FROM produtoscomprados
+        WHERE id_loja = ? AND mes_referencia = ?
+        """, (self.id_loja, self.mes_referencia))
+        return {row[0] for row in self.cursor_sqlite.fetchall()}
+
+    def inserir_codigos_externos_sqlite(self, notas_codigos):
+        # notas_codigos: ((numeronota, hash), [cProd, ...]) já extraídos das notas.
+        # O mesmo produto aparece em dezenas de notas do mês: deduplica em memória
+        # e grava tudo em lote (chamar dentro de armazenamento.transacao())
+        count_ocorrencias = 0
+        count_excluidos = 0
+        codigos_excluidos = self.carregar_codigos_excluidos()
+        codigos_mes = set()
+        notas = []
+
+        for (numeronota, hash_xml), codigos in notas_codigos:
+            for codigo_externo in codigos:
+                if codigo_externo in codigos_excluidos:
+                    count_excluidos += 1
+                    continue
+                count_ocorrencias += 1
+                codigos_mes.add(codigo_externo)
+            # Nota com erro de parsing não chega aqui, então não entra no controle
+            notas.append((self.id_loja, self.mes_referencia, numeronota, hash_xml, self.data_coleta))
+
+        novos = codigos_mes - self.carregar_codigos_do_mes()
+        self.cursor_sqlite.executemany("""
+        INSERT OR IGNORE INTO produtoscomprados (codigoexterno, codigointerno, descricao, id_loja, mes_referencia, data_coleta)
+        VALUES (?, NULL, NULL, ?, ?, ?)
+        """, [(codigo, self.id_loja, self.mes_referencia, self.data_coleta) for codigo in sorted(novos)])
+        self.cursor_sqlite.executemany("""
+        INSERT OR REPLACE INTO notas_processadas (id_loja, mes_referencia, numeronota, hash, data_processamento)
+        VALUES (?, ?, ?, ?, ?)
+        """, notas)
+
+        count_inserts = len(novos)
+        count_ignorados = count_ocorrencias - count_inserts
         self.logger.info(f"Loja {self.id_loja}: Inseridos {count_inserts} novos códigos externos.")
-        self.logger.info(f"Loja {self.id_loja}: Ignorados {count_ignorados} códigos já existentes neste mês.")
+        self.logger.info(f"Loja {self.id_loja}: Ignorados {count_ignorados} códigos repetidos ou já existentes neste mês.")
+        if count_excluidos:
+            self.logger.info(f"Loja {self.id_loja}: Descartados {count_excluidos} códigos de mercadológicos excluídos.")
         return count_inserts, count_ignorados
 
-    def identificar_codigos_internos(self):
+    def aplicar_mapa_codigos(self):
+        # Identificação local: copia codigointerno/descricao do mapa persistente, tanto
+        # para linhas ainda sem código quanto para as que divergem de um mapeamento renovado
         self.cursor_sqlite.execute("""
-        SELECT codigoexterno FROM produtoscomprados 
-        WHERE codigointerno IS NULL AND id_loja = ? AND mes_referencia = ?
+        UPDATE produtoscomprados
+        SET codigointerno = (SELECT m.codigointerno FROM mapa_codigos m WHERE m.codigoexterno = produtoscomprados.codigoexterno),
+            descricao = (SELECT m.descricao FROM mapa_codigos m WHERE m.codigoexterno = produtoscomprados.codigoexterno)
+        WHERE id_loja = ? AND mes_referencia = ?
+        AND EXISTS (
+            SELECT 1 FROM mapa_codigos m
+            WHERE m.codigoexterno = produtoscomprados.codigoexterno
+            AND (m.codigointerno IS NOT produtoscomprados.codigointerno OR m.descricao IS NOT produtoscomprados.descricao)
+        )
         """, (self.id_loja, self.mes_referencia))
-        codigo_externos = [row[0] for row in self.cursor_sqlite.fetchall()]
-        if not codigo_externos:
-            self.logger.info(f"Loja {self.id_loja}: Todos os códigos já foram identificados ou tabela está vazia para o mês {self.mes_referencia}.")
-            return 0, 0
-
-        placeholders = ','.join(['%s'] * len(codigo_externos))
-        params = [self.data_ini, self.data_fim] + codigo_externos
-        params.insert(2, self.id_loja)  # id_loja depois das datas
-
-        query_principal = f"""
+        return self.cursor_sqlite.rowcount
+
+    def listar_codigos_para_consulta(self, codigos_novos=()):
+        # Códigos do mês ainda sem codigointerno, sem entrada no mapa (ou com entrada
+        # vencida) e que não estão no cache negativo desta loja dentro da validade.
+        # codigos_novos: códigos extraídos das notas que ainda vão ser gravados
+        limite_mapa = (datetime.now() - timedelta(days=self.validade_mapa_dias)).strftime("%Y-%m-%d")
+        limite_negativo = (datetime.now() - timedelta(days=self.validade_nao_resolvidos_dias)).strftime("%Y-%m-%d")
+        codigos = set()
+        if codigos_novos:
+            self.cursor_sqlite.execute("""
+            SELECT codigoexterno FROM mapa_codigos WHERE data_atualizacao >= ?
+            UNION
+            SELECT codigoexterno FROM codigos_nao_resolvidos WHERE id_loja = ? AND data_consulta >= ?
+            """, (limite_mapa, self.id_loja, limite_negativo))
+            codigos = set(codigos_novos) - {row[0] for row in self.cursor_sqlite.fetchall()}
+        self.cursor_sqlite.execute("""
+        SELECT pc.codigoexterno FROM produtoscomprados pc
+        LEFT JOIN mapa_codigos m ON m.codigoexterno = pc.codigoexterno
+        LEFT JOIN codigos_nao_resolvidos n ON n.codigoexterno = pc.codigoexterno AND n.id_loja = pc.id_loja
+        WHERE pc.id_loja = ? AND pc.mes_referencia = ? AND pc.codigointerno IS NULL
+        AND (m.codigoexterno IS NULL OR m.data_atualizacao < ?)
+        AND (n.codigoexterno IS NULL OR n.data_consulta < ?)
+        """, (self.id_loja, self.mes_referencia, limite_mapa, limite_negativo))
+        codigos.update(row[0] for row in self.cursor_sqlite.fetchall())
+        return sorted(codigos)
+
+    def consultar_mapa_codigos(self, codigo_externos):
+        # Só leitura no PostgreSQL (fora da transação do SQLite); devolve os registros
+        # para mapa_codigos e os códigos sem correspondência nesta loja
+        params = [self.data_ini, self.data_fim, self.id_loja, codigo_externos]
+
+        query_principal = """
         SELECT DISTINCT p.id AS codigointerno, p.descricaoreduzida, pf.codigoexterno
         FROM public.notaentrada ne
         JOIN public.notaentradaitem ni ON ne.id = ni.id_notaentrada
@@ -142,64 +263,153 @@ class ProdutosComprados:
         AND ne.id_tipoentrada != 3
         AND ne.dataemissao BETWEEN %s AND %s
         AND ne.id_loja = %s
-        AND pf.codigoexterno IN ({placeholders})
+        AND pf.codigoexterno = ANY(%s)
         """
 
         self.cursor_pg.execute(query_principal, params)
-        atualizados = 0
-        for codint, descricao, codext in self.cursor_pg.fetchall():
-            self.cursor_sqlite.execute("""
-            UPDATE produtoscomprados 
-            SET codigointerno = ?, descricao = ?
-            WHERE codigoexterno = ? AND id_loja = ? AND mes_referencia = ?
-            """, (codint, descricao, codext, self.id_loja, self.mes_referencia))
-            atualizados += 1
-
-        query_secundaria = f"""
-        SELECT DISTINCT p.id AS codigointerno, p.descricaocompleta, pe.codigoexterno
-        FROM public.notaentrada ne
-        JOIN public.notaentradaitem ni ON ne.id = ni.id_notaentrada
-        JOIN public.produto p ON ni.id_produto = p.id
-        JOIN public.produtofornecedor pf ON ni.id_produto = pf.id_produto
-        JOIN public.produtofornecedorcodigoexterno pe ON pf.id = pe.id_produtofornecedor
-        WHERE pf.id_fornecedor = 2
-        AND ne.id_fornecedor = 2
-        AND ne.id_tipoentrada != 3
-        AND ne.dataemissao BETWEEN %s AND %s
-        AND ne.id_loja = %s
-        AND pe.codigoexterno IN ({placeholders})
-        """
-
-        self.cursor_pg.execute(query_secundaria, params)
-        for codint, descricao, codext in self.cursor_pg.fetchall():
-            self.cursor_sqlite.execute("""
-            UPDATE produtoscomprados 
-            SET codigointerno = ?, descricao = ?
-            WHERE codigoexterno = ? AND codigointerno IS NULL AND id_loja = ? AND mes_referencia = ?
-            """, (codint, descricao, codext, self.id_loja, self.mes_referencia))
-            atualizados += 1
+        principais = {codext: (codint, descricao) for codint, descricao, codext in self.cursor_pg.fetchall()}
+
+        # Códigos alternativos só para o que a consulta principal não resolveu
+        pendentes = [codigo for codigo in codigo_externos if codigo not in principais]
+        alternativos = {}
+        if pendentes:
+            query_secundaria = """
+            SELECT DISTINCT p.id AS codigointerno, p.descricaocompleta, pe.codigoexterno
+            FROM public.notaentrada ne
+            JOIN public.notaentradaitem ni ON ne.id = ni.id_notaentrada
+            JOIN public.produto p ON ni.id_produto = p.id
+            JOIN public.produtofornecedor pf ON ni.id_produto = pf.id_produto
+            JOIN public.produtofornecedorcodigoexterno pe ON pf.id = pe.id_produtofornecedor
+            WHERE pf.id_fornecedor = 2
+            AND ne.id_fornecedor = 2
+            AND ne.id_tipoentrada != 3
+            AND ne.dataemissao BETWEEN %s AND %s
+            AND ne.id_loja = %s
+            AND pe.codigoexterno = ANY(%s)
+            """
+            self.cursor_pg.execute(query_secundaria, [self.data_ini, self.data_fim, self.id_loja, pendentes])
+            alternativos = {codext: (codint, descricao) for codint, descricao, codext in self.cursor_pg.fetchall()}
+
+        registros = [(codext, codint, descricao, "principal", self.data_coleta) for codext, (codint, descricao) in principais.items()]
+        registros += [(codext, codint, descricao, "alternativo", self.data_coleta) for codext, (codint, descricao) in alternativos.items()]
+        # A consulta é limitada às notas desta loja no mês: o "não encontrado" vale só para ela
+        nao_resolvidos = [(codigo, self.id_loja, self.data_coleta) for codigo in pendentes if codigo not in alternativos]
+        return registros, nao_resolvidos
+
+    def gravar_mapa_codigos(self, registros, nao_resolvidos):
+        # Chamar dentro de armazenamento.transacao()
+        self.cursor_sqlite.executemany("""
+        INSERT INTO mapa_codigos (codigoexterno, codigointerno, descricao, origem, data_atualizacao)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(codigoexterno) DO UPDATE SET
+            codigointerno = excluded.codigointerno,
+            descricao = excluded.descricao,
+            origem = excluded.origem,
+            data_atualizacao = excluded.data_atualizacao
+        """, registros)
+        # Código resolvido por qualquer loja sai do cache negativo de todas
+        self.cursor_sqlite.executemany("""
+        DELETE FROM codigos_nao_resolvidos WHERE codigoexterno = ?
+        """, [(registro[0],) for registro in registros])
+        self.cursor_sqlite.executemany("""
+        INSERT OR REPLACE INTO codigos_nao_resolvidos (codigoexterno, id_loja, data_consulta)
+        VALUES (?, ?, ?)
+        """, nao_resolvidos)
+
+        self.logger.info(
+            f"Loja {self.id_loja}: Mapa de códigos atualizado com {len(registros)} códigos; "
+            f"{len(nao_resolvidos)} sem correspondência no PostgreSQL."
+        )
+        return len(registros)
 
-        self.logger.info(f"Loja {self.id_loja}: Atualizados {atualizados} produtos via queries de identificação.")
+    def consultar_codigos_internos(self, codigos_novos=()):
+        # Parte remota da identificação: o PostgreSQL só é consultado para códigos novos
+        # (ou com mapeamento vencido). Devolve (registros, nao_resolvidos, consultados)
+        codigo_externos = self.listar_codigos_para_consulta(codigos_novos)
+        if not codigo_externos:
+            return [], [], 0
+        registros, nao_resolvidos = self.consultar_mapa_codigos(codigo_externos)
+        return registros, nao_resolvidos, len(codigo_externos)
+
+    def identificar_codigos_internos(self, consulta):
+        # Parte local (chamar dentro de armazenamento.transacao()): grava o resultado da
+        # consulta no mapa, descarta os produtos de mercadológicos excluídos e identifica
+        registros, nao_resolvidos, consultados = consulta
+        if consultados:
+            self.gravar_mapa_codigos(registros, nao_resolvidos)
+
+        # Produtos de mercadológicos excluídos saem antes de serem identificados
+        self.filtrar_produtos_excluidos()
+        atualizados = self.aplicar_mapa_codigos()
+
+        self.logger.info(f"Loja {self.id_loja}: Atualizados {atualizados} produtos via mapa de códigos ({consultados} consultados no PostgreSQL).")
         return atualizados
 
-    def remover_mercadologico16(self):
-        self.cursor_pg.execute("""
-        SELECT p.id
-        FROM public.produto p
-        WHERE p.mercadologico1 = 16
+    def atualizar_produtos_excluidos(self):
+        # Cache local dos produtos dos mercadológicos excluídos, renovado só quando
+        # vence a validade ou muda a configuração (não a cada loja)
+        configuracao = ";".join(f"{nivel}:{valor}" for nivel, valor in sorted(self.mercadologicos_excluidos))
+        self.cursor_sqlite.execute("""
+        SELECT valor, data_atualizacao FROM cache_controle WHERE chave = 'produtos_excluidos'
         """)
-        ids_mercadologico16 = [str(row[0]) for row in self.cursor_pg.fetchall()]
-        removidos = 0
-        if ids_mercadologico16:
-            placeholders_sqlite = ','.join(['?'] * len(ids_mercadologico16))
-            self.cursor_sqlite.execute(f"""
-            DELETE FROM produtoscomprados
-            WHERE codigointerno IN ({placeholders_sqlite}) AND id_loja = ? AND mes_referencia = ?
-            """, ids_mercadologico16 + [self.id_loja, self.mes_referencia])
-            removidos = self.cursor_sqlite.rowcount
-            self.logger.info(f"Loja {self.id_loja}: Removidos {removidos} produtos com mercadologico1 = 16 da tabela produtoscomprados.")
-        else:
-            self.logger.info(f"Loja {self.id_loja}: Nenhum produto com mercadologico1 = 16 encontrado para exclusão.")
+        row = self.cursor_sqlite.fetchone()
+        limite = (datetime.now() - timedelta(hours=self.validade_excluidos_horas)).strftime("%Y-%m-%d %H:%M:%S")
+        if row and row[0] == configuracao and row[1] >= limite:
+            return False
+
+        ids_excluidos = []
+        if self.mercadologicos_excluidos:
+            niveis = sorted({nivel for nivel, _ in self.mercadologicos_excluidos})
+            condicoes = " OR ".join(f"p.mercadologico{nivel} = ANY(%s)" for nivel in niveis)
+            params = [[valor for n, valor in self.mercadologicos_excluidos if n == nivel] for nivel in niveis]
+            self.cursor_pg.execute(f"""
+            SELECT p.id
+            FROM public.produto p
+            WHERE {condicoes}
+            """, params)
+            ids_excluidos = [(row[0],) for row in self.cursor_pg.fetchall()]
+
+        with self.armazenamento.transacao():
+            # Notas processadas tiveram os códigos excluídos descartados na gravação: se
+            # a configuração mudou ou algum produto deixou de ser excluído, o controle de
+            # notas é zerado para que elas sejam lidas de novo e esses códigos voltem
+            self.cursor_sqlite.execute("SELECT id_produto FROM produtos_excluidos")
+            anteriores = {row[0] for row in self.cursor_sqlite.fetchall()}
+            if row and (row[0] != configuracao or anteriores - {id_produto for (id_produto,) in ids_excluidos}):
+                self.cursor_sqlite.execute("DELETE FROM notas_processadas")
+                self.logger.info("Produtos excluídos alterados: controle de notas processadas reiniciado.")
+            self.cursor_sqlite.execute("DELETE FROM produtos_excluidos")
+            self.cursor_sqlite.executemany("INSERT INTO produtos_excluidos (id_produto) VALUES (?)", ids_excluidos)
+            self.cursor_sqlite.execute("""
+            INSERT OR REPLACE INTO cache_controle (chave, valor, data_atualizacao)
+            VALUES ('produtos_excluidos', ?, ?)
+            """, (configuracao, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        self.logger.info(f"Cache de produtos excluídos renovado ({configuracao}): {len(ids_excluidos)} produtos.")
+        return True
+
+    def carregar_codigos_excluidos(self):
+        # Códigos externos já mapeados para produtos excluídos: nem chegam a ser gravados
+        self.cursor_sqlite.execute("""
+        SELECT m.codigoexterno FROM mapa_codigos m
+        JOIN produtos_excluidos e ON e.id_produto = m.codigointerno
+        """)
+        return {row[0] for row in self.cursor_sqlite.fetchall()}
+
+    def filtrar_produtos_excluidos(self):
+        self.cursor_sqlite.execute("""
+        DELETE FROM produtoscomprados
+        WHERE id_loja = ? AND mes_referencia = ?
+        AND (
+            codigointerno IN (SELECT id_produto FROM produtos_excluidos)
+            OR (codigointerno IS NULL AND codigoexterno IN (
+                SELECT m.codigoexterno FROM mapa_codigos m
+                JOIN produtos_excluidos e ON e.id_produto = m.codigointerno
+            ))
+        )
+        """, (self.id_loja, self.mes_referencia))
+        removidos = self.cursor_sqlite.rowcount
+        if removidos:
+            self.logger.info(f"Loja {self.id_loja}: Descartados {removidos} produtos de mercadológicos excluídos.")
         return removidos
 
     def listar_nao_identificados(self):
@@ -219,11 +429,16 @@ class ProdutosComprados:
         if self.cursor_pg:
             self.cursor_pg.close()
         if self.conn_pg:
-            self.conn_pg.close()
+            if self.pool:
+                self.pool.devolver(self.conn_pg)
+            else:
+                self.conn_pg.close()
         if self.cursor_sqlite:
             self.cursor_sqlite.close()
-        if self.conn_sqlite:
-            self.conn_sqlite.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
+        if self._parser_proprio and self.parser:
+            self.parser.fechar()
         self.logger.info(f"Loja {self.id_loja}: Conexões fechadas.")
 
     def executar_rotina(self):
@@ -232,16 +447,25 @@ class ProdutosComprados:
             self.conectar_postgres()
             self.conectar_sqlite()
 
-            notas = self.buscar_notas_pg()
+            self.atualizar_produtos_excluidos()
 
-            inserts, ignorados = self.inserir_codigos_externos_sqlite(notas)
-            self.conn_sqlite.commit()
+            # fetch -> parse em fluxo (memória limitada pelo itersize); só os códigos
+            # extraídos ficam em memória, e a leitura acontece fora da transação
+            notas_codigos = list(self.extrair_codigos_externos(self.iterar_notas_pg()))
 
-            atualizados = self.identificar_codigos_internos()
-            self.conn_sqlite.commit()
+            # Consulta ao PostgreSQL antes de abrir a transação: o lock de escrita do
+            # SQLite (compartilhado entre as lojas) só fica preso durante as gravações locais
+            consulta = self.consultar_codigos_internos(
+                {codigo for _, codigos in notas_codigos for codigo in codigos}
+            )
 
-            removidos = self.remover_mercadologico16()
-            self.conn_sqlite.commit()
+            # Inserção e identificação na mesma transação: códigos de produtos
+            # excluídos descobertos na identificação nunca chegam a ser gravados
+            with self.armazenamento.transacao():
+                inserts, ignorados = self.inserir_codigos_externos_sqlite(notas_codigos)
+                atualizados = self.identificar_codigos_internos(consulta)
+                # Bitset da loja/mês acompanha a gravação (depois do descarte dos excluídos)
+                gravar_bitset_compras(self.cursor_sqlite, self.id_loja, self.mes_referencia)
 
             self.listar_nao_identificados()
 
@@ -253,6 +477,8 @@ class ProdutosComprados:
             self.logger.info(f"Loja {self.id_loja}: Processo finalizado com sucesso.")
         except Exception as e:
             self.logger.error(f"Loja {self.id_loja}: Erro inesperado: {e}")
+            # Propaga para o agendador não calcular mix/meta com compras incompletas
+            raise
         finally:
             self.fechar_conexoes()
 
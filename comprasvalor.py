@@ -1,13 +1,13 @@
 import psycopg2
-import sqlite3
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 from logger import Logger
+from armazenamento import ArmazenamentoSQLite
 
 
 class ComprasValorPorMes:
-    def __init__(self, id_loja, mes_referencia=None):
+    def __init__(self, id_loja, mes_referencia=None, pool=None, armazenamento=None):
         load_dotenv()
 
         self.id_loja = id_loja
@@ -25,6 +25,7 @@ class ComprasValorPorMes:
         except Exception:
             raise ValueError("mes_referencia deve estar no formato 'YYYY-MM'")
 
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
         self.pg_conn = None
         self.pg_cursor = None
         self.sqlite_conn = None
@@ -35,38 +36,32 @@ class ComprasValorPorMes:
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         # Configura o logger
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
     def conectar_postgres(self):
-        self.pg_conn = psycopg2.connect(
-            host=os.getenv("PG_HOST"),
-            port=os.getenv("PG_PORT"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
+        if self.pool:
+            self.pg_conn = self.pool.obter()
+        else:
+            self.pg_conn = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
         self.pg_cursor = self.pg_conn.cursor()
         self.logger.info(f"Conectado ao PostgreSQL para loja {self.id_loja}.")
 
     def conectar_sqlite(self):
-        self.sqlite_conn = sqlite3.connect(self.db_path)
+        self.sqlite_conn = self.armazenamento.conexao()
         self.sqlite_cursor = self.sqlite_conn.cursor()
 
-        # Cria tabela se não existir
-        self.sqlite_cursor.execute("""
-            CREATE TABLE IF NOT EXISTS compras_valor_por_mes (
-                id_loja INTEGER,
-                mes_referencia TEXT,
-                valor_total REAL,
-                PRIMARY KEY (id_loja, mes_referencia)
-            )
-        """)
-        self.sqlite_conn.commit()
-
-        self.logger.info("Tabela compras_valor_por_mes criada/verificada no SQLite.")
-
     def buscar_compras_pg(self):
         query = """
             SELECT 
@@ -90,23 +85,22 @@ class ComprasValorPorMes:
         return resultado
 
     def salvar_sqlite(self, dados_pg):
-        for mes_pg, total_mes in dados_pg:
-            mes_int = int(mes_pg) if mes_pg is not None else None
-            total_float = float(total_mes) if total_mes is not None else 0.0
-
-            mes_referencia = f"{self.ano}-{mes_int:02d}"
-
-            self.sqlite_cursor.execute("""
-                INSERT OR REPLACE INTO compras_valor_por_mes 
-                (id_loja, mes_referencia, valor_total)
-                VALUES (?, ?, ?)
-            """, (
-                self.id_loja,
-                mes_referencia,
-                total_float
-            ))
-        
-        self.sqlite_conn.commit()
+        with self.armazenamento.transacao():
+            for mes_pg, total_mes in dados_pg:
+                mes_int = int(mes_pg) if mes_pg is not None else None
+                total_float = float(total_mes) if total_mes is not None else 0.0
+
+                mes_referencia = f"{self.ano}-{mes_int:02d}"
+
+                self.sqlite_cursor.execute("""
+                    INSERT OR REPLACE INTO compras_valor_por_mes 
+                    (id_loja, mes_referencia, valor_total)
+                    VALUES (?, ?, ?)
+                """, (
+                    self.id_loja,
+                    mes_referencia,
+                    total_float
+                ))
         self.logger.info(f"Dados salvos no SQLite para loja {self.id_loja} em {self.mes_referencia}.")
 
     def consultar_compras(self):
@@ -134,11 +128,14 @@ class ComprasValorPorMes:
         if self.pg_cursor:
             self.pg_cursor.close()
         if self.pg_conn:
-            self.pg_conn.close()
+            if self.pool:
+                self.pool.devolver(self.pg_conn)
+            else:
+                self.pg_conn.close()
         if self.sqlite_cursor:
             self.sqlite_cursor.close()
-        if self.sqlite_conn:
-            self.sqlite_conn.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info(f"Conexões fechadas para loja {self.id_loja}.")
 
 
@@ -0,0 +1,105 @@
+import os
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from dotenv import load_dotenv
+from logger import Logger
+
+
+# Pool de conexões PostgreSQL compartilhado entre as etapas do pipeline.
+# A Main cria uma instância e injeta nas classes de extração, que pegam
+# uma conexão emprestada em vez de abrir uma nova a cada loja.
+class PoolPostgres:
+    def __init__(self, minimo=None, maximo=None, verificar_conexao=True):
+        load_dotenv()
+
+        self.minimo = int(minimo if minimo is not None else os.getenv("PG_POOL_MIN", 1))
+        self.maximo = int(maximo if maximo is not None else os.getenv("PG_POOL_MAX", 4))
+        if self.minimo < 0 or self.maximo < 1 or self.maximo < self.minimo:
+            raise ValueError("Tamanho do pool inválido: exige 0 <= minimo <= maximo e maximo >= 1")
+
+        # Testa a conexão com "SELECT 1" antes de entregá-la
+        self.verificar_conexao = verificar_conexao
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # Bloqueia quem pede conexão quando todas estão emprestadas
+        self._vagas = threading.BoundedSemaphore(self.maximo)
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def _obter_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = pg_pool.ThreadedConnectionPool(
+                    self.minimo,
+                    self.maximo,
+                    host=os.getenv("PG_HOST"),
+                    port=os.getenv("PG_PORT"),
+                    database=os.getenv("PG_DB"),
+                    user=os.getenv("PG_USER"),
+                    password=os.getenv("PG_PASSWORD")
+                )
+                self.logger.info(f"Pool PostgreSQL criado (min={self.minimo}, max={self.maximo}).")
+            return self._pool
+
+    def _conexao_saudavel(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        self._vagas.acquire()
+        try:
+            pool = self._obter_pool()
+            # Descarta conexões quebradas (timeout, restart do servidor) e tenta de novo
+            for _ in range(self.maximo + 1):
+                conn = pool.getconn()
+                if not self.verificar_conexao or self._conexao_saudavel(conn):
+                    return conn
+                self.logger.warning("Conexão inválida descartada do pool.")
+                pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("Não foi possível obter uma conexão válida do pool.")
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def devolver(self, conn):
+        if conn is None:
+            return
+        try:
+            if self._pool is None:
+                conn.close()
+                return
+            descartar = bool(conn.closed)
+            if not descartar:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    descartar = True
+            self._pool.putconn(conn, close=descartar)
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+
+    def fechar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self.logger.info("Pool PostgreSQL fechado.")
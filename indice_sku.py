@@ -0,0 +1,277 @@
+from functools import reduce
+from operator import or_
+from logger import Logger
+from meses import listar_meses
+
+# int.bit_count existe a partir do Python 3.10
+_popcount = getattr(int, "bit_count", None) or (lambda bits: bin(bits).count("1"))
+
+
+def montar_bitset(posicoes):
+    if not posicoes:
+        return 0
+    buffer = bytearray(max(posicoes) // 8 + 1)
+    for posicao in posicoes:
+        buffer[posicao >> 3] |= 1 << (posicao & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def _para_blob(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _de_blob(blob):
+    return int.from_bytes(blob, "little") if blob else 0
+
+
+def _carregar_posicoes(cursor):
+    cursor.execute("SELECT codigoexterno, posicao FROM sku_indice")
+    return dict(cursor.fetchall())
+
+
+def registrar_codigos(cursor, codigos):
+    # Códigos novos ganham as próximas posições livres (chamar dentro de transação);
+    # lê o índice no momento para não colidir com posições gravadas por outra instância
+    posicoes = _carregar_posicoes(cursor)
+    novos = sorted(set(codigos) - posicoes.keys())
+    if novos:
+        proxima = max(posicoes.values(), default=-1) + 1
+        registros = [(codigo, proxima + i) for i, codigo in enumerate(novos)]
+        cursor.executemany("INSERT INTO sku_indice (codigoexterno, posicao) VALUES (?, ?)", registros)
+        posicoes.update(registros)
+    return posicoes
+
+
+def gravar_bitset_compras(cursor, id_loja, mes_referencia):
+    # Refaz só o bitset da loja/mês que acabou de ser gravado em produtoscomprados
+    # (chamar na mesma transação da gravação das compras). Se o conjunto mudou, o
+    # resumo de mix da loja e do total geral (id_loja = 0) deixa de valer
+    cursor.execute("""
+        SELECT DISTINCT codigoexterno FROM produtoscomprados
+        WHERE id_loja = ? AND mes_referencia = ?
+    """, (id_loja, mes_referencia))
+    codigos = [row[0] for row in cursor.fetchall()]
+    anterior = cursor.execute("""
+        SELECT bits FROM bitset_compras WHERE id_loja = ? AND mes_referencia = ?
+    """, (id_loja, mes_referencia)).fetchone()
+    if codigos:
+        posicoes = registrar_codigos(cursor, codigos)
+        bits = _para_blob(montar_bitset([posicoes[c] for c in codigos]))
+    else:
+        bits = None
+    if (anterior and anterior[0]) == bits:
+        return len(codigos)
+
+    if bits is None:
+        cursor.execute("""
+            DELETE FROM bitset_compras WHERE id_loja = ? AND mes_referencia = ?
+        """, (id_loja, mes_referencia))
+    else:
+        cursor.execute("""
+            INSERT OR REPLACE INTO bitset_compras (id_loja, mes_referencia, bits, total)
+            VALUES (?, ?, ?, ?)
+        """, (id_loja, mes_referencia, bits, len(codigos)))
+    cursor.execute("""
+        DELETE FROM mix_por_mes WHERE mes_referencia = ? AND id_loja IN (?, 0)
+    """, (mes_referencia, id_loja))
+    return len(codigos)
+
+
+def gravar_bitset_catalogo(cursor, mes_referencia, codigos):
+    # Bitset do catálogo do mês gravado (chamar na transação do CatalogoRede.gravar_mes).
+    # Catálogo diferente invalida o resumo de mix do mês em todas as lojas
+    codigos = list(codigos)
+    posicoes = registrar_codigos(cursor, codigos)
+    bits = _para_blob(montar_bitset([posicoes[c] for c in codigos]))
+    anterior = cursor.execute("""
+        SELECT bits FROM bitset_catalogo WHERE mes_referencia = ?
+    """, (mes_referencia,)).fetchone()
+    if anterior is not None and anterior[0] == bits:
+        return len(codigos)
+
+    cursor.execute("""
+        INSERT OR REPLACE INTO bitset_catalogo (mes_referencia, bits, total)
+        VALUES (?, ?, ?)
+    """, (mes_referencia, bits, len(codigos)))
+    cursor.execute("DELETE FROM mix_por_mes WHERE mes_referencia = ?", (mes_referencia,))
+    return len(codigos)
+
+
+def reconstruir_bitsets(cursor, mes_inicio=None, mes_fim=None, lojas=None):
+    # Reconstrução completa a partir das tabelas (migração e reparo); no dia a dia os
+    # bitsets são mantidos por gravar_bitset_compras / gravar_bitset_catalogo.
+    # Sem meses considera todo o histórico; lojas=None considera todas as lojas
+    if mes_inicio is None:
+        mes_inicio, mes_fim = "0000-00", mes_fim or "9999-99"
+    else:
+        mes_fim = mes_fim or mes_inicio
+    filtro_lojas = filtro_mix = ""
+    params = [mes_inicio, mes_fim]
+    if lojas is not None:
+        lojas = [int(loja) for loja in lojas]
+        if not lojas:
+            return 0, 0
+        placeholders = ','.join('?' for _ in lojas)
+        filtro_lojas = f" AND id_loja IN ({placeholders})"
+        # Total geral (id_loja = 0) depende das compras de todas as lojas
+        filtro_mix = f" AND id_loja IN (0, {placeholders})"
+        params += lojas
+
+    cursor.execute(f"""
+        SELECT DISTINCT id_loja, mes_referencia, codigoexterno
+        FROM produtoscomprados
+        WHERE mes_referencia BETWEEN ? AND ?{filtro_lojas}
+    """, params)
+    compras = cursor.fetchall()
+    cursor.execute("""
+        SELECT mes_referencia, codigoexterno
+        FROM produtosrede_historico
+        WHERE mes_referencia BETWEEN ? AND ?
+    """, (mes_inicio, mes_fim))
+    catalogo = cursor.fetchall()
+
+    posicoes = registrar_codigos(cursor, [row[2] for row in compras] + [row[1] for row in catalogo])
+
+    por_loja_mes = {}
+    for id_loja, mes, codigo in compras:
+        por_loja_mes.setdefault((id_loja, mes), []).append(posicoes[codigo])
+    por_mes = {}
+    for mes, codigo in catalogo:
+        por_mes.setdefault(mes, []).append(posicoes[codigo])
+
+    # Resumos de mix do intervalo são recalculados a partir dos bitsets refeitos
+    cursor.execute(f"""
+        DELETE FROM mix_por_mes
+        WHERE mes_referencia BETWEEN ? AND ?{filtro_mix}
+    """, params)
+
+    # Loja/mês sem compras no intervalo fica sem bitset (equivale a vazio)
+    cursor.execute(f"""
+        DELETE FROM bitset_compras
+        WHERE mes_referencia BETWEEN ? AND ?{filtro_lojas}
+    """, params)
+    cursor.executemany("""
+        INSERT INTO bitset_compras (id_loja, mes_referencia, bits, total)
+        VALUES (?, ?, ?, ?)
+    """, [
+        (id_loja, mes, _para_blob(montar_bitset(lista)), len(lista))
+        for (id_loja, mes), lista in por_loja_mes.items()
+    ])
+    cursor.execute("""
+        DELETE FROM bitset_catalogo WHERE mes_referencia BETWEEN ? AND ?
+    """, (mes_inicio, mes_fim))
+    cursor.executemany("""
+        INSERT INTO bitset_catalogo (mes_referencia, bits, total)
+        VALUES (?, ?, ?)
+    """, [
+        (mes, _para_blob(montar_bitset(lista)), len(lista))
+        for mes, lista in por_mes.items()
+    ])
+    return len(por_loja_mes), len(por_mes)
+
+
+# Índice denso de SKUs: cada codigoexterno recebe uma posição inteira fixa e os
+# conjuntos (compras de uma loja no mês, catálogo do mês) viram bitsets gravados
+# como BLOB junto com as próprias compras e o catálogo. A leitura só carrega os
+# BLOBs: mix, SKUs fora do catálogo e sobreposição entre lojas saem de AND/OR e
+# popcount, inclusive em períodos de vários meses.
+class IndiceSKU:
+    def __init__(self, armazenamento):
+        self.armazenamento = armazenamento
+        self._posicoes = None
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def reconstruir(self, mes_inicio=None, mes_fim=None, lojas=None):
+        # Reparo: refaz os bitsets do intervalo a partir de produtoscomprados e do catálogo
+        with self.armazenamento.transacao() as conn:
+            cursor = conn.cursor()
+            compras, meses = reconstruir_bitsets(cursor, mes_inicio, mes_fim, lojas)
+            cursor.close()
+        self._posicoes = None
+        self.logger.info(
+            f"Bitsets reconstruídos ({mes_inicio or 'início'} a {mes_fim or mes_inicio or 'fim'}): "
+            f"{compras} loja/mês de compras, {meses} meses de catálogo."
+        )
+
+    def carregar_compras(self, mes_inicio, mes_fim=None):
+        # {(id_loja, mes): bitset}
+        cursor = self.armazenamento.conexao().execute("""
+            SELECT id_loja, mes_referencia, bits FROM bitset_compras
+            WHERE mes_referencia BETWEEN ? AND ?
+        """, (mes_inicio, mes_fim or mes_inicio))
+        return {(id_loja, mes): _de_blob(bits) for id_loja, mes, bits in cursor.fetchall()}
+
+    def carregar_catalogo(self, mes_inicio, mes_fim=None):
+        # {mes: bitset}
+        cursor = self.armazenamento.conexao().execute("""
+            SELECT mes_referencia, bits FROM bitset_catalogo
+            WHERE mes_referencia BETWEEN ? AND ?
+        """, (mes_inicio, mes_fim or mes_inicio))
+        return {mes: _de_blob(bits) for mes, bits in cursor.fetchall()}
+
+    @staticmethod
+    def calcular_mix(bits_compras, bits_catalogo):
+        total_catalogo = _popcount(bits_catalogo)
+        comprados = _popcount(bits_compras & bits_catalogo)
+        fora_catalogo = _popcount(bits_compras & ~bits_catalogo)
+        percentual = (comprados / total_catalogo) * 100 if total_catalogo else 0.0
+        return {
+            "total_ofertado": total_catalogo,
+            "total_comprado": comprados,
+            "total_fora_catalogo": fora_catalogo,
+            "percentual_comprado": percentual
+        }
+
+    def mix_periodo(self, id_loja, mes_inicio, mes_fim=None):
+        # Mix acumulado do período: união das compras contra a união dos catálogos.
+        # id_loja = 0 (ou None) junta todas as lojas
+        compras = self.carregar_compras(mes_inicio, mes_fim)
+        catalogo = self.carregar_catalogo(mes_inicio, mes_fim)
+        bits_compras = reduce(or_, (
+            bits for (loja, _), bits in compras.items() if not id_loja or loja == id_loja
+        ), 0)
+        return self.calcular_mix(bits_compras, reduce(or_, catalogo.values(), 0))
+
+    def mix_por_loja_mes(self, mes_inicio, mes_fim=None, lojas=()):
+        # {(id_loja, mes): mix} para cada mês do intervalo, com id_loja 0 = todas as lojas
+        meses = listar_meses(mes_inicio, mes_fim or mes_inicio)
+        compras = self.carregar_compras(mes_inicio, mes_fim)
+        catalogo = self.carregar_catalogo(mes_inicio, mes_fim)
+        resultado = {}
+        for mes in meses:
+            bits_catalogo = catalogo.get(mes, 0)
+            geral = reduce(or_, (bits for (_, m), bits in compras.items() if m == mes), 0)
+            resultado[(0, mes)] = self.calcular_mix(geral, bits_catalogo)
+            for id_loja in lojas:
+                resultado[(id_loja, mes)] = self.calcular_mix(compras.get((id_loja, mes), 0), bits_catalogo)
+        return resultado
+
+    def sobreposicao(self, lojas, mes_referencia):
+        # SKUs do catálogo comprados por todas as lojas informadas no mês
+        compras = self.carregar_compras(mes_referencia)
+        bits = self.carregar_catalogo(mes_referencia).get(mes_referencia, 0)
+        for id_loja in lojas:
+            bits &= compras.get((id_loja, mes_referencia), 0)
+        return _popcount(bits)
+
+    def codigos(self, bits):
+        # Converte um bitset de volta para os códigos externos
+        if self._posicoes is None:
+            cursor = self.armazenamento.conexao().cursor()
+            self._posicoes = _carregar_posicoes(cursor)
+            cursor.close()
+        por_posicao = {posicao: codigo for codigo, posicao in self._posicoes.items()}
+        codigos = []
+        for i, byte in enumerate(_para_blob(bits)):
+            while byte:
+                menor = byte & -byte
+                codigos.append(por_posicao[i * 8 + menor.bit_length() - 1])
+                byte ^= menor
+        return codigos
+
+    def codigos_fora_catalogo(self, id_loja, mes_referencia):
+        bits_compras = self.carregar_compras(mes_referencia).get((id_loja, mes_referencia), 0)
+        bits_catalogo = self.carregar_catalogo(mes_referencia).get(mes_referencia, 0)
+        return self.codigos(bits_compras & ~bits_catalogo)
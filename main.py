@@ -1,14 +1,16 @@
 from datetime import datetime
+from functools import partial
 from dateutil.relativedelta import relativedelta
 from logger import Logger
+from conexao_pg import PoolPostgres
+from armazenamento import ArmazenamentoSQLite
+from parser_nfe import ParserNFe
+from agendador import AgendadorEtapas
 
 from compras import ProdutosComprados
-from vendas import VendasPorMes
-from notabonificacao import BonificacaoPorMes
-from comprasvalor import ComprasValorPorMes
+from vendas import VendasPorMesLote
+from notaentrada import NotaEntradaPorMes
 from comparamix import ComparadorMixProdutos
-from calculodameta import CalculoMeta
-from relatorio import RelatorioMeta
 
 
 class Main:
@@ -26,71 +28,103 @@ class Main:
         logger_config = Logger()
         self.logger = logger_config.get_logger("Principal")
 
+        # Pool PostgreSQL único para todas as etapas (tamanho via PG_POOL_MIN/PG_POOL_MAX)
+        self.pool = PoolPostgres()
+        # SQLite aberto uma vez por execução (WAL), compartilhado por todas as etapas
+        self.armazenamento = ArmazenamentoSQLite()
+
     def executar_vendas(self):
         self.logger.info(f"Executando Vendas (mês: {self.mes_vendas})")
-        for loja in self.lojas:
-            self.logger.info(f"Iniciando vendas para loja {loja}")
-            vendas = VendasPorMes(id_loja=loja, mes_referencia=self.mes_vendas)
-            vendas.consultar_venda()
-
-    def executar_compras(self):
-        self.logger.info(f"Executando Compras (mês: {self.mes_referencia})")
-        for loja in self.lojas:
-            self.logger.info(f"Iniciando compras para loja {loja}")
-            compras = ProdutosComprados(id_loja=loja, mes_referencia=self.mes_referencia)
-            compras.executar_rotina()
-
-    def executar_bonificacao(self):
-        self.logger.info(f"Executando Bonificação (mês: {self.mes_referencia})")
-        for loja in self.lojas:
-            self.logger.info(f"Iniciando bonificação para loja {loja}")
-            bonificacao = BonificacaoPorMes(id_loja=loja, mes_referencia=self.mes_referencia)
-            bonificacao.verificar_bonificacao()
-
-    def executar_compras_valor(self):
-        self.logger.info(f"Executando Compras Valor (mês: {self.mes_referencia})")
-        for loja in self.lojas:
-            self.logger.info(f"Iniciando compras valor para loja {loja}")
-            compras_valor = ComprasValorPorMes(id_loja=loja, mes_referencia=self.mes_referencia)
-            compras_valor.consultar_compras()
+        vendas = VendasPorMesLote(lojas=self.lojas, mes_inicio=self.mes_vendas, pool=self.pool, armazenamento=self.armazenamento)
+        vendas.consultar_vendas()
+
+    def executar_compras_loja(self, loja, parser):
+        self.logger.info(f"Iniciando compras para loja {loja}")
+        compras = ProdutosComprados(
+            id_loja=loja, mes_referencia=self.mes_referencia, pool=self.pool, parser=parser,
+            armazenamento=self.armazenamento
+        )
+        compras.executar_rotina()
+
+    def executar_notas_entrada(self):
+        # Compras em valor e bonificações saem da mesma varredura de notaentrada
+        self.logger.info(f"Executando Compras Valor e Bonificação (mês: {self.mes_referencia})")
+        notas = NotaEntradaPorMes(
+            lojas=self.lojas, mes_inicio=self.mes_referencia, pool=self.pool, armazenamento=self.armazenamento
+        )
+        notas.consultar_notas()
 
     def executar_comparamix(self):
         self.logger.info(f"Executando Comparador Mix Produtos (mês: {self.mes_referencia})")
-        comp = ComparadorMixProdutos()
-        self.logger.info("Calculando percentual geral")
-        comp.calcular_percentual_comprados(mes_referencia=self.mes_referencia, id_loja=None)  # geral
-        for loja in self.lojas:
-            self.logger.info(f"Calculando percentual para loja {loja}")
-            comp.calcular_percentual_comprados(mes_referencia=self.mes_referencia, id_loja=loja)
+        comp = ComparadorMixProdutos(armazenamento=self.armazenamento)
+        # Geral (id_loja 0) e todas as lojas numa passada; o cálculo da meta lê de mix_por_mes
+        comp.calcular_mix_lote(self.mes_referencia, lojas=self.lojas)
 
     def executar_calculodameta(self):
+        # Lojas e consolidado da rede (id_loja=0) calculados em lote, numa única gravação
         self.logger.info(f"Executando Cálculo da Meta (mês: {self.mes_referencia})")
+        # Import tardio: numpy só entra quando a meta é calculada
+        from calculodameta import CalculoMetaLote
+        alterados = CalculoMetaLote(
+            lojas=self.lojas, mes_inicio=self.mes_referencia, armazenamento=self.armazenamento
+        ).processar()
+        if not alterados:
+            self.logger.info("Entradas da meta sem alteração; resultados mantidos.")
+
+    def executar_relatorio(self):
+        self.logger.info("Executando geração do relatório final em PDF...")
+        # Import tardio: matplotlib/WeasyPrint/Jinja só entram quando o relatório roda
+        from relatorio import RelatorioMeta
+        try:
+            gerado = RelatorioMeta(self.mes_referencia, armazenamento=self.armazenamento).gerar()
+            if gerado:
+                self.logger.info("Relatório gerado com sucesso.")
+            elif gerado is None:
+                self.logger.warning(f"Sem dados de meta para {self.mes_referencia}; relatório não gerado.")
+            else:
+                self.logger.info("Relatório sem alterações; PDF existente mantido.")
+        except Exception as e:
+            self.logger.error(f"Erro ao gerar relatório: {e}")
+            raise
+
+    def montar_agendador(self, parser):
+        # Extrações independentes entre si (e entre lojas) rodam em paralelo;
+        # meta, consolidado e PDF começam assim que suas entradas terminam
+        agendador = AgendadorEtapas()
+        agendador.adicionar("vendas", self.executar_vendas)
+        agendador.adicionar("notas_entrada", self.executar_notas_entrada)
+
+        tarefas_compras = []
         for loja in self.lojas:
-            self.logger.info(f"Iniciando cálculo da meta para loja {loja}")
-            meta = CalculoMeta(id_loja=loja)
-            meta.processar(self.mes_referencia)
+            nome = f"compras_loja_{loja}"
+            agendador.adicionar(nome, partial(self.executar_compras_loja, loja, parser))
+            tarefas_compras.append(nome)
 
-        self.logger.info("Iniciando cálculo consolidado da rede (id_loja=0)")
-        CalculoMeta.calcular_bonificacao_grupo(self.mes_referencia)
+        agendador.adicionar("comparamix", self.executar_comparamix, tarefas_compras)
 
+        agendador.adicionar(
+            "meta", self.executar_calculodameta, ["vendas", "notas_entrada", "comparamix"]
+        )
+        agendador.adicionar("relatorio", self.executar_relatorio, ["meta"])
+        return agendador
 
     def executar_todas_rotinas(self):
         self.logger.info(f"Executando todas as rotinas para lojas: {self.lojas} - mês referência: {self.mes_referencia}")
         self.logger.info(f"Mês vendas (mês anterior): {self.mes_vendas}")
 
-        self.executar_vendas()
-        self.executar_compras()
-        self.executar_bonificacao()
-        self.executar_compras_valor()
-        self.executar_comparamix()
-        self.executar_calculodameta()
-
-        self.logger.info("Executando geração do relatório final em PDF...")
+        parser = ParserNFe()
         try:
-            RelatorioMeta(self.mes_referencia).gerar()
-            self.logger.info("Relatório gerado com sucesso.")
-        except Exception as e:
-            self.logger.error(f"Erro ao gerar relatório: {e}")
+            # Pool de parsing criado aqui, antes das threads do agendador existirem
+            parser.iniciar()
+            status = self.montar_agendador(parser).executar()
+        finally:
+            parser.fechar()
+            self.pool.fechar()
+            self.armazenamento.fechar()
+
+        falhas = [nome for nome, situacao in status.items() if situacao != "ok"]
+        if falhas:
+            self.logger.warning(f"Tarefas não concluídas: {falhas}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+NOME_MANIFESTO = "manifesto.json"
+
+
+def impressao_digital(*entradas):
+    # Hash de tudo o que entra no HTML de um relatório (linhas, cards, gráficos, template)
+    return hashlib.sha1(repr(entradas).encode("utf-8")).hexdigest()
+
+
+# Manifesto dos PDFs gerados: para cada arquivo em Relatorio/ guarda a impressão
+# digital das entradas usadas no render. Se as entradas não mudaram e o PDF ainda
+# existe, o relatório não precisa passar de novo pelo WeasyPrint. Relatórios que
+# são enviados (WhatsApp) guardam também qual conteúdo já foi entregue.
+class ManifestoRelatorio:
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.caminho = os.path.join(pasta, NOME_MANIFESTO)
+
+    def _ler(self):
+        try:
+            with open(self.caminho, "r", encoding="utf-8") as arquivo:
+                return json.load(arquivo)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def atualizado(self, nome_pdf, fingerprint):
+        registro = self._ler().get(nome_pdf)
+        return (
+            registro is not None
+            and registro.get("fingerprint") == fingerprint
+            and os.path.exists(os.path.join(self.pasta, nome_pdf))
+        )
+
+    def _gravar(self, manifesto):
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(manifesto, arquivo, indent=2, sort_keys=True)
+        os.replace(temporario, self.caminho)
+
+    def registrar(self, nome_pdf, fingerprint):
+        # Relê antes de gravar para não perder entradas de outros relatórios. A marca de
+        # envio só sobrevive se o conteúdo (fingerprint) continuar o mesmo
+        manifesto = self._ler()
+        anterior = manifesto.get(nome_pdf) or {}
+        registro = {
+            "fingerprint": fingerprint,
+            "gerado_em": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if anterior.get("enviado") == fingerprint:
+            registro["enviado"] = fingerprint
+            registro["enviado_em"] = anterior.get("enviado_em")
+        manifesto[nome_pdf] = registro
+        self._gravar(manifesto)
+
+    def pendente_envio(self, nome_pdf):
+        # PDF registrado cujo conteúdo atual ainda não foi enviado
+        registro = self._ler().get(nome_pdf)
+        return registro is not None and registro.get("enviado") != registro.get("fingerprint")
+
+    def registrar_envio(self, nome_pdf):
+        # Chamar só depois que o envio terminou com sucesso
+        manifesto = self._ler()
+        registro = manifesto.get(nome_pdf)
+        if registro is None:
+            return
+        registro["enviado"] = registro.get("fingerprint")
+        registro["enviado_em"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._gravar(manifesto)
@@ -0,0 +1,50 @@
+from datetime import date
+
+
+def separar_mes(mes_referencia):
+    try:
+        ano, mes = map(int, mes_referencia.split('-'))
+    except Exception:
+        raise ValueError("mes_referencia deve estar no formato 'YYYY-MM'")
+    if not 1 <= mes <= 12:
+        raise ValueError("mes_referencia deve estar no formato 'YYYY-MM'")
+    return ano, mes
+
+
+def mes_anterior(mes_referencia, meses_antes=1):
+    ano, mes = separar_mes(mes_referencia)
+    mes -= meses_antes
+    while mes <= 0:
+        mes += 12
+        ano -= 1
+    return f"{ano:04d}-{mes:02d}"
+
+
+def proximo_mes(mes_referencia, meses_depois=1):
+    ano, mes = separar_mes(mes_referencia)
+    mes += meses_depois
+    while mes > 12:
+        mes -= 12
+        ano += 1
+    return f"{ano:04d}-{mes:02d}"
+
+
+def listar_meses(mes_inicio, mes_fim):
+    if mes_inicio > mes_fim:
+        raise ValueError("mes_inicio deve ser anterior ou igual a mes_fim")
+    meses = []
+    mes = mes_inicio
+    while mes <= mes_fim:
+        meses.append(mes)
+        mes = proximo_mes(mes)
+    return meses
+
+
+def intervalo_datas(mes_inicio, mes_fim=None):
+    # Intervalo semiaberto [primeiro dia de mes_inicio, primeiro dia após mes_fim),
+    # para filtros do tipo "data >= %s AND data < %s" que aproveitam índice
+    if mes_fim is None:
+        mes_fim = mes_inicio
+    ano_ini, mes_ini = separar_mes(mes_inicio)
+    ano_fim, mes_fim_num = separar_mes(proximo_mes(mes_fim))
+    return date(ano_ini, mes_ini, 1), date(ano_fim, mes_fim_num, 1)
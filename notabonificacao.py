@@ -1,13 +1,13 @@
 import psycopg2
-import sqlite3
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from logger import Logger
+from armazenamento import ArmazenamentoSQLite
 
 class BonificacaoPorMes:
-    def __init__(self, id_loja, mes_referencia=None):
+    def __init__(self, id_loja, mes_referencia=None, pool=None, armazenamento=None):
         load_dotenv()
 
         self.id_loja = id_loja
@@ -26,6 +26,7 @@ class BonificacaoPorMes:
             except Exception:
                 raise ValueError("mes_referencia deve estar no formato 'YYYY-MM'")
 
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
         self.pg_conn = None
         self.pg_cursor = None
         self.sqlite_conn = None
@@ -36,39 +37,32 @@ class BonificacaoPorMes:
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         # Configura o logger
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
     def conectar_postgres(self):
-        self.pg_conn = psycopg2.connect(
-            host=os.getenv("PG_HOST"),
-            port=os.getenv("PG_PORT"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
+        if self.pool:
+            self.pg_conn = self.pool.obter()
+        else:
+            self.pg_conn = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
         self.pg_cursor = self.pg_conn.cursor()
         self.logger.info(f"Conectado ao PostgreSQL para loja {self.id_loja}.")
 
     def conectar_sqlite(self):
-        self.sqlite_conn = sqlite3.connect(self.db_path)
+        self.sqlite_conn = self.armazenamento.conexao()
         self.sqlite_cursor = self.sqlite_conn.cursor()
 
-        # Cria a tabela com a nova estrutura
-        self.sqlite_cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bonificacao_por_mes (
-                mes_referencia_meta TEXT,
-                mes_lancamento TEXT,
-                id_loja INTEGER,
-                bonificacao BOOLEAN,
-                valortotal REAL,
-                PRIMARY KEY (mes_referencia_meta, id_loja)
-            )
-        """)
-        self.sqlite_conn.commit()
-        self.logger.info("Tabela bonificacao_por_mes criada/verificada no SQLite.")
-
     def mes_referencia_meta(self):
         dt = datetime(self.ano, self.mes, 1)
         dt_meta = dt - relativedelta(months=1)
@@ -106,18 +100,18 @@ class BonificacaoPorMes:
 
         mes_meta = self.mes_referencia_meta()
 
-        self.sqlite_cursor.execute("""
-            INSERT OR REPLACE INTO bonificacao_por_mes
-            (mes_referencia_meta, mes_lancamento, id_loja, bonificacao, valortotal)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            mes_meta,
-            self.mes_referencia,  # mês em que a bonificação chegou
-            self.id_loja,
-            bonificacao,
-            total
-        ))
-        self.sqlite_conn.commit()
+        with self.armazenamento.transacao():
+            self.sqlite_cursor.execute("""
+                INSERT OR REPLACE INTO bonificacao_por_mes
+                (mes_referencia_meta, mes_lancamento, id_loja, bonificacao, valortotal)
+                VALUES (?, ?, ?, ?, ?)
+            """, (
+                mes_meta,
+                self.mes_referencia,  # mês em que a bonificação chegou
+                self.id_loja,
+                bonificacao,
+                total
+            ))
 
         self.logger.info(
             f"Salvo bonificação no SQLite: loja={self.id_loja}, "
@@ -145,11 +139,14 @@ class BonificacaoPorMes:
         if self.pg_cursor:
             self.pg_cursor.close()
         if self.pg_conn:
-            self.pg_conn.close()
+            if self.pool:
+                self.pool.devolver(self.pg_conn)
+            else:
+                self.pg_conn.close()
         if self.sqlite_cursor:
             self.sqlite_cursor.close()
-        if self.sqlite_conn:
-            self.sqlite_conn.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info(f"Conexões fechadas para loja {self.id_loja}.")
 
 
@@ -0,0 +1,158 @@
+import psycopg2
+import os
+from dotenv import load_dotenv
+from logger import Logger
+from meses import intervalo_datas, listar_meses, mes_anterior
+from armazenamento import ArmazenamentoSQLite
+
+
+# Uma única varredura de public.notaentrada (fornecedor 2) para todas as lojas e meses,
+# separando compras (id_tipoentrada != 3) e bonificações (id_tipoentrada = 3) por
+# agregação condicional. Alimenta compras_valor_por_mes e bonificacao_por_mes.
+class NotaEntradaPorMes:
+    def __init__(self, lojas, mes_inicio, mes_fim=None, pool=None, armazenamento=None):
+        load_dotenv()
+        self.lojas = list(lojas)
+        if not self.lojas:
+            raise ValueError("Informe ao menos uma loja")
+
+        self.mes_inicio = mes_inicio
+        self.mes_fim = mes_fim or mes_inicio
+        self.meses = listar_meses(self.mes_inicio, self.mes_fim)
+        self.data_ini, self.data_fim = intervalo_datas(self.mes_inicio, self.mes_fim)
+
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
+        self.pg_conn = None
+        self.pg_cursor = None
+        self.sqlite_conn = None
+        self.sqlite_cursor = None
+
+        self.db_path = os.getenv("DB_LITE_PATH")
+        if not self.db_path:
+            raise ValueError("Variável DB_LITE_PATH não configurada no .env")
+
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def conectar_postgres(self):
+        if self.pool:
+            self.pg_conn = self.pool.obter()
+        else:
+            self.pg_conn = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
+        self.pg_cursor = self.pg_conn.cursor()
+        self.logger.info(f"Conectado ao PostgreSQL para lojas {self.lojas}.")
+
+    def conectar_sqlite(self):
+        self.sqlite_conn = self.armazenamento.conexao()
+        self.sqlite_cursor = self.sqlite_conn.cursor()
+
+    def buscar_notas_pg(self):
+        query = """
+            SELECT
+                id_loja,
+                DATE_TRUNC('month', dataemissao)::date AS mes,
+                SUM(valortotal) FILTER (WHERE id_tipoentrada != 3) AS total_compras,
+                COUNT(*) FILTER (WHERE id_tipoentrada != 3) AS notas_compras,
+                SUM(valortotal) FILTER (WHERE id_tipoentrada = 3) AS total_bonificacao,
+                COUNT(*) FILTER (WHERE id_tipoentrada = 3) AS notas_bonificacao
+            FROM public.notaentrada
+            WHERE dataemissao >= %s
+              AND dataemissao < %s
+              AND id_fornecedor = 2
+              AND id_loja = ANY(%s)
+            GROUP BY id_loja, DATE_TRUNC('month', dataemissao)
+            ORDER BY id_loja, mes;
+        """
+        self.pg_cursor.execute(query, (self.data_ini, self.data_fim, self.lojas))
+        resultado = self.pg_cursor.fetchall()
+        self.logger.info(
+            f"Buscadas {len(resultado)} linhas de notas de entrada para lojas {self.lojas} "
+            f"entre {self.mes_inicio} e {self.mes_fim}."
+        )
+        return resultado
+
+    def salvar_sqlite(self, dados_pg):
+        compras = []
+        totais_bonificacao = {}
+        for id_loja, mes, total_compras, notas_compras, total_bonif, notas_bonif in dados_pg:
+            chave = (int(id_loja), mes.strftime("%Y-%m"))
+            if notas_compras:
+                compras.append(chave + (float(total_compras) if total_compras is not None else 0.0,))
+            if notas_bonif:
+                totais_bonificacao[chave] = float(total_bonif) if total_bonif is not None else 0.0
+
+        # Bonificação é gravada para toda loja/mês (False quando não houve nota),
+        # referenciando o mês anterior da meta
+        bonificacoes = []
+        for loja in self.lojas:
+            for mes in self.meses:
+                total = totais_bonificacao.get((loja, mes))
+                bonificacoes.append((
+                    mes_anterior(mes),
+                    mes,  # mês em que a bonificação chegou
+                    loja,
+                    total is not None,
+                    total or 0.0
+                ))
+
+        with self.armazenamento.transacao():
+            self.sqlite_cursor.executemany("""
+                INSERT OR REPLACE INTO compras_valor_por_mes
+                (id_loja, mes_referencia, valor_total)
+                VALUES (?, ?, ?)
+            """, compras)
+            self.sqlite_cursor.executemany("""
+                INSERT OR REPLACE INTO bonificacao_por_mes
+                (mes_referencia_meta, mes_lancamento, id_loja, bonificacao, valortotal)
+                VALUES (?, ?, ?, ?, ?)
+            """, bonificacoes)
+
+        self.logger.info(
+            f"Salvos {len(compras)} registros em compras_valor_por_mes e "
+            f"{len(bonificacoes)} em bonificacao_por_mes."
+        )
+        return len(compras), len(bonificacoes)
+
+    def consultar_notas(self):
+        try:
+            self.conectar_postgres()
+            self.conectar_sqlite()
+
+            dados = self.buscar_notas_pg()
+            self.salvar_sqlite(dados)
+
+            self.logger.info(f"Processo finalizado para lojas {self.lojas} entre {self.mes_inicio} e {self.mes_fim}.")
+        except Exception as e:
+            self.logger.error(f"Erro para lojas {self.lojas}: {e}")
+            # Propaga para o agendador ignorar as etapas que dependem das notas
+            raise
+        finally:
+            self.fechar_conexoes()
+
+    def fechar_conexoes(self):
+        if self.pg_cursor:
+            self.pg_cursor.close()
+        if self.pg_conn:
+            if self.pool:
+                self.pool.devolver(self.pg_conn)
+            else:
+                self.pg_conn.close()
+        if self.sqlite_cursor:
+            self.sqlite_cursor.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
+        self.logger.info(f"Conexões fechadas para lojas {self.lojas}.")
+
+
+if __name__ == "__main__":
+    NotaEntradaPorMes(lojas=[1, 2, 3], mes_inicio="2025-01", mes_fim="2025-07").consultar_notas()
@@ -0,0 +1,160 @@
+import gzip
+import os
+import re
+from html.parser import HTMLParser
+
+try:
+    from lxml import html as lxml_html
+except ImportError:  # sem lxml usa o tokenizador da biblioteca padrão
+    lxml_html = None
+
+SECOES_IGNORADAS = ("FRUTAS", "VERDURAS")
+ID_TABELA_PRODUTO = "tabela_produto"
+PREFIXO_CODIGO = "codigo["
+PREFIXO_DESCRICAO = "descricaocompleta["
+
+PADRAO_SNAPSHOT = re.compile(r"^produtosrede-(\d{4}-\d{2})\.html\.gz$")
+
+
+# Regras da página do catálogo da rede: tabelas "grid" sem id são títulos de seção
+# (FRUTAS/VERDURAS fazem a próxima tabela de produtos ser ignorada) e as tabelas
+# "tabela_produto" trazem os spans codigo[n] / descricaocompleta[n], pareados na ordem.
+def _secao_ignorada(titulo):
+    titulo = titulo.upper()
+    return any(secao in titulo for secao in SECOES_IGNORADAS)
+
+
+def _extrair_lxml(html):
+    documento = lxml_html.fromstring(html)
+    produtos = []
+    ignorar_proximo_produto = False
+    for tabela in documento.iter("table"):
+        if "grid" not in (tabela.get("class") or "").split():
+            continue
+        id_tabela = tabela.get("id")
+        if id_tabela is None:
+            titulo = "".join(texto.strip() for texto in tabela.itertext())
+            ignorar_proximo_produto = _secao_ignorada(titulo)
+        elif id_tabela == ID_TABELA_PRODUTO and not ignorar_proximo_produto:
+            codigos = tabela.xpath(f'.//span[starts-with(@id, "{PREFIXO_CODIGO}")]')
+            descricoes = tabela.xpath(f'.//span[starts-with(@id, "{PREFIXO_DESCRICAO}")]')
+            for c, d in zip(codigos, descricoes):
+                produtos.append(("".join(c.itertext()).strip(), "".join(d.itertext()).strip()))
+    return produtos
+
+
+class _TokenizadorCatalogo(HTMLParser):
+    # Percorre a página uma única vez, sem montar árvore: só acompanha a pilha de
+    # tabelas e o texto dos spans de código/descrição
+    def __init__(self):
+        super().__init__()
+        self.produtos = []
+        self.ignorar_proximo_produto = False
+        self.tabelas = []  # contexto de cada <table> aberta (None se não for "grid")
+        self.span = None  # [destino, profundidade, partes] do span sendo lido
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            attrs = dict(attrs)
+            if "grid" not in (attrs.get("class") or "").split():
+                self.tabelas.append(None)
+            elif "id" not in attrs:
+                self.tabelas.append({"tipo": "titulo", "texto": []})
+            elif attrs["id"] == ID_TABELA_PRODUTO:
+                self.tabelas.append({
+                    "tipo": "produto",
+                    "ignorar": self.ignorar_proximo_produto,
+                    "codigos": [],
+                    "descricoes": []
+                })
+            else:
+                self.tabelas.append(None)
+        elif tag == "span":
+            if self.span is not None:
+                self.span[1] += 1
+                return
+            tabela = self._tabela_produto()
+            if tabela is None:
+                return
+            id_span = dict(attrs).get("id") or ""
+            if id_span.startswith(PREFIXO_CODIGO):
+                self.span = [tabela["codigos"], 1, []]
+            elif id_span.startswith(PREFIXO_DESCRICAO):
+                self.span = [tabela["descricoes"], 1, []]
+
+    def handle_endtag(self, tag):
+        if tag == "span" and self.span is not None:
+            self.span[1] -= 1
+            if self.span[1] == 0:
+                destino, _, partes = self.span
+                destino.append("".join(partes).strip())
+                self.span = None
+        elif tag == "table" and self.tabelas:
+            tabela = self.tabelas.pop()
+            if tabela is None:
+                return
+            if tabela["tipo"] == "titulo":
+                self.ignorar_proximo_produto = _secao_ignorada("".join(tabela["texto"]))
+            elif not tabela["ignorar"]:
+                self.produtos.extend(zip(tabela["codigos"], tabela["descricoes"]))
+
+    def handle_data(self, data):
+        if self.span is not None:
+            self.span[2].append(data)
+        texto = data.strip()
+        if texto:
+            for tabela in self.tabelas:
+                if tabela is not None and tabela["tipo"] == "titulo":
+                    tabela["texto"].append(texto)
+
+    def _tabela_produto(self):
+        for tabela in reversed(self.tabelas):
+            if tabela is not None and tabela["tipo"] == "produto":
+                return tabela
+        return None
+
+
+def extrair_produtos(html):
+    # Lista de (codigo, descricao) da página do catálogo, na ordem em que aparecem
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    if not html.strip():
+        return []
+    if lxml_html is not None:
+        return _extrair_lxml(html)
+    tokenizador = _TokenizadorCatalogo()
+    tokenizador.feed(html)
+    tokenizador.close()
+    return tokenizador.produtos
+
+
+def caminho_snapshot(pasta, mes_referencia):
+    return os.path.join(pasta, f"produtosrede-{mes_referencia}.html.gz")
+
+
+def salvar_snapshot(pasta, mes_referencia, html):
+    # Grava em arquivo temporário e troca no fim: nunca deixa um .gz truncado
+    os.makedirs(pasta, exist_ok=True)
+    caminho = caminho_snapshot(pasta, mes_referencia)
+    temporario = caminho + ".tmp"
+    with gzip.open(temporario, "wt", encoding="utf-8") as arquivo:
+        arquivo.write(html)
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def ler_snapshot(pasta, mes_referencia):
+    with gzip.open(caminho_snapshot(pasta, mes_referencia), "rt", encoding="utf-8") as arquivo:
+        return arquivo.read()
+
+
+def listar_snapshots(pasta):
+    # Meses com página gravada, em ordem cronológica
+    if not os.path.isdir(pasta):
+        return []
+    meses = []
+    for nome in os.listdir(pasta):
+        encontrado = PADRAO_SNAPSHOT.match(nome)
+        if encontrado:
+            meses.append(encontrado.group(1))
+    return sorted(meses)
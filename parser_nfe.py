@@ -0,0 +1,103 @@
+import os
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+NS_NFE = '{http://www.portalfiscal.inf.br/nfe}'
+TAG_DET = NS_NFE + 'det'
+TAG_PROD = NS_NFE + 'prod'
+TAG_CPROD = NS_NFE + 'cProd'
+
+
+def extrair_cprods(xml):
+    # Leitura incremental: só guarda o texto de det/prod/cProd e limpa cada
+    # elemento ao fechar, então a árvore completa da nota nunca é montada
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    codigos = []
+    pilha = []
+    for evento, elem in ET.iterparse(BytesIO(xml), events=('start', 'end')):
+        if evento == 'start':
+            pilha.append(elem.tag)
+            continue
+        pilha.pop()
+        if elem.tag == TAG_CPROD and pilha[-2:] == [TAG_DET, TAG_PROD] and elem.text:
+            codigos.append(elem.text.strip())
+        elem.clear()
+    return codigos
+
+
+def _contexto_processos():
+    # Workers nascem de um servidor limpo (forkserver) ou do zero (spawn), nunca por
+    # fork de um processo que já tem threads do agendador, pool PG e locks de log
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+
+def _processar_lote(lote):
+    resultado = []
+    for numeronota, xml in lote:
+        try:
+            resultado.append((numeronota, extrair_cprods(xml), None))
+        except Exception as e:
+            resultado.append((numeronota, [], str(e)))
+    return resultado
+
+
+# Distribui o parsing das NF-e entre processos, em lotes, devolvendo
+# (numeronota, [cProd...], erro) na mesma ordem das notas recebidas
+class ParserNFe:
+    def __init__(self, processos=None, tamanho_lote=None):
+        self.processos = int(processos if processos is not None else os.getenv("NFE_PROCESSOS", os.cpu_count() or 1))
+        self.tamanho_lote = int(tamanho_lote if tamanho_lote is not None else os.getenv("NFE_TAMANHO_LOTE", 50))
+        if self.processos < 1 or self.tamanho_lote < 1:
+            raise ValueError("processos e tamanho_lote devem ser maiores que zero")
+        self._executor = None
+        # O mesmo parser pode ser usado por várias lojas em paralelo (threads)
+        self._lock = threading.Lock()
+
+    def _lotes(self, notas):
+        iterador = iter(notas)
+        while True:
+            # memoryview (bytea do psycopg2) não é serializável entre processos
+            lote = [
+                (numeronota, bytes(xml) if isinstance(xml, memoryview) else xml)
+                for numeronota, xml in islice(iterador, self.tamanho_lote)
+            ]
+            if not lote:
+                return
+            yield lote
+
+    def iniciar(self):
+        # Sobe o pool de processos; chamar antes de disparar as threads do pipeline
+        with self._lock:
+            if self._executor is None and self.processos > 1:
+                self._executor = ProcessPoolExecutor(max_workers=self.processos, mp_context=_contexto_processos())
+            return self._executor
+
+    def processar(self, notas):
+        if self.processos == 1:
+            for lote in self._lotes(notas):
+                yield from _processar_lote(lote)
+            return
+
+        executor = self.iniciar()
+
+        # Limita os lotes em andamento para não puxar todas as notas do cursor de uma vez
+        pendentes = deque()
+        for lote in self._lotes(notas):
+            pendentes.append(executor.submit(_processar_lote, lote))
+            if len(pendentes) >= self.processos * 2:
+                yield from pendentes.popleft().result()
+        while pendentes:
+            yield from pendentes.popleft().result()
+
+    def fechar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -1,26 +1,25 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import WebDriverException, TimeoutException
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
 from datetime import datetime
-import sqlite3
+from urllib.parse import urljoin
 import os
 import time
 from logger import Logger  # importando logger centralizado
+from armazenamento import ArmazenamentoSQLite
+from catalogo import CatalogoRede
+from parser_catalogo import extrair_produtos, salvar_snapshot, ler_snapshot, listar_snapshots, caminho_snapshot
 
 
 class ProdutosRedeScraper:
-    def __init__(self, mes_referencia):
+    def __init__(self, mes_referencia, armazenamento=None):
         load_dotenv()
         self.db_path = os.getenv("DB_LITE_PATH")
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         self.mes_referencia = mes_referencia
         if self.mes_referencia is None:
             self.mes_referencia = datetime.now().strftime("%Y-%m")
@@ -33,26 +32,98 @@ class ProdutosRedeScraper:
         self.usuario = os.getenv("USUARIO_VR")
         self.senha = os.getenv("SENHA_VR")
 
+        # Endereços configuráveis para poder apontar para um servidor local com páginas gravadas
+        self.url_base = os.getenv("REDE_URL_BASE", "http://redeintegrada.ddns.net:38080/php/vrcentralrede/")
+        self.url_login = os.getenv("REDE_URL_LOGIN") or urljoin(self.url_base, "login.php")
+        self.url_listagem = os.getenv("REDE_URL_LISTAGEM")  # vazio: segue o link "Novo" após o login
+        self.timeout_http = float(os.getenv("REDE_HTTP_TIMEOUT", 30))
+
+        # Página bruta de cada mês, comprimida, para reprocessar sem acessar o site
+        self.pasta_snapshots = os.getenv("PRODUTOSREDE_SNAPSHOTS") or os.path.join(os.getcwd(), "Snapshots")
+
+        # "http" (sessão HTTP, Selenium só como contingência) ou "selenium"
+        self.motor = os.getenv("PRODUTOSREDE_MOTOR", "http").lower()
+        if self.motor not in ("http", "selenium"):
+            raise ValueError(f"PRODUTOSREDE_MOTOR inválido: {self.motor}")
+
         self.conn = None
         self.cursor = None
         self.driver = None
+        self.sessao = None
 
     def _setup_db(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = self.armazenamento.conexao()
         self.cursor = self.conn.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS produtosrede_historico (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                codigoexterno TEXT,
-                descricao TEXT,
-                mes_referencia TEXT,
-                data_coleta TEXT,
-                UNIQUE (codigoexterno, mes_referencia)
-            )
-        ''')
-        self.conn.commit()
+
+    def _setup_sessao(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Sessão com pool de conexões keep-alive: login e listagem reaproveitam o mesmo socket
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=2)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+    @staticmethod
+    def _login_invalido(html):
+        return "Usuário ou senha inválidos" in html or "Login inválido" in html
+
+    @staticmethod
+    def _link_novo(html, url_atual):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        for link in soup.find_all('a', href=True):
+            if 'Novo' in link.get_text():
+                return urljoin(url_atual, link['href'])
+        return None
+
+    @staticmethod
+    def _exibicao_completa(html):
+        # A listagem só vale como catálogo do mês se veio na exibição completa
+        # (select tipoExibicao com a opção "1" selecionada)
+        from bs4 import BeautifulSoup
+
+        select = BeautifulSoup(html, 'html.parser').find('select', id='tipoExibicao')
+        if select is None:
+            return False
+        opcao = select.find('option', selected=True)
+        return opcao is not None and opcao.get('value') == "1"
+
+    def baixar_pagina_http(self):
+        # Mesmo fluxo do navegador (login, "Novo", tipoExibicao=1) em requisições diretas
+        if self.sessao is None:
+            self._setup_sessao()
+        self.logger.info("Iniciando a coleta de produtos via HTTP.")
+
+        resposta = self.sessao.get(self.url_login, timeout=self.timeout_http)
+        resposta.raise_for_status()
+
+        resposta = self.sessao.post(
+            self.url_login,
+            data={"usuario": self.usuario, "senha": self.senha},
+            timeout=self.timeout_http
+        )
+        resposta.raise_for_status()
+        if self._login_invalido(resposta.text):
+            self.logger.error("Falha no login: usuário ou senha incorretos.")
+            return None
+
+        url_listagem = self.url_listagem or self._link_novo(resposta.text, resposta.url)
+        if not url_listagem:
+            raise ValueError("Link 'Novo' não encontrado após o login.")
+
+        resposta = self.sessao.post(url_listagem, data={"tipoExibicao": "1"}, timeout=self.timeout_http)
+        resposta.raise_for_status()
+        return resposta.text
 
     def _setup_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from webdriver_manager.chrome import ChromeDriverManager
+
         chrome_options = Options()
         chrome_options.add_argument("--headless")
         chrome_options.add_argument("--disable-gpu")
@@ -63,92 +134,137 @@ class ProdutosRedeScraper:
             options=chrome_options
         )
 
+    def baixar_pagina(self):
+        # Faz login no navegador e devolve o HTML da listagem completa (None se o login falhar)
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import Select
+
+        if self.driver is None:
+            self._setup_driver()
+        self.logger.info("Iniciando a coleta de produtos via Selenium.")
+        self.driver.get(self.url_login)
+        time.sleep(2)
+
+        # Login
+        self.driver.find_element(By.ID, "usuario").send_keys(self.usuario)
+        self.driver.find_element(By.ID, "senha").send_keys(self.senha)
+        self.driver.find_element(By.ID, "btnAutenticar").click()
+        time.sleep(3)
+
+        if self._login_invalido(self.driver.page_source):
+            self.logger.error("Falha no login: usuário ou senha incorretos.")
+            return None
+
+        self.driver.find_element(By.XPATH, "//a[contains(text(),'Novo')]").click()
+        time.sleep(2)
+
+        select_element = Select(self.driver.find_element(By.ID, "tipoExibicao"))
+        select_element.select_by_value("1")
+        time.sleep(5)
+
+        return self.driver.page_source
+
+    def salvar_produtos(self, produtos, substituir=False):
+        # Grava o catálogo do mês no catálogo versionado; não depende do navegador,
+        # então pode ser chamado com qualquer lista de (codigo, descricao)
+        if self.cursor is None:
+            self._setup_db()
+
+        # Código repetido na página: vale a última descrição
+        por_codigo = dict(produtos)
+        inseridos, atualizados = CatalogoRede(self.armazenamento).gravar_mes(
+            self.mes_referencia, por_codigo, self.data_coleta, substituir=substituir
+        )
+
+        self.logger.info(
+            f"{len(produtos)} produtos processados com base em {self.mes_referencia}: "
+            f"{inseridos} inseridos, {atualizados} atualizados."
+        )
+        return inseridos, atualizados
+
+    def arquivar_pagina(self, html):
+        # Falha ao gravar o snapshot não impede a coleta do mês
+        try:
+            caminho = salvar_snapshot(self.pasta_snapshots, self.mes_referencia, html)
+            self.logger.info(f"Página do catálogo salva em {caminho}.")
+        except OSError as e:
+            self.logger.warning(f"Não foi possível salvar a página do catálogo: {e}")
+
+    def obter_produtos(self):
+        # Tenta a sessão HTTP; qualquer erro (ou listagem incompleta) cai para o Selenium.
+        # Login inválido não tem contingência: devolve None nos dois motores
+        if self.motor == "http":
+            try:
+                html = self.baixar_pagina_http()
+                if html is None:
+                    return None
+                # Página parcial (exibição resumida ou sem produtos) não pode virar o
+                # catálogo do mês nem o snapshot arquivado
+                produtos = extrair_produtos(html) if self._exibicao_completa(html) else []
+                if produtos:
+                    self.arquivar_pagina(html)
+                    return produtos
+                self.logger.warning("Listagem via HTTP incompleta (sem exibição completa ou sem produtos); usando Selenium.")
+            except Exception as e:
+                self.logger.warning(f"Falha na coleta via HTTP ({e}); usando Selenium.")
+
+        html = self.baixar_pagina()
+        if html is None:
+            return None
+        self.arquivar_pagina(html)
+        return extrair_produtos(html)
+
     def coletar_produtos(self):
         self._setup_db()
-        self._setup_driver()
 
         try:
-            self.logger.info("Iniciando a coleta de produtos.")
-            self.driver.get("http://redeintegrada.ddns.net:38080/php/vrcentralrede/login.php")
-            time.sleep(2)
-
-            # Login
-            self.driver.find_element(By.ID, "usuario").send_keys(self.usuario)
-            self.driver.find_element(By.ID, "senha").send_keys(self.senha)
-            self.driver.find_element(By.ID, "btnAutenticar").click()
-            time.sleep(3)
-
-            if "Usuário ou senha inválidos" in self.driver.page_source or "Login inválido" in self.driver.page_source:
-                self.logger.error("Falha no login: usuário ou senha incorretos.")
+            produtos = self.obter_produtos()
+            if produtos is None:
                 return False
 
-            self.driver.find_element(By.XPATH, "//a[contains(text(),'Novo')]").click()
-            time.sleep(2)
-
-            select_element = Select(self.driver.find_element(By.ID, "tipoExibicao"))
-            select_element.select_by_value("1")
-            time.sleep(5)
-
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-            tabelas = soup.find_all('table', class_='grid')
-
-            todos_codigos = []
-            todos_descricoes = []
-            ignorar_proximo_produto = False
-
-            for tabela in tabelas:
-                if not tabela.has_attr('id'):
-                    titulo = tabela.get_text(strip=True).upper()
-                    if "FRUTAS" in titulo or "VERDURAS" in titulo:
-                        ignorar_proximo_produto = True
-                    else:
-                        ignorar_proximo_produto = False
-
-                elif tabela.get('id') == 'tabela_produto':
-                    if ignorar_proximo_produto:
-                        continue
-
-                    codigos = tabela.select('span[id^="codigo["]')
-                    descricoes = tabela.select('span[id^="descricaocompleta["]')
-
-                    for c, d in zip(codigos, descricoes):
-                        codigo = c.text.strip()
-                        descricao = d.text.strip()
-                        todos_codigos.append(codigo)
-                        todos_descricoes.append(descricao)
-
-            # Inserção/atualização no banco
-            for codigo, descricao in zip(todos_codigos, todos_descricoes):
-                self.cursor.execute('''
-                    INSERT OR IGNORE INTO produtosrede_historico 
-                    (codigoexterno, descricao, mes_referencia, data_coleta)
-                    VALUES (?, ?, ?, ?)
-                ''', (codigo, descricao, self.mes_referencia, self.data_coleta))
-
-                if self.cursor.rowcount == 0:
-                    self.cursor.execute('''
-                        UPDATE produtosrede_historico
-                        SET descricao = ?, data_coleta = ?
-                        WHERE codigoexterno = ? AND mes_referencia = ?
-                    ''', (descricao, self.data_coleta, codigo, self.mes_referencia))
-
-            self.conn.commit()
-            self.logger.info(f"{len(todos_codigos)} produtos processados com base em {self.mes_referencia}.")
+            self.salvar_produtos(produtos)
             return True
 
-        except (WebDriverException, TimeoutException) as e:
-            self.logger.error(f"Erro ao acessar o site ou timeout: {e}")
-            return False
-
         except Exception as e:
-            self.logger.error(f"Erro inesperado: {e}")
+            self.logger.error(f"Erro ao acessar o site ou salvar produtos: {e}")
             return False
 
         finally:
+            if self.sessao:
+                self.sessao.close()
             if self.driver:
                 self.driver.quit()
-            if self.conn:
-                self.conn.close()
+            if self.cursor:
+                self.cursor.close()
+            if self._armazenamento_proprio:
+                self.armazenamento.fechar()
+
+    @staticmethod
+    def reprocessar_snapshots(meses=None, armazenamento=None, substituir=False):
+        # Regrava o catálogo da rede a partir das páginas salvas, sem rede nem navegador.
+        # meses=None reprocessa todos os snapshots encontrados; substituir=True faz o
+        # catálogo de cada mês ficar exatamente igual ao da página salva
+        armazenamento_proprio = armazenamento is None
+        if armazenamento_proprio:
+            armazenamento = ArmazenamentoSQLite()
+
+        resultado = {}
+        try:
+            pasta = ProdutosRedeScraper(None, armazenamento).pasta_snapshots
+            for mes in meses or listar_snapshots(pasta):
+                scraper = ProdutosRedeScraper(mes, armazenamento)
+                # data_coleta passa a ser a data em que a página foi baixada
+                modificado = os.path.getmtime(caminho_snapshot(pasta, mes))
+                scraper.data_coleta = datetime.fromtimestamp(modificado).strftime("%Y-%m-%d")
+                scraper._setup_db()
+                try:
+                    resultado[mes] = scraper.salvar_produtos(extrair_produtos(ler_snapshot(pasta, mes)), substituir)
+                finally:
+                    scraper.cursor.close()
+        finally:
+            if armazenamento_proprio:
+                armazenamento.fechar()
+        return resultado
 
 
 if __name__ == "__main__":
@@ -1,24 +1,137 @@
-import sqlite3
 import os
 import base64
 from io import BytesIO
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
-import matplotlib.pyplot as plt
-from weasyprint import HTML
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 from logger import Logger
-import numpy as np
+from armazenamento import ArmazenamentoSQLite
+from cache_graficos import CacheGraficos
+from manifesto_relatorio import ManifestoRelatorio, impressao_digital
+
+
+def criar_ambiente(pasta):
+    # Jinja carregado só quando um relatório é montado; o lote reaproveita o mesmo ambiente
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    return Environment(
+        loader=FileSystemLoader(pasta),
+        autoescape=select_autoescape(['html'])
+    )
+
+
+def configuracao_fontes():
+    # Uma FontConfiguration por processo evita refazer a busca de fontes a cada PDF
+    try:
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:
+        from weasyprint.fonts import FontConfiguration
+    return FontConfiguration()
+
+
+def escrever_pdf(html, caminho, font_config=None):
+    # WeasyPrint é o import mais caro do relatório: só quando há PDF a gravar
+    from weasyprint import HTML
+    HTML(string=html).write_pdf(caminho, font_config=font_config)
+    return caminho
+
+
+def _pyplot():
+    # matplotlib só é carregado quando algum gráfico não está no cache
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _figura_base64(plt, fig):
+    plt.tight_layout()
+    buf = BytesIO()
+    plt.savefig(buf, format='png')
+    plt.close(fig)
+    buf.seek(0)
+    return base64.b64encode(buf.read()).decode()
+
+
+def desenhar_colunas_meta_valor(lojas, metas, valores_batidos, titulo):
+    plt = _pyplot()
+    x = range(len(lojas))
+    largura = 0.35
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    barras_meta = ax.bar([i - largura/2 for i in x], metas, width=largura, label='Meta Valor (R$)', color='lightgreen')
+    barras_batido = ax.bar([i + largura/2 for i in x], valores_batidos, width=largura, label='Valor Batido (R$)', color='darkgreen')
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(lojas)
+    ax.set_ylabel('Valor (R$)')
+    ax.set_title(titulo)
+    ax.legend()
+
+    def rotular_barras(barras):
+        for barra in barras:
+            altura = barra.get_height()
+            ax.annotate(f'R$ {altura:,.0f}',
+                        xy=(barra.get_x() + barra.get_width() / 2, altura),
+                        xytext=(0, 3),
+                        textcoords="offset points",
+                        ha='center', va='bottom', fontsize=9)
+
+    rotular_barras(barras_meta)
+    rotular_barras(barras_batido)
+
+    return _figura_base64(plt, fig)
+
+
+def desenhar_colunas_meta_mix(lojas, valores_mix, titulo, meta_fixa):
+    plt = _pyplot()
+    x = range(len(lojas))
+    largura = 0.35
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    barras_meta = ax.bar([i - largura/2 for i in x], [meta_fixa]*len(lojas), largura,
+                        label=f'Meta Mix SKUs ({meta_fixa}%)', color='lightcoral')
+
+    barras_valor = ax.bar([i + largura/2 for i in x], valores_mix, largura,
+                        label='% Mix SKUs Comprados', color='coral')
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(lojas)
+    ax.set_ylim(0, 100)
+    ax.set_ylabel('Percentual (%)')
+    ax.set_title(titulo)
+    ax.legend()
+
+    def rotular_barras(barras):
+        for barra in barras:
+            altura = barra.get_height()
+            ax.annotate(f'{altura:.2f}%',
+                        xy=(barra.get_x() + barra.get_width()/2, altura),
+                        xytext=(0, 3),
+                        textcoords='offset points',
+                        ha='center', va='bottom', fontsize=9)
+
+    rotular_barras(barras_meta)
+    rotular_barras(barras_valor)
+
+    return _figura_base64(plt, fig)
+
 
 class RelatorioMeta:
-    def __init__(self, mes_referencia):
+    def __init__(self, mes_referencia, armazenamento=None, id_loja=None, env=None):
         load_dotenv()
         self.mes_referencia = mes_referencia
+        # id_loja: variante com uma loja só (0 = consolidado); None = relatório da rede
+        self.id_loja = id_loja
         self.db_path = os.getenv("DB_LITE_PATH")
         if not self.db_path:
             raise ValueError("DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         self.logger = Logger().get_logger(self.__class__.__name__)
 
         # Silenciar logs muito verbosos de libs usadas
@@ -32,32 +145,42 @@ class RelatorioMeta:
         self.pasta = os.path.join(os.getcwd(), "Relatorio")
         os.makedirs(self.pasta, exist_ok=True)
 
-        self.env = Environment(
-            loader=FileSystemLoader(self.pasta),
-            autoescape=select_autoescape(['html'])
-        )
+        self.env = env or criar_ambiente(self.pasta)
         self.template = self.env.get_template("template.html")
 
+        # PNGs dos gráficos em base64, reaproveitados enquanto as séries não mudam
+        self.cache_graficos = CacheGraficos()
+        self.manifesto = ManifestoRelatorio(self.pasta)
+        # Marcado por preparar(): o último None foi por falta de dados, não por PDF em dia
+        self.sem_dados = False
+
     def conectar(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = self.armazenamento.conexao()
         self.cur = self.conn.cursor()
         self.logger.info("Conectado ao SQLite")
 
     def fechar(self):
         self.cur.close()
-        self.conn.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info("Conexão SQLite fechada")
 
+    def _filtro_loja(self):
+        if self.id_loja is None:
+            return "", ()
+        return " AND id_loja = ?", (self.id_loja,)
+
     def buscar_dados(self):
-        self.cur.execute("""
+        filtro, params = self._filtro_loja()
+        self.cur.execute(f"""
             SELECT id_loja,
                    metavalor, metavalorbatido, percentual_metavalor,
                    skumetamix, skumetamixcomprado,
                    percentual_metamix, bonificacao_pct, valor_bonificacao, motivo
             FROM resultado_meta_por_mes
-            WHERE mes_referencia = ?
+            WHERE mes_referencia = ?{filtro}
             ORDER BY id_loja
-        """, (self.mes_referencia,))
+        """, (self.mes_referencia,) + params)
         rows = self.cur.fetchall()
         dados = []
         for r in rows:
@@ -79,12 +202,13 @@ class RelatorioMeta:
 
     def buscar_bonificacoes_mes(self):
         self.logger.info(f"Buscando bonificações para o mês meta {self.mes_referencia}...")
-        self.cur.execute("""
+        filtro, params = self._filtro_loja()
+        self.cur.execute(f"""
             SELECT id_loja, SUM(valortotal)
             FROM bonificacao_por_mes
-            WHERE mes_referencia_meta = ?
+            WHERE mes_referencia_meta = ?{filtro}
             GROUP BY id_loja
-        """, (self.mes_referencia,))
+        """, (self.mes_referencia,) + params)
         rows = self.cur.fetchall()
         dados = {}
         for r in rows:
@@ -128,148 +252,130 @@ class RelatorioMeta:
             "skus_comprados_total": total_sku_comprado
         }
 
-    def grafico_colunas_meta_valor(self):
-        self.cur.execute("""
+    def series_meta_valor(self):
+        filtro, params = self._filtro_loja()
+        self.cur.execute(f"""
             SELECT id_loja, metavalor, metavalorbatido
             FROM resultado_meta_por_mes
-            WHERE mes_referencia = ?
+            WHERE mes_referencia = ?{filtro}
             ORDER BY id_loja
-        """, (self.mes_referencia,))
-        rows = self.cur.fetchall()
-
+        """, (self.mes_referencia,) + params)
         lojas = []
         metas = []
         valores_batidos = []
-
-        for id_loja, meta_val, valor_batido in rows:
-            loja_nome = "Deus Te Pague" if id_loja == 0 else f"Loja {id_loja}"
-            lojas.append(loja_nome)
+        for id_loja, meta_val, valor_batido in self.cur.fetchall():
+            lojas.append("Deus Te Pague" if id_loja == 0 else f"Loja {id_loja}")
             metas.append(meta_val or 0)
             valores_batidos.append(valor_batido or 0)
+        return lojas, metas, valores_batidos
 
-        x = range(len(lojas))
-        largura = 0.35
-
-        fig, ax = plt.subplots(figsize=(10, 6))
-
-        barras_meta = ax.bar([i - largura/2 for i in x], metas, width=largura, label='Meta Valor (R$)', color='lightgreen')
-        barras_batido = ax.bar([i + largura/2 for i in x], valores_batidos, width=largura, label='Valor Batido (R$)', color='darkgreen')
-
-        ax.set_xticks(x)
-        ax.set_xticklabels(lojas)
-        ax.set_ylabel('Valor (R$)')
-        ax.set_title(f'Meta Valor e Valor Batido - {self.mes_referencia}')
-        ax.legend()
-
-        def rotular_barras(barras):
-            for barra in barras:
-                altura = barra.get_height()
-                ax.annotate(f'R$ {altura:,.0f}',
-                            xy=(barra.get_x() + barra.get_width() / 2, altura),
-                            xytext=(0, 3),
-                            textcoords="offset points",
-                            ha='center', va='bottom', fontsize=9)
-
-        rotular_barras(barras_meta)
-        rotular_barras(barras_batido)
-
-        plt.tight_layout()
-
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        self.logger.info("Gráfico de colunas - Meta Valor gerado para o mês atual.")
-        return base64.b64encode(buf.read()).decode()
-
-    def grafico_colunas_meta_mix(self):
-        self.cur.execute("""
+    def series_meta_mix(self):
+        filtro, params = self._filtro_loja()
+        self.cur.execute(f"""
             SELECT id_loja, percentual_metamix
             FROM resultado_meta_por_mes
-            WHERE mes_referencia = ?
+            WHERE mes_referencia = ?{filtro}
             ORDER BY id_loja
-        """, (self.mes_referencia,))
-        rows = self.cur.fetchall()
-
+        """, (self.mes_referencia,) + params)
         lojas = []
         valores_mix = []
+        for id_loja, percentual in self.cur.fetchall():
+            lojas.append("Deus Te Pague" if id_loja == 0 else f"Loja {id_loja}")
+            valores_mix.append(percentual if percentual is not None else 0.0)
+        return lojas, valores_mix
+
+    def _grafico_em_cache(self, tipo, series, parametros, desenhar):
+        # Só chega no matplotlib quando a combinação série + parâmetros é nova
+        chave = self.cache_graficos.chave(tipo, series, parametros)
+        imagem = self.cache_graficos.obter(chave)
+        if imagem is not None:
+            self.logger.info(f"Gráfico {tipo} reaproveitado do cache.")
+            return imagem
+        imagem = desenhar(*series, **parametros)
+        self.cache_graficos.gravar(chave, imagem)
+        self.logger.info(f"Gráfico {tipo} gerado para {self.mes_referencia}.")
+        return imagem
+
+    def _grafico_meta_valor(self):
+        return (
+            "meta_valor", self.series_meta_valor(),
+            {"titulo": f'Meta Valor e Valor Batido - {self.mes_referencia}'},
+            desenhar_colunas_meta_valor
+        )
 
-        meta_fixa = 50  # percentual meta fixa (%)
-
-        for id_loja, percentual in rows:
-            loja_nome = "Deus Te Pague" if id_loja == 0 else f"Loja {id_loja}"
-            lojas.append(loja_nome)
-            valor_percentual = percentual if percentual is not None else 0.0
-            valores_mix.append(valor_percentual)
-
-        x = np.arange(len(lojas))
-        largura = 0.35
-
-        fig, ax = plt.subplots(figsize=(10, 6))
-
-        barras_meta = ax.bar(x - largura/2, [meta_fixa]*len(lojas), largura,
-                            label='Meta Mix SKUs (50%)', color='lightcoral')
-
-        barras_valor = ax.bar(x + largura/2, valores_mix, largura,
-                            label='% Mix SKUs Comprados', color='coral')
-
-        ax.set_xticks(x)
-        ax.set_xticklabels(lojas)
-        ax.set_ylim(0, 100)
-        ax.set_ylabel('Percentual (%)')
-        ax.set_title(f'% Mix SKUs Comprados - {self.mes_referencia}')
-        ax.legend()
-
-        def rotular_barras(barras):
-            for barra in barras:
-                altura = barra.get_height()
-                ax.annotate(f'{altura:.2f}%',
-                            xy=(barra.get_x() + barra.get_width()/2, altura),
-                            xytext=(0, 3),
-                            textcoords='offset points',
-                            ha='center', va='bottom', fontsize=9)
-
-        rotular_barras(barras_meta)
-        rotular_barras(barras_valor)
-
-        plt.tight_layout()
+    def _grafico_meta_mix(self):
+        return (
+            "meta_mix", self.series_meta_mix(),
+            {"titulo": f'% Mix SKUs Comprados - {self.mes_referencia}', "meta_fixa": 50},
+            desenhar_colunas_meta_mix
+        )
 
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        self.logger.info("Gráfico de colunas - Mix SKUs gerado para o mês atual.")
-        return base64.b64encode(buf.read()).decode()
+    def grafico_colunas_meta_valor(self):
+        return self._grafico_em_cache(*self._grafico_meta_valor())
 
-    def gerar(self):
+    def grafico_colunas_meta_mix(self):
+        return self._grafico_em_cache(*self._grafico_meta_mix())
+
+    def nome_pdf(self):
+        nome = datetime.strptime(self.mes_referencia, "%Y-%m").strftime("RelatorioMetaRede-%m-%y")
+        if self.id_loja is not None:
+            nome += f"-Loja{self.id_loja}"
+        return nome + ".pdf"
+
+    def preparar(self, force=False):
+        # Monta o HTML do relatório e devolve (nome_pdf, html, fingerprint); None quando
+        # não há dados (sem_dados fica True) ou as entradas são as mesmas do PDF já
+        # existente (sem force)
         self.conectar()
-        dados = self.buscar_dados()
-        bonifs_chegou = self.buscar_bonificacoes_mes()
-
-        if not dados:
-            self.logger.warning("Nenhum dado para relatório")
+        try:
+            dados = self.buscar_dados()
+            bonifs_chegou = self.buscar_bonificacoes_mes()
+
+            self.sem_dados = not dados
+            if not dados:
+                self.logger.warning("Nenhum dado para relatório")
+                return None
+
+            bonifs = self.comparar_bonificacoes(dados, bonifs_chegou)
+            cards = self.calcular_cards(dados)
+
+            # Os gráficos entram pela chave do cache (hash das séries): conferir o
+            # manifesto não exige desenhar nada
+            graficos = [self._grafico_meta_valor(), self._grafico_meta_mix()]
+            chaves = [self.cache_graficos.chave(tipo, series, parametros) for tipo, series, parametros, _ in graficos]
+            nome = self.nome_pdf()
+            fingerprint = impressao_digital(
+                self.mes_referencia, dados, bonifs, cards, chaves, os.path.getmtime(self.template.filename)
+            )
+            if not force and self.manifesto.atualizado(nome, fingerprint):
+                self.logger.info(f"Relatório Relatorio/{nome} sem alterações; geração ignorada.")
+                return None
+
+            grafico_valor, grafico_mix = [self._grafico_em_cache(*grafico) for grafico in graficos]
+
+            html = self.template.render(
+                mes_referencia=self.mes_referencia,
+                cards=cards,
+                dados=dados,
+                grafico_linha_valor=grafico_valor,
+                grafico_linha_mix=grafico_mix,
+                bonificacoes=bonifs
+            )
+            return nome, html, fingerprint
+        finally:
             self.fechar()
-            return
-
-        bonifs = self.comparar_bonificacoes(dados, bonifs_chegou)
-        cards = self.calcular_cards(dados)
-
-        grafico_valor = self.grafico_colunas_meta_valor()
-        grafico_mix = self.grafico_colunas_meta_mix()
-
-        html = self.template.render(
-            mes_referencia=self.mes_referencia,
-            cards=cards,
-            dados=dados,
-            grafico_linha_valor=grafico_valor,
-            grafico_linha_mix=grafico_mix,
-            bonificacoes=bonifs
-        )
 
-        nome = datetime.strptime(self.mes_referencia, "%Y-%m").strftime("RelatorioMetaRede-%m-%y.pdf")
-        HTML(string=html).write_pdf(os.path.join(self.pasta, nome))
+    def gerar(self, force=False, font_config=None):
+        # Devolve True quando um PDF novo foi gravado, False quando o existente já
+        # corresponde às entradas e None quando não há dados para o relatório
+        preparado = self.preparar(force)
+        if preparado is None:
+            return None if self.sem_dados else False
+        nome, html, fingerprint = preparado
+        escrever_pdf(html, os.path.join(self.pasta, nome), font_config)
+        self.manifesto.registrar(nome, fingerprint)
         self.logger.info(f"Relatório PDF salvo em Relatorio/{nome}")
-        self.fechar()
+        return True
 
 
 if __name__ == "__main__":
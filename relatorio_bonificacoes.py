@@ -1,28 +1,37 @@
 import os
-import sqlite3
 from collections import defaultdict, namedtuple
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from weasyprint import HTML
 from logger import Logger
+from armazenamento import ArmazenamentoSQLite
+from manifesto_relatorio import ManifestoRelatorio, impressao_digital
+from relatorio import criar_ambiente, escrever_pdf
 import logging
 import locale
 import subprocess
 
-try:
-    locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
-except locale.Error:
-    locale.setlocale(locale.LC_TIME, 'Portuguese_Brazil.1252')
+
+def configurar_locale():
+    # Nomes de mês em português (%b/%B); feito na hora de usar, não no import
+    try:
+        locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')
+    except locale.Error:
+        locale.setlocale(locale.LC_TIME, 'Portuguese_Brazil.1252')
+
 
 class ValidaBonificacaoAnual:
-    def __init__(self, mes_referencia=None):
+    def __init__(self, mes_referencia=None, armazenamento=None, env=None):
         load_dotenv()
+        configurar_locale()
         self.db_path = os.getenv("DB_LITE_PATH")
         if not self.db_path:
             raise ValueError("DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         self.logger = Logger().get_logger(self.__class__.__name__)
         # Silenciar logs muito verbosos de libs usadas
         for lib in ("fontTools", "weasyprint"):
@@ -48,39 +57,22 @@ class ValidaBonificacaoAnual:
         self.pasta = os.path.join(os.getcwd(), "Relatorio")
         os.makedirs(self.pasta, exist_ok=True)
 
-        self.env = Environment(
-            loader=FileSystemLoader(self.pasta),
-            autoescape=select_autoescape(['html'])
-        )
+        self.env = env or criar_ambiente(self.pasta)
         self.template = self.env.get_template("template_bonificacoes.html")
+        self.manifesto = ManifestoRelatorio(self.pasta)
 
     def conectar(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = self.armazenamento.conexao()
         self.cur = self.conn.cursor()
         self.logger.info("Conectado ao SQLite.")
 
     def fechar(self):
         if self.cur:
             self.cur.close()
-        if self.conn:
-            self.conn.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info("Conexão SQLite fechada.")
 
-    def criar_tabela_cruzada(self):
-        self.cur.execute("""
-        CREATE TABLE IF NOT EXISTS resultado_bonificacao_cruzada (
-            id_loja INTEGER,
-            mes_referencia TEXT,
-            valor_previsto REAL,
-            valor_recebido REAL,
-            diferenca REAL,
-            status TEXT,
-            PRIMARY KEY (id_loja, mes_referencia)
-        )
-        """)
-        self.conn.commit()
-        self.logger.info("Tabela resultado_bonificacao_cruzada criada/verificada.")
-
     def buscar_previsto(self):
         placeholders = ','.join('?' for _ in self.periodo_meses)
         query = f"""
@@ -115,13 +107,12 @@ class ValidaBonificacaoAnual:
     def processar_cruzamento(self):
         self.conectar()
         try:
-            self.criar_tabela_cruzada()
-
             previsto = self.buscar_previsto()
             recebido = self.buscar_recebido()
 
             chaves = set(previsto.keys()) | set(recebido.keys())
 
+            registros = []
             for chave in chaves:
                 id_loja, mes_ref = chave
                 if id_loja == 0:
@@ -130,12 +121,7 @@ class ValidaBonificacaoAnual:
                 val_receb = recebido.get(chave, 0.0)
                 diferenca = val_receb - val_prev
                 status = "BATIDO" if val_receb >= val_prev else "NÃO BATIDO"
-
-                self.cur.execute("""
-                    INSERT OR REPLACE INTO resultado_bonificacao_cruzada (
-                        id_loja, mes_referencia, valor_previsto, valor_recebido, diferenca, status
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                """, (id_loja, mes_ref, val_prev, val_receb, diferenca, status))
+                registros.append((id_loja, mes_ref, val_prev, val_receb, diferenca, status))
 
             meses_unicos = set(mes for _, mes in chaves)
             for mes_ref in meses_unicos:
@@ -146,14 +132,14 @@ class ValidaBonificacaoAnual:
                 val_receb_sum = sum(recebido.get((id_loja, mes_ref), 0.0) for id_loja in lojas_receb)
                 diferenca_sum = val_receb_sum - val_prev_sum
                 status_sum = "BATIDO" if val_receb_sum >= val_prev_sum else "NÃO BATIDO"
+                registros.append((0, mes_ref, val_prev_sum, val_receb_sum, diferenca_sum, status_sum))
 
-                self.cur.execute("""
+            with self.armazenamento.transacao():
+                self.cur.executemany("""
                     INSERT OR REPLACE INTO resultado_bonificacao_cruzada (
                         id_loja, mes_referencia, valor_previsto, valor_recebido, diferenca, status
                     ) VALUES (?, ?, ?, ?, ?, ?)
-                """, (0, mes_ref, val_prev_sum, val_receb_sum, diferenca_sum, status_sum))
-
-            self.conn.commit()
+                """, registros)
             self.logger.info(f"Cruzamento processado e salvo para {len(chaves) + len(meses_unicos)} registros (incluindo consolidado).")
         except Exception as e:
             self.logger.error(f"Erro no processamento do cruzamento: {e}")
@@ -167,7 +153,12 @@ class ValidaBonificacaoAnual:
                 lojas.add(id_loja)
         return lojas
 
-    def gerar_relatorio_pdf(self):
+    def nome_pdf(self):
+        return f"RelatorioBonificacoesAnual-{self.mes_ref_dt.strftime('%m-%y')}.pdf"
+
+    def preparar_relatorio_pdf(self, force=False):
+        # Devolve (nome_pdf, html, fingerprint), ou None quando o PDF existente já
+        # corresponde às entradas (sem force)
         self.conectar()
         try:
             DadosBonificacao = namedtuple(
@@ -203,21 +194,36 @@ class ValidaBonificacaoAnual:
 
             self.logger.info(f"Dados para relatório carregados para {len(dados)} lojas.")
 
+            nome_arquivo = self.nome_pdf()
+            fingerprint = impressao_digital(
+                self.periodo_meses, dados_formatado, os.path.getmtime(self.template.filename)
+            )
+            if not force and self.manifesto.atualizado(nome_arquivo, fingerprint):
+                self.logger.info(f"Relatório Relatorio/{nome_arquivo} sem alterações; geração ignorada.")
+                return None
+
             html = self.template.render(
                 dados=dados_formatado
             )
+            return nome_arquivo, html, fingerprint
+        finally:
+            self.fechar()
 
-            mes_label = self.mes_ref_dt.strftime("%m-%y")
-            nome_arquivo = f"RelatorioBonificacoesAnual-{mes_label}.pdf"
-            caminho_pdf = os.path.join(self.pasta, nome_arquivo)
-
-            HTML(string=html).write_pdf(caminho_pdf)
+    def gerar_relatorio_pdf(self, force=False, font_config=None):
+        # Devolve True quando um PDF novo foi gravado e False quando o existente já
+        # corresponde às entradas; erros são propagados
+        try:
+            preparado = self.preparar_relatorio_pdf(force)
+            if preparado is None:
+                return False
+            nome_arquivo, html, fingerprint = preparado
+            caminho_pdf = escrever_pdf(html, os.path.join(self.pasta, nome_arquivo), font_config)
+            self.manifesto.registrar(nome_arquivo, fingerprint)
             self.logger.info(f"Relatório PDF salvo em {caminho_pdf}")
-
+            return True
         except Exception as e:
             self.logger.error(f"Erro ao gerar relatório PDF: {e}")
-        finally:
-            self.fechar()
+            raise
 
 if __name__ == "__main__":
     logger = Logger().get_logger("Main")
@@ -230,6 +236,11 @@ if __name__ == "__main__":
     try:
         processador.processar_cruzamento()
         processador.gerar_relatorio_pdf()
+        nome_pdf = processador.nome_pdf()
+        if not processador.manifesto.pendente_envio(nome_pdf):
+            # PDF igual ao último gerado e já enviado: nada novo para o WhatsApp
+            logger.info("Relatório de bonificações sem novidades; envio não realizado.")
+            raise SystemExit(0)
 
         # calcula período (últimos 12 meses)
         mes_ref_dt = datetime.strptime(mes_referencia, "%Y-%m")
@@ -258,8 +269,12 @@ if __name__ == "__main__":
         )
 
         logger.info(f"Script Node.js executado com sucesso. Output:\n{resultado.stdout}")
+        # Só agora o PDF conta como enviado; falha no envio faz a próxima execução reenviar
+        processador.manifesto.registrar_envio(nome_pdf)
 
     except subprocess.CalledProcessError as e:
         logger.error(f"Erro ao executar script Node.js: {e.stderr}")
+        raise SystemExit(1)
     except Exception as e:
         logger.error(f"Erro inesperado: {e}")
+        raise SystemExit(1)
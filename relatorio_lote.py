@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+from logger import Logger
+from armazenamento import ArmazenamentoSQLite
+from relatorio import RelatorioMeta, criar_ambiente, configuracao_fontes, escrever_pdf
+from relatorio_bonificacoes import ValidaBonificacaoAnual
+
+# FontConfiguration do processo de renderização, criada uma vez no início do worker
+_font_config = None
+
+
+def _iniciar_renderizador():
+    global _font_config
+    _font_config = configuracao_fontes()
+
+
+def _renderizar_pdf(html, caminho):
+    return escrever_pdf(html, caminho, _font_config)
+
+
+# Geração em lote dos relatórios (vários meses e, opcionalmente, uma variante por
+# loja). Dados, gráficos (cache) e HTML saem no processo principal com um único
+# ambiente Jinja; só o WeasyPrint, que é a etapa cara, é distribuído num pool de
+# processos, cada um com a sua FontConfiguration. O manifesto é gravado aqui, à
+# medida que os PDFs ficam prontos.
+class RelatorioLote:
+    def __init__(self, meses, lojas=None, bonificacoes=False, armazenamento=None, processos=None):
+        load_dotenv()
+        self.meses = list(meses)
+        # lojas: além do relatório da rede, um PDF por loja para cada mês
+        self.lojas = [int(loja) for loja in lojas or ()]
+        self.bonificacoes = bonificacoes
+        self.processos = int(processos if processos is not None else os.getenv("RELATORIO_PROCESSOS", os.cpu_count() or 1))
+
+        self.armazenamento = armazenamento or ArmazenamentoSQLite()
+        self._armazenamento_proprio = armazenamento is None
+
+        self.pasta = os.path.join(os.getcwd(), "Relatorio")
+        os.makedirs(self.pasta, exist_ok=True)
+        self.env = criar_ambiente(self.pasta)
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def _relatorios(self):
+        for mes in self.meses:
+            for id_loja in [None] + self.lojas:
+                relatorio = RelatorioMeta(mes, armazenamento=self.armazenamento, id_loja=id_loja, env=self.env)
+                yield relatorio, relatorio.preparar
+            if self.bonificacoes:
+                relatorio = ValidaBonificacaoAnual(mes, armazenamento=self.armazenamento, env=self.env)
+                relatorio.processar_cruzamento()
+                yield relatorio, relatorio.preparar_relatorio_pdf
+
+    def preparar(self, force=False):
+        # [(manifesto, nome_pdf, html, fingerprint)] dos relatórios que precisam de PDF novo
+        pendentes = []
+        for relatorio, preparar in self._relatorios():
+            preparado = preparar(force)
+            if preparado is not None:
+                pendentes.append((relatorio.manifesto,) + preparado)
+        return pendentes
+
+    def gerar(self, force=False):
+        # Devolve os nomes dos PDFs gravados; os sem alteração ficam de fora
+        try:
+            pendentes = self.preparar(force)
+        finally:
+            if self._armazenamento_proprio:
+                self.armazenamento.fechar()
+
+        gerados = []
+        if not pendentes:
+            self.logger.info("Nenhum relatório com alterações; nada a renderizar.")
+            return gerados
+
+        if self.processos <= 1 or len(pendentes) == 1:
+            font_config = configuracao_fontes()
+            for manifesto, nome, html, fingerprint in pendentes:
+                try:
+                    escrever_pdf(html, os.path.join(self.pasta, nome), font_config)
+                except Exception as e:
+                    self.logger.error(f"Erro ao renderizar Relatorio/{nome}: {e}")
+                    continue
+                manifesto.registrar(nome, fingerprint)
+                gerados.append(nome)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(self.processos, len(pendentes)), initializer=_iniciar_renderizador
+            ) as executor:
+                futuros = {
+                    executor.submit(_renderizar_pdf, html, os.path.join(self.pasta, nome)): (manifesto, nome, fingerprint)
+                    for manifesto, nome, html, fingerprint in pendentes
+                }
+                for futuro in as_completed(futuros):
+                    manifesto, nome, fingerprint = futuros[futuro]
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        self.logger.error(f"Erro ao renderizar Relatorio/{nome}: {e}")
+                        continue
+                    manifesto.registrar(nome, fingerprint)
+                    gerados.append(nome)
+
+        self.logger.info(f"{len(gerados)} de {len(pendentes)} relatórios renderizados em Relatorio/.")
+        return sorted(gerados)
+
+
+if __name__ == "__main__":
+    from meses import listar_meses
+    # Regera um ano de relatórios da rede, com variantes por loja e o anual de bonificações
+    lote = RelatorioLote(listar_meses("2024-08", "2025-07"), lojas=[1, 2, 3], bonificacoes=True)
+    for nome in lote.gerar():
+        lote.logger.info(f"Relatorio/{nome}")
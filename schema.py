@@ -0,0 +1,387 @@
+import sqlite3
+
+
+def _catalogo_por_intervalos(conn):
+    # Converte as cópias mensais de produtosrede_historico em intervalos de validade:
+    # um SKU presente em meses coletados consecutivos (com a mesma descrição) vira
+    # uma única linha [valido_de, valido_ate]. A data de coleta fica por mês.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_rede (
+            codigoexterno TEXT,
+            valido_de TEXT,
+            valido_ate TEXT,
+            descricao TEXT,
+            PRIMARY KEY (codigoexterno, valido_de)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_rede_contagem (
+            mes_referencia TEXT PRIMARY KEY,
+            total_skus INTEGER,
+            data_coleta TEXT
+        )
+    """)
+
+    meses = [row[0] for row in conn.execute("""
+        SELECT DISTINCT mes_referencia FROM produtosrede_historico
+        WHERE mes_referencia IS NOT NULL ORDER BY mes_referencia
+    """)]
+    posicao = {mes: i for i, mes in enumerate(meses)}
+    linhas = conn.execute("""
+        SELECT codigoexterno, mes_referencia, descricao FROM produtosrede_historico
+        WHERE mes_referencia IS NOT NULL AND codigoexterno IS NOT NULL
+        ORDER BY codigoexterno, mes_referencia
+    """).fetchall()
+
+    intervalos = []
+    atual = None
+    for codigo, mes, descricao in linhas:
+        if (atual and atual[0] == codigo and atual[3] == descricao
+                and posicao[mes] == posicao[atual[2]] + 1):
+            atual[2] = mes
+            continue
+        if atual:
+            intervalos.append(tuple(atual))
+        atual = [codigo, mes, mes, descricao]
+    if atual:
+        intervalos.append(tuple(atual))
+
+    conn.executemany("""
+        INSERT INTO catalogo_rede (codigoexterno, valido_de, valido_ate, descricao)
+        VALUES (?, ?, ?, ?)
+    """, intervalos)
+    conn.execute("""
+        INSERT INTO catalogo_rede_contagem (mes_referencia, total_skus, data_coleta)
+        SELECT mes_referencia, COUNT(DISTINCT codigoexterno), MAX(data_coleta)
+        FROM produtosrede_historico
+        WHERE mes_referencia IS NOT NULL AND codigoexterno IS NOT NULL
+        GROUP BY mes_referencia
+    """)
+
+    conn.execute("DROP TABLE produtosrede_historico")
+    # Mantém as consultas por mês funcionando: uma linha por SKU em cada mês coletado
+    conn.execute("""
+        CREATE VIEW produtosrede_historico AS
+        SELECT c.codigoexterno, c.descricao, m.mes_referencia, m.data_coleta
+        FROM catalogo_rede_contagem m
+        JOIN catalogo_rede c
+          ON c.valido_de <= m.mes_referencia AND c.valido_ate >= m.mes_referencia
+    """)
+
+
+def _bitsets_iniciais(conn):
+    # Os bitsets passam a ser mantidos na gravação das compras e do catálogo: monta
+    # uma vez os de todo o histórico já gravado. A lógica fica congelada aqui (e não
+    # importada de indice_sku) para a migração fazer sempre a mesma coisa
+    def blob(posicoes):
+        buffer = bytearray(max(posicoes) // 8 + 1)
+        for posicao in posicoes:
+            buffer[posicao >> 3] |= 1 << (posicao & 7)
+        bits = int.from_bytes(buffer, "little")
+        return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+    compras = conn.execute("""
+        SELECT DISTINCT id_loja, mes_referencia, codigoexterno FROM produtoscomprados
+    """).fetchall()
+    catalogo = conn.execute("""
+        SELECT mes_referencia, codigoexterno FROM produtosrede_historico
+    """).fetchall()
+
+    # Códigos ainda sem posição entram em ordem, depois da maior posição existente
+    posicoes = dict(conn.execute("SELECT codigoexterno, posicao FROM sku_indice").fetchall())
+    novos = sorted(({row[2] for row in compras} | {row[1] for row in catalogo}) - posicoes.keys())
+    proxima = max(posicoes.values(), default=-1) + 1
+    registros = [(codigo, proxima + i) for i, codigo in enumerate(novos)]
+    conn.executemany("INSERT INTO sku_indice (codigoexterno, posicao) VALUES (?, ?)", registros)
+    posicoes.update(registros)
+
+    por_loja_mes = {}
+    for id_loja, mes, codigo in compras:
+        por_loja_mes.setdefault((id_loja, mes), []).append(posicoes[codigo])
+    por_mes = {}
+    for mes, codigo in catalogo:
+        por_mes.setdefault(mes, []).append(posicoes[codigo])
+
+    conn.execute("DELETE FROM bitset_compras")
+    conn.executemany("""
+        INSERT INTO bitset_compras (id_loja, mes_referencia, bits, total) VALUES (?, ?, ?, ?)
+    """, [(id_loja, mes, blob(lista), len(lista)) for (id_loja, mes), lista in por_loja_mes.items()])
+    conn.execute("DELETE FROM bitset_catalogo")
+    conn.executemany("""
+        INSERT INTO bitset_catalogo (mes_referencia, bits, total) VALUES (?, ?, ?)
+    """, [(mes, blob(lista), len(lista)) for mes, lista in por_mes.items()])
+
+
+# Schema do SQLite do pipeline. Cada migração tem um número de versão e roda uma
+# única vez: a versão aplicada fica gravada em PRAGMA user_version.
+# Para alterar o schema, acrescente uma nova migração ao final (nunca edite as antigas).
+MIGRACOES = [
+    (1, "Tabelas do pipeline", [
+        """
+        CREATE TABLE IF NOT EXISTS vendas_por_mes (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            valor_venda REAL,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS compras_valor_por_mes (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            valor_total REAL,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bonificacao_por_mes (
+            mes_referencia_meta TEXT,
+            mes_lancamento TEXT,
+            id_loja INTEGER,
+            bonificacao BOOLEAN,
+            valortotal REAL,
+            PRIMARY KEY (mes_referencia_meta, id_loja)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS produtoscomprados (
+            codigoexterno TEXT,
+            codigointerno INTEGER,
+            descricao TEXT,
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            data_coleta TEXT,
+            PRIMARY KEY (codigoexterno, id_loja, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notas_processadas (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            numeronota TEXT,
+            hash TEXT,
+            data_processamento TEXT,
+            PRIMARY KEY (id_loja, mes_referencia, numeronota)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mapa_codigos (
+            codigoexterno TEXT PRIMARY KEY,
+            codigointerno INTEGER,
+            descricao TEXT,
+            origem TEXT,
+            data_atualizacao TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS codigos_nao_resolvidos (
+            codigoexterno TEXT PRIMARY KEY,
+            data_consulta TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS produtos_excluidos (
+            id_produto INTEGER PRIMARY KEY
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cache_controle (
+            chave TEXT PRIMARY KEY,
+            valor TEXT,
+            data_atualizacao TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS produtosrede_historico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigoexterno TEXT,
+            descricao TEXT,
+            mes_referencia TEXT,
+            data_coleta TEXT,
+            UNIQUE (codigoexterno, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS resultado_meta_por_mes (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            data_ultima_consulta TEXT,
+            metavalor REAL,
+            metavalorbatido REAL,
+            percentual_metavalor REAL,
+            skumetamix INTEGER,
+            skumetamixcomprado INTEGER,
+            percentual_metamix REAL,
+            bonificacao_pct REAL,
+            valor_bonificacao REAL,
+            motivo TEXT,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS resultado_bonificacao_cruzada (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            valor_previsto REAL,
+            valor_recebido REAL,
+            diferenca REAL,
+            status TEXT,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+    ]),
+    (2, "Índices de cobertura para as consultas por mês/loja", [
+        # COUNT(DISTINCT codigoexterno) ... WHERE mes_referencia = ? (comparamix, calculodameta);
+        # a chave UNIQUE começa por codigoexterno e não serve para esse filtro
+        """
+        CREATE INDEX IF NOT EXISTS idx_produtosrede_historico_mes
+        ON produtosrede_historico (mes_referencia, codigoexterno)
+        """,
+        # COUNT(DISTINCT codigoexterno) por mês e loja (comparamix, calculodameta, compras)
+        """
+        CREATE INDEX IF NOT EXISTS idx_produtoscomprados_mes_loja
+        ON produtoscomprados (mes_referencia, id_loja, codigoexterno)
+        """,
+        # Códigos ainda não identificados de uma loja/mês (compras)
+        """
+        CREATE INDEX IF NOT EXISTS idx_produtoscomprados_pendentes
+        ON produtoscomprados (id_loja, mes_referencia, codigoexterno)
+        WHERE codigointerno IS NULL
+        """,
+        # SUM(valortotal) ... WHERE mes_referencia_meta = ? GROUP BY id_loja (relatorio, relatorio_bonificacoes)
+        """
+        CREATE INDEX IF NOT EXISTS idx_bonificacao_por_mes_meta
+        ON bonificacao_por_mes (mes_referencia_meta, id_loja, valortotal)
+        """,
+        # Consolidado do grupo e previsto anual filtram por mes_referencia (calculodameta, relatorio_bonificacoes)
+        """
+        CREATE INDEX IF NOT EXISTS idx_resultado_meta_mes
+        ON resultado_meta_por_mes (
+            mes_referencia, id_loja,
+            metavalor, metavalorbatido, skumetamix, skumetamixcomprado, valor_bonificacao
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_resultado_bonificacao_cruzada_mes
+        ON resultado_bonificacao_cruzada (mes_referencia, id_loja)
+        """,
+        # Códigos mapeados para produtos excluídos (compras)
+        """
+        CREATE INDEX IF NOT EXISTS idx_mapa_codigos_codigointerno
+        ON mapa_codigos (codigointerno, codigoexterno)
+        """,
+    ]),
+    (3, "Catálogo da rede versionado por intervalo de meses", [
+        _catalogo_por_intervalos,
+        # SKUs vigentes num mês (view produtosrede_historico) e vizinhos de um mês na gravação
+        """
+        CREATE INDEX IF NOT EXISTS idx_catalogo_rede_validade
+        ON catalogo_rede (valido_de, valido_ate, codigoexterno)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_catalogo_rede_fim
+        ON catalogo_rede (valido_ate, codigoexterno)
+        """,
+    ]),
+    (4, "Resumo de mix comprado por loja e mês", [
+        # id_loja = 0 guarda o total geral (todas as lojas)
+        """
+        CREATE TABLE IF NOT EXISTS mix_por_mes (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            total_ofertado INTEGER,
+            total_comprado INTEGER,
+            percentual_comprado REAL,
+            data_calculo TEXT,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+    ]),
+    (5, "Índice denso de SKUs e bitsets de compras/catálogo", [
+        """
+        CREATE TABLE IF NOT EXISTS sku_indice (
+            codigoexterno TEXT PRIMARY KEY,
+            posicao INTEGER NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bitset_compras (
+            id_loja INTEGER,
+            mes_referencia TEXT,
+            bits BLOB,
+            total INTEGER,
+            PRIMARY KEY (id_loja, mes_referencia)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bitset_catalogo (
+            mes_referencia TEXT PRIMARY KEY,
+            bits BLOB,
+            total INTEGER
+        )
+        """,
+        # Leitura de todas as lojas de um intervalo de meses
+        """
+        CREATE INDEX IF NOT EXISTS idx_bitset_compras_mes
+        ON bitset_compras (mes_referencia, id_loja)
+        """,
+        "ALTER TABLE mix_por_mes ADD COLUMN total_fora_catalogo INTEGER",
+    ]),
+    (6, "Impressão digital das entradas de cada resultado da meta", [
+        "ALTER TABLE resultado_meta_por_mes ADD COLUMN fingerprint TEXT",
+    ]),
+    (7, "Cache negativo de códigos por loja", [
+        # A busca no PostgreSQL é feita na janela de notas da loja: código que uma loja
+        # ainda não lançou não pode ficar marcado como sem correspondência para as outras.
+        # O conteúdo antigo é só cache e é descartado
+        "DROP TABLE IF EXISTS codigos_nao_resolvidos",
+        """
+        CREATE TABLE codigos_nao_resolvidos (
+            codigoexterno TEXT NOT NULL,
+            id_loja INTEGER NOT NULL,
+            data_consulta TEXT,
+            PRIMARY KEY (codigoexterno, id_loja)
+        )
+        """,
+    ]),
+    (8, "Bitsets de compras e catálogo montados para todo o histórico", [
+        _bitsets_iniciais,
+    ]),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao_schema(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar_migracoes(conn, logger=None):
+    versao = versao_schema(conn)
+    if versao > VERSAO_ATUAL:
+        raise sqlite3.DatabaseError(
+            f"Banco na versão de schema {versao}, mais nova que a suportada ({VERSAO_ATUAL})."
+        )
+
+    aplicadas = 0
+    for numero, descricao, comandos in MIGRACOES:
+        if numero <= versao:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for comando in comandos:
+                if callable(comando):
+                    comando(conn)
+                else:
+                    conn.execute(comando)
+            conn.execute(f"PRAGMA user_version = {int(numero)}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        aplicadas += 1
+        if logger:
+            logger.info(f"Migração {numero} aplicada: {descricao}.")
+    return aplicadas
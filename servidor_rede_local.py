@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+from logger import Logger
+
+PASTA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Fixtures", "Rede")
+PREFIXO = "/php/vrcentralrede/"
+USUARIO = "teste"
+SENHA = "teste"
+COOKIE_SESSAO = "PHPSESSID=local"
+
+
+# Servidor local que imita o site da rede com as páginas sintéticas de Fixtures/Rede
+# (montadas a partir do que o Selenium e o parser esperam, não capturadas do site):
+# GET/POST login.php, página inicial com o link "Novo", GET da listagem na exibição
+# resumida (como o navegador a abre) e a completa só com sessão válida e POST de
+# tipoExibicao=1. Serve para exercitar o motor HTTP do ProdutosRedeScraper sem
+# acessar o site real; não prova que o site real aceite o mesmo fluxo.
+class _PaginasRede(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, fixture, status=200, cabecalhos=()):
+        with open(os.path.join(PASTA_FIXTURES, fixture), "rb") as arquivo:
+            corpo = arquivo.read()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        for nome, valor in cabecalhos:
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _formulario(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        dados = parse_qs(self.rfile.read(tamanho).decode("utf-8"))
+        return {chave: valores[0] for chave, valores in dados.items()}
+
+    def _com_sessao(self):
+        return COOKIE_SESSAO in (self.headers.get("Cookie") or "")
+
+    def do_GET(self):
+        caminho = urlsplit(self.path).path
+        if caminho == PREFIXO + "login.php":
+            self._responder("login.html")
+        elif caminho == PREFIXO + "produtorede/cadastro.php":
+            self._responder("listagem_resumida.html" if self._com_sessao() else "login.html")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        caminho = urlsplit(self.path).path
+        if caminho == PREFIXO + "login.php":
+            formulario = self._formulario()
+            if formulario.get("usuario") == USUARIO and formulario.get("senha") == SENHA:
+                self._responder("inicio.html", cabecalhos=[("Set-Cookie", f"{COOKIE_SESSAO}; Path=/")])
+            else:
+                self._responder("login_invalido.html")
+        elif caminho == PREFIXO + "produtorede/cadastro.php":
+            if not self._com_sessao():
+                self._responder("login.html", status=200)
+            elif self._formulario().get("tipoExibicao") != "1":
+                self.send_error(400, "tipoExibicao deve ser 1")
+            else:
+                self._responder("listagem.html")
+        else:
+            self.send_error(404)
+
+
+class ServidorRedeLocal:
+    def __init__(self, porta=0):
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", porta), _PaginasRede)
+        self.thread = None
+
+    @property
+    def url_base(self):
+        host, porta = self.servidor.server_address[:2]
+        return f"http://{host}:{porta}{PREFIXO}"
+
+    def iniciar(self):
+        self.thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+def executar_fluxo(logger):
+    # Login válido traz a listagem esperada, a exibição resumida é recusada e login
+    # inválido devolve None. Devolve os problemas
+    from produtosrede import ProdutosRedeScraper
+    from parser_catalogo import extrair_produtos
+
+    with open(os.path.join(PASTA_FIXTURES, "esperado.json"), encoding="utf-8") as arquivo:
+        esperado = [tuple(produto) for produto in json.load(arquivo)]
+
+    problemas = []
+    servidor = ServidorRedeLocal().iniciar()
+    variaveis = ("REDE_URL_BASE", "DB_LITE_PATH", "PRODUTOSREDE_SNAPSHOTS", "REDE_URL_LOGIN", "REDE_URL_LISTAGEM")
+    ambiente_original = {nome: os.environ.get(nome) for nome in variaveis}
+    try:
+        with tempfile.TemporaryDirectory(prefix="rede_local_") as pasta:
+            os.environ.update({
+                "REDE_URL_BASE": servidor.url_base,
+                "DB_LITE_PATH": os.path.join(pasta, "rede_local.sqlite"),
+                "PRODUTOSREDE_SNAPSHOTS": os.path.join(pasta, "Snapshots"),
+            })
+            os.environ.pop("REDE_URL_LOGIN", None)
+            os.environ.pop("REDE_URL_LISTAGEM", None)
+
+            scraper = ProdutosRedeScraper("2025-07")
+            try:
+                scraper.usuario, scraper.senha = USUARIO, SENHA
+                html = scraper.baixar_pagina_http()
+                produtos = extrair_produtos(html) if html else []
+                if produtos != esperado:
+                    problemas.append(f"Listagem divergente: {produtos}")
+                elif not scraper._exibicao_completa(html):
+                    problemas.append("Listagem completa não reconhecida como exibição completa.")
+                else:
+                    logger.info(f"Login e listagem via HTTP: {len(produtos)} produtos, como esperado.")
+
+                resumida = scraper.sessao.get(servidor.url_base + "produtorede/cadastro.php").text
+                if scraper._exibicao_completa(resumida):
+                    problemas.append("Listagem resumida aceita como catálogo completo.")
+                else:
+                    logger.info("Listagem resumida recusada.")
+
+                scraper.sessao.close()
+                scraper.sessao = None
+                scraper.usuario, scraper.senha = USUARIO, "errada"
+                if scraper.baixar_pagina_http() is not None:
+                    problemas.append("Login inválido não foi detectado.")
+                else:
+                    logger.info("Login inválido detectado.")
+            finally:
+                scraper.armazenamento.fechar()
+    finally:
+        servidor.parar()
+        for nome, valor in ambiente_original.items():
+            if valor is None:
+                os.environ.pop(nome, None)
+            else:
+                os.environ[nome] = valor
+    return problemas
+
+
+if __name__ == "__main__":
+    # Uso: python servidor_rede_local.py         -> roda o fluxo HTTP contra as páginas sintéticas
+    #      python servidor_rede_local.py servir  -> só sobe o servidor (REDE_URL_BASE no log)
+    logger = Logger().get_logger("ServidorRedeLocal")
+    if len(sys.argv) > 1 and sys.argv[1] == "servir":
+        servidor = ServidorRedeLocal(porta=int(os.getenv("REDE_LOCAL_PORTA", 8765)))
+        logger.info(f"Servindo páginas sintéticas em {servidor.url_base}")
+        servidor.servidor.serve_forever()
+    else:
+        problemas = executar_fluxo(logger)
+        for problema in problemas:
+            logger.error(problema)
+        sys.exit(1 if problemas else 0)
@@ -0,0 +1,111 @@
+from itertools import product
+from logger import Logger
+from calculodameta import (
+    CalculoMetaLote, FAIXAS_LOJA, FAIXAS_GRUPO, FATOR_META, avaliar_faixas
+)
+
+
+def grade_cenarios(mix_minimo=None, fatores_valor=None, pcts=None, faixas=FAIXAS_LOJA):
+    # Produto cartesiano das variações sobre a tabela base; None mantém o valor da tabela.
+    # mix_minimo: limites de mix (substituem o 50% em todas as faixas que o usam)
+    # fatores_valor / pcts: uma tupla por variação, com um valor por faixa
+    cenarios = []
+    for mix, fatores, percentuais in product(mix_minimo or [None], fatores_valor or [None], pcts or [None]):
+        tabela = []
+        for k, faixa in enumerate(faixas):
+            nova = dict(faixa)
+            if mix is not None:
+                if nova["mix_minimo"] is not None:
+                    nova["mix_minimo"] = mix
+                if nova["mix_maximo"] is not None:
+                    nova["mix_maximo"] = mix
+            if fatores is not None:
+                nova["fator_valor"] = fatores[k]
+            if percentuais is not None:
+                nova["pct"] = percentuais[k]
+            tabela.append(nova)
+        cenarios.append({
+            "mix_minimo": mix,
+            "fatores_valor": fatores,
+            "pcts": percentuais,
+            "faixas_loja": tuple(tabela),
+        })
+    return cenarios
+
+
+# Simulação "e se?" das faixas de bonificação: carrega o histórico uma vez
+# (mesmas entradas do CalculoMetaLote) e avalia todos os cenários juntos, com
+# broadcast cenários × lojas × meses. Nada é gravado no banco.
+class SimuladorBonificacao:
+    def __init__(self, lojas, mes_inicio, mes_fim=None, armazenamento=None):
+        self.lote = CalculoMetaLote(lojas, mes_inicio, mes_fim, armazenamento=armazenamento)
+        self.lojas = self.lote.lojas
+        self.meses = self.lote.meses
+        self._dados = None
+        self._outras_lojas = None
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def carregar(self):
+        if self._dados is None:
+            try:
+                self._dados = self.lote.carregar_dados()
+                # Lojas fora da simulação entram no grupo pelas linhas gravadas, como no CalculoMetaLote
+                self._outras_lojas = self.lote.carregar_outras_lojas()
+            finally:
+                if self.lote._armazenamento_proprio:
+                    self.lote.armazenamento.fechar()
+        return self._dados
+
+    def simular(self, cenarios):
+        # cenarios: lista de dicts com "faixas_loja" (e opcionalmente "faixas_grupo"),
+        # como os gerados por grade_cenarios
+        dados = self.carregar()
+        venda = dados["venda"]
+        compra = dados["compra"]
+        skus_catalogo = dados["skus_catalogo"]
+        skus_comprados = dados["skus_comprados"]
+
+        perc_mix = self.lote._percentual(skus_comprados, skus_catalogo)
+        faixa, pct = avaliar_faixas(
+            compra, venda, perc_mix, [cenario["faixas_loja"] for cenario in cenarios]
+        )
+        bonificacao = compra * pct  # cenários × lojas × meses
+
+        outras = self._outras_lojas
+        total_meta = (venda * FATOR_META).sum(axis=0) + outras["metavalor"]
+        total_comprado = compra.sum(axis=0) + outras["metavalorbatido"]
+        perc_mix_grupo = self.lote._percentual(
+            skus_comprados.sum(axis=0) + outras["skumetamixcomprado"],
+            skus_catalogo.sum(axis=0) + outras["skumetamix"]
+        )
+        faixa_grupo, pct_grupo = avaliar_faixas(
+            total_comprado, total_meta, perc_mix_grupo,
+            [cenario.get("faixas_grupo", FAIXAS_GRUPO) for cenario in cenarios]
+        )
+
+        total = bonificacao.sum(axis=(1, 2))
+        self.logger.info(
+            f"{len(cenarios)} cenários simulados para lojas {self.lojas} "
+            f"de {self.lote.mes_inicio} a {self.lote.mes_fim}."
+        )
+        return {
+            "cenarios": cenarios,
+            "lojas": self.lojas,
+            "meses": self.meses,
+            "total": total,
+            "por_loja": bonificacao.sum(axis=2),
+            "por_mes": bonificacao.sum(axis=1),
+            "faixa_loja": faixa,
+            "faixa_grupo": faixa_grupo,
+            "pct_grupo": pct_grupo,
+        }
+
+
+if __name__ == "__main__":
+    simulador = SimuladorBonificacao(lojas=[1, 2, 3], mes_inicio="2024-06", mes_fim="2025-07")
+    cenarios = grade_cenarios(mix_minimo=[30, 40, 45, 50, 60])
+    resultado = simulador.simular(cenarios)
+    for cenario, total in zip(cenarios, resultado["total"]):
+        simulador.logger.info(f"Mix mínimo {cenario['mix_minimo']}%: R$ {total:,.2f}")
@@ -1,12 +1,13 @@
 import psycopg2
-import sqlite3
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 from logger import Logger  # importa o logger centralizado
+from meses import intervalo_datas, listar_meses
+from armazenamento import ArmazenamentoSQLite
 
 class VendasPorMes:
-    def __init__(self, id_loja, mes_referencia=None):
+    def __init__(self, id_loja, mes_referencia=None, pool=None, armazenamento=None):
         load_dotenv()
         self.id_loja = id_loja
 
@@ -22,6 +23,7 @@ class VendasPorMes:
         except Exception:
             raise ValueError("mes_referencia deve estar no formato 'YYYY-MM'")
 
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
         self.conn_pg = None
         self.cursor_pg = None
         self.conn_sqlite = None
@@ -32,71 +34,67 @@ class VendasPorMes:
         if not self.db_path:
             raise ValueError("Variável DB_LITE_PATH não configurada no .env")
 
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
         # Inicializa logger
         logger_config = Logger()
         self.logger = logger_config.get_logger(self.__class__.__name__)
 
     def conectar_postgres(self):
-        self.conn_pg = psycopg2.connect(
-            host=os.getenv("PG_HOST"),
-            port=os.getenv("PG_PORT"),
-            database=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD")
-        )
+        if self.pool:
+            self.conn_pg = self.pool.obter()
+        else:
+            self.conn_pg = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
         self.cursor_pg = self.conn_pg.cursor()
         self.logger.info(f"Conectado ao PostgreSQL para loja {self.id_loja}.")
 
     def conectar_sqlite(self):
-        self.conn_sqlite = sqlite3.connect(self.db_path)
+        self.conn_sqlite = self.armazenamento.conexao()
         self.cursor_sqlite = self.conn_sqlite.cursor()
 
-        self.cursor_sqlite.execute("""
-            CREATE TABLE IF NOT EXISTS vendas_por_mes (
-                id_loja INTEGER,
-                mes_referencia TEXT,
-                valor_venda REAL,
-                PRIMARY KEY (id_loja, mes_referencia)
-            )
-        """)
-        self.conn_sqlite.commit()
-
-        self.logger.info("Tabela vendas_por_mes criada/verificada no SQLite.")
-
     def buscar_vendas_pg(self):
         query = """
             SELECT
                 EXTRACT(MONTH FROM data) AS mes,
                 ROUND(SUM(subtotalimpressora - valordesconto + valoracrescimo), 2) as venda
             FROM pdv.venda
-            WHERE EXTRACT(YEAR FROM data) = %s
-              AND EXTRACT(MONTH FROM data) = %s
+            WHERE data >= %s
+              AND data < %s
               AND cancelado = false
               AND id_loja = %s
             GROUP BY EXTRACT(MONTH FROM data)
             ORDER BY mes;
         """
-        self.cursor_pg.execute(query, (self.ano, self.mes, self.id_loja))
+        data_ini, data_fim = intervalo_datas(self.mes_referencia)
+        self.cursor_pg.execute(query, (data_ini, data_fim, self.id_loja))
         resultado = self.cursor_pg.fetchall()
         self.logger.info(f"Buscadas vendas para loja {self.id_loja} em {self.mes_referencia}.")
         return resultado
 
     def salvar_sqlite(self, dados):
-        for mes_pg, venda in dados:
-            mes_pg_int = int(mes_pg) if mes_pg is not None else None
-            venda_float = float(venda) if venda is not None else 0.0
+        with self.armazenamento.transacao():
+            for mes_pg, venda in dados:
+                mes_pg_int = int(mes_pg) if mes_pg is not None else None
+                venda_float = float(venda) if venda is not None else 0.0
 
-            mes_referencia = f"{self.ano}-{mes_pg_int:02d}"
+                mes_referencia = f"{self.ano}-{mes_pg_int:02d}"
 
-            self.cursor_sqlite.execute("""
-                INSERT OR REPLACE INTO vendas_por_mes (id_loja, mes_referencia, valor_venda)
-                VALUES (?, ?, ?)
-            """, (
-                self.id_loja,
-                mes_referencia,
-                venda_float
-            ))
-        self.conn_sqlite.commit()
+                self.cursor_sqlite.execute("""
+                    INSERT OR REPLACE INTO vendas_por_mes (id_loja, mes_referencia, valor_venda)
+                    VALUES (?, ?, ?)
+                """, (
+                    self.id_loja,
+                    mes_referencia,
+                    venda_float
+                ))
         self.logger.info(f"Salvo SQLite para loja {self.id_loja} em {self.mes_referencia}.")
 
     def consultar_venda(self):
@@ -120,16 +118,140 @@ class VendasPorMes:
         if self.cursor_pg:
             self.cursor_pg.close()
         if self.conn_pg:
-            self.conn_pg.close()
+            if self.pool:
+                self.pool.devolver(self.conn_pg)
+            else:
+                self.conn_pg.close()
         if self.cursor_sqlite:
             self.cursor_sqlite.close()
-        if self.conn_sqlite:
-            self.conn_sqlite.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
         self.logger.info(f"Conexões fechadas para loja {self.id_loja}.")
 
 
+# Extrai as vendas de várias lojas e vários meses numa única varredura de pdv.venda
+class VendasPorMesLote:
+    def __init__(self, lojas, mes_inicio, mes_fim=None, pool=None, armazenamento=None):
+        load_dotenv()
+        self.lojas = list(lojas)
+        if not self.lojas:
+            raise ValueError("Informe ao menos uma loja")
+
+        self.mes_inicio = mes_inicio
+        self.mes_fim = mes_fim or mes_inicio
+        self.meses = listar_meses(self.mes_inicio, self.mes_fim)
+        self.data_ini, self.data_fim = intervalo_datas(self.mes_inicio, self.mes_fim)
+
+        self.pool = pool  # PoolPostgres compartilhado (opcional)
+        self.conn_pg = None
+        self.cursor_pg = None
+        self.conn_sqlite = None
+        self.cursor_sqlite = None
+
+        self.db_path = os.getenv("DB_LITE_PATH")
+        if not self.db_path:
+            raise ValueError("Variável DB_LITE_PATH não configurada no .env")
+
+        # Camada SQLite compartilhada (WAL); sem ela a classe abre a sua própria
+        self.armazenamento = armazenamento or ArmazenamentoSQLite(self.db_path)
+        self._armazenamento_proprio = armazenamento is None
+
+        logger_config = Logger()
+        self.logger = logger_config.get_logger(self.__class__.__name__)
+
+    def conectar_postgres(self):
+        if self.pool:
+            self.conn_pg = self.pool.obter()
+        else:
+            self.conn_pg = psycopg2.connect(
+                host=os.getenv("PG_HOST"),
+                port=os.getenv("PG_PORT"),
+                database=os.getenv("PG_DB"),
+                user=os.getenv("PG_USER"),
+                password=os.getenv("PG_PASSWORD")
+            )
+        self.cursor_pg = self.conn_pg.cursor()
+        self.logger.info(f"Conectado ao PostgreSQL para lojas {self.lojas}.")
+
+    def conectar_sqlite(self):
+        self.conn_sqlite = self.armazenamento.conexao()
+        self.cursor_sqlite = self.conn_sqlite.cursor()
+
+    def buscar_vendas_pg(self):
+        # Filtro por intervalo em "data" (sem EXTRACT) para permitir uso de índice
+        query = """
+            SELECT
+                id_loja,
+                DATE_TRUNC('month', data)::date AS mes,
+                ROUND(SUM(subtotalimpressora - valordesconto + valoracrescimo), 2) AS venda
+            FROM pdv.venda
+            WHERE data >= %s
+              AND data < %s
+              AND cancelado = false
+              AND id_loja = ANY(%s)
+            GROUP BY id_loja, DATE_TRUNC('month', data)
+            ORDER BY id_loja, mes;
+        """
+        self.cursor_pg.execute(query, (self.data_ini, self.data_fim, self.lojas))
+        resultado = self.cursor_pg.fetchall()
+        self.logger.info(
+            f"Buscadas {len(resultado)} linhas de vendas para lojas {self.lojas} "
+            f"entre {self.mes_inicio} e {self.mes_fim}."
+        )
+        return resultado
+
+    def salvar_sqlite(self, dados):
+        registros = [
+            (int(id_loja), mes.strftime("%Y-%m"), float(venda) if venda is not None else 0.0)
+            for id_loja, mes, venda in dados
+        ]
+
+        # Uma única transação para todas as lojas/meses
+        with self.armazenamento.transacao():
+            self.cursor_sqlite.executemany("""
+                INSERT OR REPLACE INTO vendas_por_mes (id_loja, mes_referencia, valor_venda)
+                VALUES (?, ?, ?)
+            """, registros)
+        self.logger.info(f"Salvos {len(registros)} registros de vendas no SQLite.")
+        return len(registros)
+
+    def consultar_vendas(self):
+        try:
+            self.conectar_postgres()
+            self.conectar_sqlite()
+
+            dados = self.buscar_vendas_pg()
+            if dados:
+                self.salvar_sqlite(dados)
+
+            encontrados = {(int(id_loja), mes.strftime("%Y-%m")) for id_loja, mes, _ in dados}
+            for loja in self.lojas:
+                for mes in self.meses:
+                    if (loja, mes) not in encontrados:
+                        self.logger.info(f"Sem vendas encontradas para loja {loja} em {mes}.")
+
+            self.logger.info(f"Processo finalizado para lojas {self.lojas} entre {self.mes_inicio} e {self.mes_fim}.")
+        except Exception as e:
+            self.logger.error(f"Erro para lojas {self.lojas}: {e}")
+            # Propaga para o agendador ignorar as etapas que dependem das vendas
+            raise
+        finally:
+            self.fechar_conexoes()
+
+    def fechar_conexoes(self):
+        if self.cursor_pg:
+            self.cursor_pg.close()
+        if self.conn_pg:
+            if self.pool:
+                self.pool.devolver(self.conn_pg)
+            else:
+                self.conn_pg.close()
+        if self.cursor_sqlite:
+            self.cursor_sqlite.close()
+        if self._armazenamento_proprio:
+            self.armazenamento.fechar()
+        self.logger.info(f"Conexões fechadas para lojas {self.lojas}.")
+
+
 if __name__ == "__main__":
-    lojas = [1, 2, 3]
-    for loja in lojas:
-        vp = VendasPorMes(id_loja=loja, mes_referencia="2025-06")
-        vp.consultar_venda()
+    VendasPorMesLote(lojas=[1, 2, 3], mes_inicio="2024-01", mes_fim="2025-06").consultar_vendas()
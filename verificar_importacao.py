@@ -0,0 +1,77 @@
+import os
+import re
+import sys
+import subprocess
+
+# Módulos que o caminho de extração não pode carregar: só o relatório e a meta precisam deles
+PROIBIDOS = ("matplotlib", "weasyprint", "jinja2", "numpy")
+
+# Linha do -X importtime: "import time: <self us> | <cumulativo us> | <indentação><módulo>"
+PADRAO_LINHA = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+def medir_importacao(modulo):
+    # Importa o módulo num interpretador limpo e devolve [(modulo, nivel, cumulativo_us)]
+    # só da subárvore do módulo, terminando na linha do próprio módulo
+    processo = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    medicoes = []
+    erros = []
+    for linha in processo.stderr.splitlines():
+        encontrado = PADRAO_LINHA.match(linha)
+        if encontrado:
+            _, cumulativo, indentacao, nome = encontrado.groups()
+            medicoes.append((nome, (len(indentacao) - 1) // 2, int(cumulativo)))
+        elif not linha.startswith("import time:"):
+            erros.append(linha)
+    if processo.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {modulo}:\n" + "\n".join(erros))
+
+    # A saída vem em pós-ordem: a subárvore do módulo são as linhas logo antes da
+    # sua linha de nível 0, até a linha de nível 0 anterior (site, encodings...)
+    fim = max(i for i, (nome, nivel, _) in enumerate(medicoes) if nome == modulo and nivel == 0)
+    inicio = fim
+    while inicio > 0 and medicoes[inicio - 1][1] > 0:
+        inicio -= 1
+    return medicoes[inicio:fim + 1]
+
+
+def verificar(modulo="main", limite_ms=None):
+    # Devolve (problemas, total_ms, mais_lentos); problemas vazia quando o orçamento
+    # foi respeitado e mais_lentos com os 10 imports diretos mais caros
+    limite_ms = limite_ms if limite_ms is not None else float(os.getenv("IMPORTACAO_LIMITE_MS", "1000"))
+    medicoes = medir_importacao(modulo)
+
+    problemas = []
+    carregados = sorted({nome.split(".")[0] for nome, _, _ in medicoes} & set(PROIBIDOS))
+    if carregados:
+        problemas.append(f"{modulo} carrega dependências do relatório/meta: {', '.join(carregados)}")
+
+    total_ms = medicoes[-1][2] / 1000
+    if total_ms > limite_ms:
+        problemas.append(f"import {modulo} levou {total_ms:.0f} ms (limite {limite_ms:.0f} ms)")
+
+    mais_lentos = sorted((m for m in medicoes if m[1] == 1), key=lambda m: m[2], reverse=True)[:10]
+    return problemas, total_ms, [(nome, cumulativo / 1000) for nome, _, cumulativo in mais_lentos]
+
+
+if __name__ == "__main__":
+    # Uso: python verificar_importacao.py [modulo] [limite_ms]
+    modulo = sys.argv[1] if len(sys.argv) > 1 else "main"
+    limite = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    try:
+        problemas, total_ms, mais_lentos = verificar(modulo, limite)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(2)
+    limite_ms = limite if limite is not None else float(os.getenv("IMPORTACAO_LIMITE_MS", "1000"))
+    print(f"import {modulo}: {total_ms:.0f} ms (limite {limite_ms:.0f} ms)")
+    for nome, ms in mais_lentos:
+        print(f"  {ms:8.1f} ms  {nome}")
+    for problema in problemas:
+        print(f"FALHA: {problema}")
+    sys.exit(1 if problemas else 0)